@@ -1,8 +1,13 @@
+import json
 import os
 from pathlib import Path
+from typing import Optional
 
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq, DefaultAsyncHttpxClient
+
+from LLM.llm_gateway import CircuitBreaker, LLMEndpoint, LLMGateway
 
 
 class Environment:
@@ -14,8 +19,84 @@ class Environment:
             load_dotenv(env_file_location)
         self.onc_token = os.getenv("ONC_TOKEN")
         self.location_code = os.getenv("CAMBRIDGE_LOCATION_CODE")
-        self.model = "llama-3.3-70b-versatile"
-        self.client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+        # Max number of Groq completions a single worker will have in flight at once
+        self.max_concurrent_llm_calls = int(
+            os.getenv("GROQ_MAX_CONCURRENT_REQUESTS", "16")
+        )
+        # JSON list of {"name", "base_url", "api_key_env", "model"} endpoints, when set
+        # completions go through a gateway that hedges and fails over between them
+        endpoints = os.getenv("LLM_ENDPOINTS")
+        if endpoints:
+            self.async_client = self.create_llm_gateway(json.loads(endpoints))
+        else:
+            # One pooled HTTP client shared by every conversation so connections are reused
+            self.async_client = self.create_async_client(os.getenv("GROQ_API_KEY"))
+        # JSON object of per-route overrides, e.g. {"conversational": {"model": "...",
+        # "max_completion_tokens": 512}}, routes are listed in LLM/model_router.py
+        self.model_routes = json.loads(os.getenv("MODEL_ROUTES", "{}"))
+        # Completions seen on a route before its max_completion_tokens adapts to them
+        self.model_routing_min_samples = int(
+            os.getenv("MODEL_ROUTING_MIN_SAMPLES", "50")
+        )
+        self.model_routing_headroom = float(os.getenv("MODEL_ROUTING_HEADROOM", "1.5"))
+        # Seconds to wait on a single read-only ONC tool before giving up on it
+        self.tool_timeout = float(os.getenv("TOOL_CALL_TIMEOUT_SECONDS", "20"))
+        # Semantic answer cache for repeated first-turn questions
+        self.semantic_cache_enabled = (
+            os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+        )
+        self.semantic_cache_threshold = float(
+            os.getenv("SEMANTIC_CACHE_SIMILARITY_THRESHOLD", "0.95")
+        )
+        self.semantic_cache_ttl = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+        self.semantic_cache_max_entries = int(
+            os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512")
+        )
+        # ONC tool result cache, windows older than the settle days never expire
+        self.tool_cache_enabled = (
+            os.getenv("TOOL_CACHE_ENABLED", "true").lower() == "true"
+        )
+        self.tool_cache_max_entries = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "1024"))
+        self.tool_cache_recent_ttl = float(
+            os.getenv("TOOL_CACHE_RECENT_TTL_SECONDS", "600")
+        )
+        self.tool_cache_settle_days = int(os.getenv("TOOL_CACHE_SETTLE_DAYS", "2"))
+        # In-memory LRU of Jina query embeddings, optionally backed by a SQLite file
+        self.query_embedding_cache_enabled = (
+            os.getenv("QUERY_EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+        )
+        self.query_embedding_cache_max_entries = int(
+            os.getenv("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", "2048")
+        )
+        self.query_embedding_cache_path = os.getenv("QUERY_EMBEDDING_CACHE_PATH")
+        # Concurrent identical first-turn questions share one pipeline run
+        self.single_flight_enabled = (
+            os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+        )
+        # "local" uses the embedding classifier for follow-ups, "llm" asks Groq yes/no
+        self.context_check_mode = os.getenv("CONTEXT_CHECK_MODE", "local").lower()
+        self.context_similarity_threshold = float(
+            os.getenv("CONTEXT_SIMILARITY_THRESHOLD", "0.5")
+        )
+        # Send only the top-k tool schemas most similar to the prompt with tool selection,
+        # plus any other tool at or above the minimum similarity
+        self.tool_retrieval_enabled = (
+            os.getenv("TOOL_RETRIEVAL_ENABLED", "true").lower() == "true"
+        )
+        self.tool_retrieval_top_k = int(os.getenv("TOOL_RETRIEVAL_TOP_K", "4"))
+        self.tool_retrieval_min_similarity = float(
+            os.getenv("TOOL_RETRIEVAL_MIN_SIMILARITY", "0.25")
+        )
+        # Upper bound on prompt tokens per Groq call, counted with the Llama 3.3 tokenizer
+        self.max_prompt_tokens = int(os.getenv("PROMPT_MAX_TOKENS", "8000"))
+        # Comma separated tools answered from a template instead of a second LLM call,
+        # unset means every tool that has a renderer
+        rendered_tools = os.getenv("TEMPLATE_RENDERED_TOOLS")
+        self.template_rendered_tools = (
+            None
+            if rendered_tools is None
+            else {name.strip() for name in rendered_tools.split(",") if name.strip()}
+        )
         self.qdrant_url = os.getenv("QDRANT_URL")
         self.QA_collection_name = os.getenv("QDRANT_QA_COLLECTION_NAME")
         self.general_collection_name = os.getenv("QDRANT_GENERAL_COLLECTION_NAME")
@@ -23,6 +104,93 @@ class Environment:
             "QDRANT_FUNCTION_CALLING_COLLECTION_NAME"
         )
         self.qdrant_api_key = os.getenv("QDRANT_API_KEY")
+        # Async Qdrant client: pooled connections, a default timeout for every call
+        # (uploads included) and a shorter one for the searches on the chat path
+        self.qdrant_max_connections = int(os.getenv("QDRANT_MAX_CONNECTIONS", "20"))
+        self.qdrant_timeout = float(os.getenv("QDRANT_TIMEOUT_SECONDS", "30"))
+        self.qdrant_search_timeout = float(
+            os.getenv("QDRANT_SEARCH_TIMEOUT_SECONDS", "5")
+        )
+        # JSON object of per-collection vector formats, e.g. {"general": {"dimensions":
+        # 512, "storage": "int8"}}, see LLM/vector_format.py. Collections must be rebuilt
+        # in the format first with LLM/migrate_vector_format.py
+        self.vector_formats = json.loads(os.getenv("VECTOR_FORMATS", "{}"))
+        # "torch" runs bge-reranker-base through sentence-transformers, "onnx" runs an
+        # int8-quantized ONNX export of it (exported into RERANKER_ONNX_DIR on first start)
+        self.reranker_backend = os.getenv("RERANKER_BACKEND", "torch").lower()
+        self.reranker_onnx_dir = os.getenv("RERANKER_ONNX_DIR") or str(
+            Path(__file__).resolve().parent / "models" / "bge-reranker-base-int8"
+        )
+        # Question + document tokens scored per pair, longer documents are truncated
+        self.reranker_max_tokens = int(os.getenv("RERANKER_MAX_TOKENS", "512"))
+        self.reranker_batch_size = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+        # JSON object of per-collection reranking overrides, e.g. {"function_calling":
+        # {"skip_margin": 0.08}}, fields and defaults are in LLM/rerank_policy.py
+        self.rerank_policies = json.loads(os.getenv("RERANK_POLICIES", "{}"))
+        # Fraction of skipped or shrunk reranks also reranked in full to measure quality
+        self.rerank_audit_rate = float(os.getenv("RERANK_AUDIT_RATE", "0"))
+        # In-process copy of the general and function-calling collections for exact local
+        # search, re-checked against Qdrant every VECTOR_INDEX_MIRROR_REFRESH_SECONDS and
+        # bypassed once older than VECTOR_INDEX_MIRROR_MAX_STALENESS_SECONDS
+        self.vector_index_mirror_enabled = (
+            os.getenv("VECTOR_INDEX_MIRROR_ENABLED", "false").lower() == "true"
+        )
+        self.vector_index_mirror_refresh_seconds = float(
+            os.getenv("VECTOR_INDEX_MIRROR_REFRESH_SECONDS", "60")
+        )
+        self.vector_index_mirror_max_staleness_seconds = float(
+            os.getenv("VECTOR_INDEX_MIRROR_MAX_STALENESS_SECONDS", "300")
+        )
+        # Collections with more points than this stay remote only
+        self.vector_index_mirror_max_points = int(
+            os.getenv("VECTOR_INDEX_MIRROR_MAX_POINTS", "50000")
+        )
+
+    def create_async_client(
+        self, api_key: Optional[str], base_url: Optional[str] = None, max_retries=2
+    ) -> AsyncGroq:
+        return AsyncGroq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=max_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrent_llm_calls,
+                    max_keepalive_connections=self.max_concurrent_llm_calls,
+                )
+            ),
+        )
+
+    def create_llm_gateway(self, endpoint_configs: list[dict]) -> LLMGateway:
+        failure_threshold = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "3"))
+        reset_seconds = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+        endpoints = []
+        for config in endpoint_configs:
+            api_key_env = config.get("api_key_env", "GROQ_API_KEY")
+            api_key = os.getenv(api_key_env)
+            if not api_key:
+                raise ValueError(
+                    f"LLM endpoint {config['name']} needs {api_key_env}, which is not set"
+                )
+            endpoints.append(
+                LLMEndpoint(
+                    name=config["name"],
+                    # The gateway fails over instead of the client retrying the same endpoint
+                    client=self.create_async_client(
+                        api_key, base_url=config.get("base_url"), max_retries=0
+                    ),
+                    model=config.get("model"),
+                    breaker=CircuitBreaker(failure_threshold, reset_seconds),
+                )
+            )
+        return LLMGateway(
+            endpoints,
+            hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+            initial_hedge_delay=float(
+                os.getenv("LLM_HEDGE_INITIAL_DELAY_SECONDS", "2")
+            ),
+            max_hedges=int(os.getenv("LLM_MAX_HEDGES", "1")),
+        )
 
     def get_onc_token(self):
         return self.onc_token
@@ -30,11 +198,80 @@ class Environment:
     def get_location_code(self):
         return self.location_code
 
-    def get_model(self):
-        return self.model
+    def get_model_routes(self):
+        return self.model_routes
+
+    def get_model_routing_min_samples(self):
+        return self.model_routing_min_samples
+
+    def get_model_routing_headroom(self):
+        return self.model_routing_headroom
+
+    def get_async_client(self):
+        return self.async_client
+
+    def get_max_concurrent_llm_calls(self):
+        return self.max_concurrent_llm_calls
+
+    def get_tool_timeout(self):
+        return self.tool_timeout
+
+    def get_semantic_cache_enabled(self):
+        return self.semantic_cache_enabled
+
+    def get_semantic_cache_threshold(self):
+        return self.semantic_cache_threshold
 
-    def get_client(self):
-        return self.client
+    def get_semantic_cache_ttl(self):
+        return self.semantic_cache_ttl
+
+    def get_semantic_cache_max_entries(self):
+        return self.semantic_cache_max_entries
+
+    def get_tool_cache_enabled(self):
+        return self.tool_cache_enabled
+
+    def get_tool_cache_max_entries(self):
+        return self.tool_cache_max_entries
+
+    def get_tool_cache_recent_ttl(self):
+        return self.tool_cache_recent_ttl
+
+    def get_tool_cache_settle_days(self):
+        return self.tool_cache_settle_days
+
+    def get_query_embedding_cache_enabled(self):
+        return self.query_embedding_cache_enabled
+
+    def get_query_embedding_cache_max_entries(self):
+        return self.query_embedding_cache_max_entries
+
+    def get_query_embedding_cache_path(self):
+        return self.query_embedding_cache_path
+
+    def get_single_flight_enabled(self):
+        return self.single_flight_enabled
+
+    def get_context_check_mode(self):
+        return self.context_check_mode
+
+    def get_context_similarity_threshold(self):
+        return self.context_similarity_threshold
+
+    def get_tool_retrieval_enabled(self):
+        return self.tool_retrieval_enabled
+
+    def get_tool_retrieval_top_k(self):
+        return self.tool_retrieval_top_k
+
+    def get_tool_retrieval_min_similarity(self):
+        return self.tool_retrieval_min_similarity
+
+    def get_max_prompt_tokens(self):
+        return self.max_prompt_tokens
+
+    def get_template_rendered_tools(self):
+        return self.template_rendered_tools
 
     def get_qdrant_url(self):
         return self.qdrant_url
@@ -50,3 +287,49 @@ class Environment:
 
     def get_qdrant_api_key(self):
         return self.qdrant_api_key
+
+    def get_qdrant_max_connections(self):
+        return self.qdrant_max_connections
+
+    def get_qdrant_timeout(self):
+        return self.qdrant_timeout
+
+    def get_qdrant_search_timeout(self):
+        return self.qdrant_search_timeout
+
+    def get_vector_formats(self):
+        return self.vector_formats
+
+    def get_reranker_backend(self):
+        return self.reranker_backend
+
+    def get_reranker_onnx_dir(self):
+        return self.reranker_onnx_dir
+
+    def get_reranker_max_tokens(self):
+        return self.reranker_max_tokens
+
+    def get_reranker_batch_size(self):
+        return self.reranker_batch_size
+
+    def get_rerank_policies(self):
+        return self.rerank_policies
+
+    def get_rerank_audit_rate(self):
+        return self.rerank_audit_rate
+
+    def get_vector_index_mirror_enabled(self):
+        return self.vector_index_mirror_enabled
+
+    def get_vector_index_mirror_refresh_seconds(self):
+        return self.vector_index_mirror_refresh_seconds
+
+    def get_vector_index_mirror_max_staleness_seconds(self):
+        return self.vector_index_mirror_max_staleness_seconds
+
+    def get_vector_index_mirror_max_points(self):
+        return self.vector_index_mirror_max_points
+
+    async def close(self):
+        """Closes the pooled async HTTP connections on app shutdown"""
+        await self.async_client.close()
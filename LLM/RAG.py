@@ -1,46 +1,161 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
 from uuid import uuid4
 
+import httpx
 import pandas as pd
 from langchain.embeddings.base import Embeddings
-from langchain.retrievers.document_compressors import CrossEncoderReranker
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder
-from langchain_community.vectorstores import Qdrant
 from langchain_core.documents import Document
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.http.models import PointStruct
 from sentence_transformers import SentenceTransformer
 
+from LLM.embedding_cache import QueryEmbeddingCache
 from LLM.Environment import Environment
+from LLM.onnx_reranker import RERANKER_MODEL_NAME
+from LLM.prompt_budget import get_token_counter
+from LLM.rerank_policy import (
+    SHRINK,
+    SKIP,
+    RerankMonitor,
+    policies_from_overrides,
+)
+from LLM.timing import stage
+from LLM.vector_format import VectorFormat, formats_from_overrides
+from LLM.vector_index import VectorIndexMirror
+
+JINA_MODEL_NAME = "jinaai/jina-embeddings-v3"
 
 
 class JinaEmbeddings(Embeddings):
-    def __init__(self, task="retrieval.passage"):
+    def __init__(
+        self,
+        task="retrieval.passage",
+        query_cache: Optional[QueryEmbeddingCache] = None,
+    ):
         print("Creating Jina Embeddings instance...")
-        self.model = SentenceTransformer(
-            "jinaai/jina-embeddings-v3", trust_remote_code=True
-        )
+        self.model = SentenceTransformer(JINA_MODEL_NAME, trust_remote_code=True)
         print("Jina Embeddings instance created.")
         self.task = task
+        # Repeated questions skip the model, see QueryEmbeddingCache
+        self.query_cache = query_cache
 
     def embed_documents(self, texts):
         return self.model.encode(texts, task=self.task, prompt_name=self.task)
 
-    def embed_query(self, text):
+    def encode_query(self, text):
         return self.model.encode(
             [text], task="retrieval.query", prompt_name="retrieval.query"
         )[0]
 
+    def embed_query(self, text):
+        if self.query_cache is None:
+            return self.encode_query(text)
+        return self.query_cache.get_or_compute(
+            text, "retrieval.query", self.encode_query
+        )
+
+
+def create_reranker(env: Environment):
+    """The bge cross-encoder on the backend picked by RERANKER_BACKEND"""
+    if env.get_reranker_backend() == "onnx":
+        # onnxruntime is only needed, and imported, when this backend is picked
+        from LLM.onnx_reranker import (
+            QUANTIZED_MODEL_FILE,
+            OnnxCrossEncoder,
+            export_quantized,
+        )
+
+        model_dir = Path(env.get_reranker_onnx_dir())
+        if not (model_dir / QUANTIZED_MODEL_FILE).exists():
+            print(f"Exporting int8 ONNX reranker to {model_dir}...")
+            export_quantized(RERANKER_MODEL_NAME, model_dir)
+        print("Creating ONNX CrossEncoder model...")
+        return OnnxCrossEncoder(
+            str(model_dir),
+            max_length=env.get_reranker_max_tokens(),
+            batch_size=env.get_reranker_batch_size(),
+        )
+    print("Creating CrossEncoder model...")
+    return HuggingFaceCrossEncoder(
+        model_name=RERANKER_MODEL_NAME,
+        model_kwargs={"max_length": env.get_reranker_max_tokens()},
+    )
+
+
+@dataclass(slots=True)
+class RetrievedDocument:
+    content: str
+    source: str
+    point_id: str
+    # Vector similarity, None for points fetched by id
+    score: Optional[float] = None
+
+    @classmethod
+    def from_point(cls, point, score: Optional[float] = None) -> "RetrievedDocument":
+        return cls(
+            content=point.payload["text"],
+            source=point.payload.get("source", "unknown"),
+            point_id=point.id,
+            score=score,
+        )
+
+
+def format_documents(documents: list[RetrievedDocument]) -> str:
+    """
+    Retrieved documents as prompt context, separated by blank lines. Each run of
+    documents from the same source is introduced by one "Source:" line.
+    """
+    blocks = []
+    previous_source = None
+    for document in documents:
+        content = document.content.strip()
+        if document.source != previous_source:
+            content = f"Source: {document.source}\n{content}"
+            previous_source = document.source
+        blocks.append(content)
+    return "\n\n".join(blocks)
+
 
 class QdrantClientWrapper:
     def __init__(self, env: Environment):
+        # Blocking client for code that runs off the event loop (e.g. the scheduled vector DB upload)
         self.qdrant_client = QdrantClient(
             url=env.get_qdrant_url(), api_key=env.get_qdrant_api_key()
         )
+        # Pooled client for chat retrieval, feedback and admin ingestion, which run on the event loop
+        self.async_qdrant_client = AsyncQdrantClient(
+            url=env.get_qdrant_url(),
+            api_key=env.get_qdrant_api_key(),
+            timeout=env.get_qdrant_timeout(),
+            limits=httpx.Limits(
+                max_connections=env.get_qdrant_max_connections(),
+                max_keepalive_connections=env.get_qdrant_max_connections(),
+            ),
+            # The blocking client above already checked the server version
+            check_compatibility=False,
+        )
+        # Retrieval gives up on a single search sooner than ingestion gives up on an upload
+        self.search_timeout = env.get_qdrant_search_timeout()
         self.general_collection_name = env.get_general_collection_name()
         self.function_calling_collection_name = (
             env.get_function_calling_collection_name()
         )
         self.QA_collection_name = env.get_QA_collection_name()
+        # How each collection stores its vectors, uploads and searches follow it
+        formats = formats_from_overrides(env.get_vector_formats())
+        self.vector_formats = {
+            collection_name: formats.get(name, VectorFormat())
+            for name, collection_name in (
+                ("general", self.general_collection_name),
+                ("function_calling", self.function_calling_collection_name),
+                ("qa", self.QA_collection_name),
+            )
+        }
 
 
 class RAG:
@@ -50,6 +165,9 @@ class RAG:
     ):
         self.qdrant_client_wrapper = QdrantClientWrapper(env)
         self.qdrant_client = self.qdrant_client_wrapper.qdrant_client
+        self.async_qdrant_client = self.qdrant_client_wrapper.async_qdrant_client
+        self.search_timeout = self.qdrant_client_wrapper.search_timeout
+        self.vector_formats = self.qdrant_client_wrapper.vector_formats
 
         self.general_collection_name = (
             self.qdrant_client_wrapper.general_collection_name
@@ -58,135 +176,279 @@ class RAG:
         self.function_calling_collection_name = (
             self.qdrant_client_wrapper.function_calling_collection_name
         )
-        self.embedding = JinaEmbeddings()
-        self.k = 20
-
-        self.qdrant = Qdrant(
-            client=self.qdrant_client,
-            collection_name=self.general_collection_name,
-            embeddings=self.embedding,
-            content_payload_key="text",
+        self.embedding = JinaEmbeddings(
+            query_cache=QueryEmbeddingCache(
+                JINA_MODEL_NAME,
+                max_entries=env.get_query_embedding_cache_max_entries(),
+                persist_path=env.get_query_embedding_cache_path() or None,
+            )
+            if env.get_query_embedding_cache_enabled()
+            else None
         )
+        self.token_counter = get_token_counter()
         # Reranker (from RerankerNoGroq notebook)
-        print("Creating CrossEncoder model...")
-        self.model = HuggingFaceCrossEncoder(model_name="BAAI/bge-reranker-base")
-        self.compressor = CrossEncoderReranker(model=self.model, top_n=15)
+        self.model = create_reranker(env)
+        # Per collection k, min_score, top_n and when to skip or shrink reranking
+        self.rerank_policies = policies_from_overrides(env.get_rerank_policies())
+        self.rerank_monitor = RerankMonitor(audit_rate=env.get_rerank_audit_rate())
+        # Local exact search over the retrieval collections while the copy is fresh
+        self.index_mirror = (
+            VectorIndexMirror(
+                self.async_qdrant_client,
+                [self.general_collection_name, self.function_calling_collection_name],
+                refresh_seconds=env.get_vector_index_mirror_refresh_seconds(),
+                max_staleness_seconds=env.get_vector_index_mirror_max_staleness_seconds(),
+                max_points=env.get_vector_index_mirror_max_points(),
+            )
+            if env.get_vector_index_mirror_enabled()
+            else None
+        )
+
+    async def start(self):
+        """Loads the vector index mirror, if enabled, on app startup"""
+        if self.index_mirror is not None:
+            await self.index_mirror.start()
+
+    async def collection_changed(self, collection_name: str):
+        """Called after this process writes to a collection, so the mirror stops serving it until it reloads"""
+        if self.index_mirror is not None:
+            self.index_mirror.mark_stale(collection_name)
 
-    def get_documents(self, question: str, previous_points: list[str]):
-        query_embedding = self.embedding.embed_query(question)
-        (general_results, general_point_ids) = self.get_documents_helper(
+    async def get_documents(
+        self, question: str, previous_points: list[str], query_embedding=None
+    ) -> tuple[list[RetrievedDocument], list[str]]:
+        """
+        The general documents and the function-calling document for the question, and the
+        point ids of the function-calling document (kept on the conversation, so a
+        follow-up can reuse it when nothing scores above the threshold)
+        """
+        # Callers that already embedded the question (e.g. for the answer cache) pass it in
+        if query_embedding is None:
+            with stage("query_embedding"):
+                query_embedding = await asyncio.to_thread(
+                    self.embedding.embed_query, question
+                )
+        general_policy = self.rerank_policies["general"]
+        function_calling_policy = self.rerank_policies["function_calling"]
+        general_hits, function_calling_hits = await self.search_collections(
             query_embedding,
+            [self.general_collection_name, self.function_calling_collection_name],
+            [general_policy.k, function_calling_policy.k],
+        )
+        # The cross-encoder is blocking, keep it off the event loop
+        ranked = await asyncio.to_thread(
+            self.rerank,
             question,
-            self.general_collection_name,
-            min_score=0.4,
-            max_returns=10,
-        )
-
-        (function_calling_results, function_calling_point_ids) = (
-            self.get_documents_helper(
-                query_embedding,
-                question,
-                self.function_calling_collection_name,
-                min_score=0.375,
-                max_returns=1,
-                previous_points=previous_points,
+            {
+                "general": self.hits_to_documents(
+                    general_hits, min_score=general_policy.min_score
+                ),
+                "function_calling": self.hits_to_documents(
+                    function_calling_hits, min_score=function_calling_policy.min_score
+                ),
+            },
+        )
+        general_results = self.select_documents(ranked["general"], max_returns=10)
+        if ranked["function_calling"]:
+            function_calling_results = self.select_documents(
+                ranked["function_calling"], max_returns=1
             )
+        else:
+            function_calling_results = await self.previous_point_documents(
+                self.function_calling_collection_name, previous_points
+            )
+        return (
+            general_results + function_calling_results,
+            [document.point_id for document in function_calling_results],
         )
-        all_results = general_results._append(function_calling_results)
-        return (all_results, function_calling_point_ids)
 
-    def get_documents_helper(
-        self,
-        query_embedding,
-        question: str,
-        collection_name: str,
-        min_score: float = 0.4,
-        max_returns: int = 1,
-        previous_points: list[str] = [],
-    ):
-        search_results = self.qdrant_client.search(
-            collection_name=collection_name,
-            query_vector=query_embedding,
-            limit=self.k,  # same as k in retriever
-            with_payload=True,
-            with_vectors=False,
-        )
-        search_results = [hit for hit in search_results if hit.score >= min_score]
-
-        documents = [
-            Document(
-                page_content=hit.payload["text"],
-                metadata={
-                    "score": hit.score,
-                    "source": hit.payload.get("source", "unknown"),
-                    "point_id": hit.id,
-                },
+    async def search_collections(
+        self, query_embedding, collection_names: list[str], limits: list[int]
+    ) -> list[list]:
+        """
+        Searches every collection at once, so retrieval waits one round trip instead of
+        one per collection (Qdrant's batch search can't span collections). Collections
+        the index mirror holds a fresh copy of are searched locally instead.
+        """
+        query_vectors = [
+            self.vector_format(collection_name).truncate(query_embedding)
+            for collection_name in collection_names
+        ]
+        local_results = [
+            self.index_mirror.search(collection_name, query_vector, limit)
+            if self.index_mirror is not None
+            else None
+            for collection_name, query_vector, limit in zip(
+                collection_names, query_vectors, limits
             )
-            for hit in search_results
         ]
+        if all(results is not None for results in local_results):
+            return local_results
+        with stage("qdrant_search"):
+            return await asyncio.gather(
+                *[
+                    self.local_or_remote_search(
+                        results, collection_name, query_vector, limit
+                    )
+                    for results, collection_name, query_vector, limit in zip(
+                        local_results, collection_names, query_vectors, limits
+                    )
+                ]
+            )
 
-        # No documents were above threshold
-        if documents == []:
-            if previous_points:
-                previous_point_search = self.qdrant_client.retrieve(
-                    collection_name=collection_name,
-                    ids=previous_points,
-                    with_payload=True,
-                )
-                # Get only most recent result from previous data points
-                prev_df = pd.DataFrame(
-                    [
-                        {
-                            "contents": previous_point_search[0].payload["text"],
-                            "sources": previous_point_search[0].payload.get(
-                                "source", "unknown"
-                            ),
-                            "point_ids": previous_point_search[0].id,
-                        }
-                    ]
-                )
-                return (prev_df, prev_df["point_ids"])
-            return (pd.DataFrame({"contents": []}), [])
+    def vector_format(self, collection_name: str) -> VectorFormat:
+        return self.vector_formats.get(collection_name, VectorFormat())
 
-        # Rerank using the CrossEncoderReranker
-        reranked_documents = self.compressor.compress_documents(
-            documents, query=question
+    async def local_or_remote_search(
+        self, local_results, collection_name: str, query_vector, limit: int
+    ) -> list:
+        if local_results is not None:
+            return local_results
+        return await asyncio.wait_for(
+            self.async_qdrant_client.search(
+                collection_name=collection_name,
+                query_vector=query_vector,
+                limit=limit,
+                with_payload=True,
+                with_vectors=False,
+                search_params=self.vector_format(collection_name).search_params(),
+            ),
+            timeout=self.search_timeout,
         )
 
+    @staticmethod
+    def hits_to_documents(search_results, min_score: float) -> list[RetrievedDocument]:
+        return [
+            RetrievedDocument.from_point(hit, hit.score)
+            for hit in search_results
+            if hit.score >= min_score
+        ]
+
+    def rerank(
+        self, question: str, document_groups: dict[str, list[RetrievedDocument]]
+    ) -> dict[str, list[RetrievedDocument]]:
+        """
+        Ranks each collection's candidates (keyed by rerank policy name) as its policy
+        decides: in vector order, with only the top_m reranked, or fully reranked. Every
+        document that needs the cross-encoder is scored in one pass, then the top_n of
+        each collection are kept.
+        """
+        plans = {}
+        for name, group in document_groups.items():
+            decision, rerank_count = self.rerank_policies[name].decide(
+                [document.score for document in group]
+            )
+            # Audited decisions are scored in full to compare with a full rerank
+            audit = (
+                decision in (SKIP, SHRINK)
+                and random.random() < self.rerank_monitor.audit_rate
+            )
+            plans[name] = (
+                decision,
+                rerank_count,
+                len(group) if audit else rerank_count,
+            )
+
+        pairs = [
+            (question, document.content)
+            for name, group in document_groups.items()
+            for document in group[: plans[name][2]]
+        ]
+        scores = []
+        if pairs:
+            with stage("rerank"):
+                scores = self.model.score(pairs)
+
+        ranked_groups = {}
+        offset = 0
+        for name, group in document_groups.items():
+            decision, rerank_count, scored_count = plans[name]
+            group_scores = scores[offset : offset + scored_count]
+            offset += scored_count
+            order = sorted(
+                range(rerank_count),
+                key=lambda index: group_scores[index],
+                reverse=True,
+            )
+            ranked = [group[index] for index in order] + group[rerank_count:]
+            if scored_count > rerank_count:
+                best = max(range(scored_count), key=lambda index: group_scores[index])
+                self.rerank_monitor.record_audit(
+                    name, decision, ranked[0] is group[best]
+                )
+            self.rerank_monitor.record(
+                name,
+                decision,
+                candidates=len(group),
+                pairs_scored=rerank_count,
+                margin=group[0].score - group[1].score if len(group) > 1 else None,
+            )
+            ranked_groups[name] = ranked[: self.rerank_policies[name].top_n]
+        return ranked_groups
+
+    def select_documents(
+        self, reranked_documents: list[RetrievedDocument], max_returns: int
+    ) -> list[RetrievedDocument]:
         # Ensure there is only a maximum of around 2000 tokens of data
         max_tokens = 2000
         total_tokens = 0
         selected_docs = []
 
-        for doc in reranked_documents:
-            approx_tokens = len(doc.page_content) // 4
-            if total_tokens + approx_tokens > max_tokens:
+        for doc in reranked_documents[:max_returns]:
+            doc_tokens = self.token_counter.count(doc.content)
+            if total_tokens + doc_tokens > max_tokens:
                 break
             selected_docs.append(doc)
-            total_tokens += approx_tokens
+            total_tokens += doc_tokens
+        return selected_docs
 
-        compression_contents = [doc.page_content for doc in selected_docs]
-        sources = [doc.metadata.get("source", "unknown") for doc in selected_docs]
-        point_ids = [doc.metadata.get("point_id", "unknown") for doc in selected_docs]
-        df = pd.DataFrame(
-            {
-                "contents": compression_contents,
-                "sources": sources,
-                "point_ids": point_ids,
-            }
+    async def previous_point_documents(
+        self, collection_name: str, previous_points: list[str]
+    ) -> list[RetrievedDocument]:
+        """No documents were above threshold, fall back to the point the conversation last used"""
+        if not previous_points:
+            return []
+        previous_point_search = (
+            self.index_mirror.retrieve(collection_name, previous_points)
+            if self.index_mirror is not None
+            else None
         )
-        df = df[:max_returns]
+        if previous_point_search is None:
+            with stage("qdrant_retrieve"):
+                previous_point_search = await asyncio.wait_for(
+                    self.async_qdrant_client.retrieve(
+                        collection_name=collection_name,
+                        ids=previous_points,
+                        with_payload=True,
+                    ),
+                    timeout=self.search_timeout,
+                )
+        # Get only most recent result from previous data points
+        return [RetrievedDocument.from_point(previous_point_search[0])]
 
-        return (df, df["point_ids"])
+    async def close(self):
+        """Closes the index mirror, the pooled async Qdrant connections and the embedding cache file on app shutdown"""
+        if self.index_mirror is not None:
+            await self.index_mirror.close()
+        await self.async_qdrant_client.close()
+        if self.embedding.query_cache is not None:
+            self.embedding.query_cache.close()
 
     # Retrieve Q&A pairs for feedback loop
-    def get_qa_docs(self, question: str):
-        search_results = self.qdrant_client.search(
-            collection_name=self.QA_collection_name,
-            query_vector=self.embedding.embed_query(question),
-            limit=5,
-            with_payload=True,
-            with_vectors=False,
+    async def get_qa_docs(self, question: str):
+        vector_format = self.vector_format(self.QA_collection_name)
+        search_results = await asyncio.wait_for(
+            self.async_qdrant_client.search(
+                collection_name=self.QA_collection_name,
+                query_vector=vector_format.truncate(
+                    await asyncio.to_thread(self.embedding.embed_query, question)
+                ),
+                limit=5,
+                with_payload=True,
+                with_vectors=False,
+                search_params=vector_format.search_params(),
+            ),
+            timeout=self.search_timeout,
         )
 
         qa_docs = []
@@ -217,7 +479,9 @@ class RAG:
         )
 
         # embedding_vector = self.Qdrant_model.encode(QA_text)
-        embedding_vector = self.embedding.embed_documents([QA_text])[0]
+        embedding_vector = self.vector_format(self.QA_collection_name).truncate(
+            (await asyncio.to_thread(self.embedding.embed_documents, [QA_text]))[0]
+        )
 
         item_payload = {
             "text": actual_text_content,
@@ -226,10 +490,10 @@ class RAG:
 
         # Create a PointStruct for the new data point
         new_point = PointStruct(
-            id=current_qa_id, vector=embedding_vector, payload=item_payload
+            id=current_qa_id, vector=embedding_vector.tolist(), payload=item_payload
         )
         # Upload the new point to Qdrant collection
-        self.qdrant_client.upsert(
+        await self.async_qdrant_client.upsert(
             collection_name=self.QA_collection_name,
             points=[new_point],  # upsert expects a list of points
         )
@@ -0,0 +1,101 @@
+"""
+Benchmarks concurrent LLM.run_conversation throughput against a local fake Groq server.
+
+"blocking" replays the old behaviour where every completion went through the synchronous
+Groq client on the event loop. "async" uses the pooled AsyncGroq client and in-flight cap.
+Retrieval is replaced by an empty result so only the LLM round trips are measured.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.async_llm_client --requests 64 --delay 0.25
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+from groq import Groq
+
+from LLM.benchmarks.fake_groq import FakeGroqServer
+from LLM.core import LLM
+from LLM.Environment import Environment
+
+
+class NoRetrievalRAG:
+    async def get_documents(
+        self, question: str, previous_points: list[str], query_embedding=None
+    ):
+        return ([], [])
+
+
+async def run_batch(llm, total_requests: int) -> float:
+    # A follow-up turn so the keep-context check and the answer call both hit the server
+    chat_history = [
+        {"role": "user", "content": "What instruments are at Cambridge Bay?"},
+        {
+            "role": "system",
+            "content": "There is a CTD, a hydrophone and an ice profiler.",
+        },
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *[
+            llm.run_conversation(
+                user_prompt="Which of those measures salinity?",
+                user_onc_token="benchmark-token",
+                chat_history=chat_history,
+            )
+            for _ in range(total_requests)
+        ]
+    )
+    return time.perf_counter() - start
+
+
+async def main(total_requests: int, delay: float, max_in_flight: int):
+    server = FakeGroqServer(delay=delay)
+    server.start()
+    os.environ["GROQ_BASE_URL"] = server.base_url
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-key")
+    os.environ["GROQ_MAX_CONCURRENT_REQUESTS"] = str(max_in_flight)
+    # Keep the yes/no context check on the fake server so both LLM round trips are measured
+    os.environ["CONTEXT_CHECK_MODE"] = "llm"
+    # There are no embeddings to pick tools with, send every tool schema
+    os.environ["TOOL_RETRIEVAL_ENABLED"] = "false"
+
+    # Built after the environment is configured so the clients point at the fake server
+    llm = LLM(Environment(), RAG_instance=NoRetrievalRAG())
+    blocking_client = Groq(api_key=os.environ["GROQ_API_KEY"], base_url=server.base_url)
+
+    async def blocking_completion(route, **kwargs):
+        return blocking_client.chat.completions.create(
+            **llm.model_router.request_options(route), **kwargs
+        )
+
+    async_completion = llm.create_chat_completion
+    try:
+        results = {}
+        for mode, completion in [
+            ("blocking", blocking_completion),
+            ("async", async_completion),
+        ]:
+            llm.create_chat_completion = completion
+            elapsed = await run_batch(llm, total_requests)
+            results[mode] = elapsed
+            print(
+                f"{mode:>8}: {total_requests} conversations in {elapsed:.2f}s "
+                f"({total_requests / elapsed:.2f} conversations/s)"
+            )
+        print(f" speedup: {results['blocking'] / results['async']:.1f}x")
+    finally:
+        blocking_client.close()
+        await llm.env.close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--delay", type=float, default=0.25)
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.delay, args.max_in_flight))
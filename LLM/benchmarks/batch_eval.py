@@ -0,0 +1,341 @@
+"""
+Batch evaluation of LLM.run_conversation on a labelled prompt set.
+
+Each JSONL line is a corpus item as in conversation_prompts.jsonl, optionally labelled:
+    {"id": ..., "user_prompt": ..., "chat_history": [...],
+     "expected_tools": ["get_ice_thickness"], "expected_status": "REGULAR_MESSAGE"}
+expected_tools is the set of tools the tool-selection call should pick ([] for none).
+
+Items run concurrently (bounded by --concurrency) on one shared LLM, so the embedding,
+reranker and HTTP clients are loaded once. Every item records the tools the LLM picked,
+the status code, Groq token usage and latency. The report shows the totals and lists
+only the items that got something wrong. --output saves it as JSON, and --baseline
+compares against an earlier report: it flags lower accuracy, higher latency or tokens,
+and items that used to pass and now fail, and exits with status 1 if anything regressed.
+
+To run offline, --replay a cassette recorded by conversation_bench or by --record here,
+or call run_eval() from Python with an LLM built on stubbed clients.
+The answer, tool and single-flight caches are off unless --with-caches is given.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.batch_eval --replay cassette.json --output report.json
+    python -m LLM.benchmarks.batch_eval --replay cassette.json --baseline report.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from LLM.benchmarks.conversation_bench import (
+    DEFAULT_CORPUS,
+    REPLAY_ONC_TOKEN,
+    load_corpus,
+)
+from LLM.benchmarks.replay import Cassette, install, replay_scope
+from LLM.Constants.status_codes import StatusCode
+from LLM.core import LLM
+from LLM.Environment import Environment
+from LLM.timing import start_timings
+
+# Routes whose completion decides which tools run
+TOOL_CHOICE_ROUTES = {"tool_selection", "conversational"}
+# A baseline comparison flags latency or token increases above this fraction
+REGRESSION_TOLERANCE = 0.10
+
+
+@dataclass
+class ItemResult:
+    id: str
+    status: str
+    tools_called: list[str] = field(default_factory=list)
+    expected_tools: Optional[list[str]] = None
+    expected_status: Optional[str] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    llm_calls: int = 0
+    latency_ms: float = 0.0
+    stages: dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def tools_correct(self) -> Optional[bool]:
+        if self.expected_tools is None:
+            return None
+        return set(self.tools_called) == set(self.expected_tools)
+
+    @property
+    def status_correct(self) -> Optional[bool]:
+        if self.expected_status is None:
+            return None
+        return self.status == self.expected_status
+
+    @property
+    def passed(self) -> bool:
+        return (
+            self.error is None
+            and self.tools_correct is not False
+            and self.status_correct is not False
+        )
+
+
+# The item a completion belongs to, so concurrent items don't mix up their usage
+_current_item: ContextVar[Optional[ItemResult]] = ContextVar(
+    "batch_eval_item", default=None
+)
+
+
+@contextmanager
+def recording_completions(llm: LLM) -> Iterator[None]:
+    """Adds the tools and usage of each completion in the block to the running item"""
+    create_chat_completion = llm.create_chat_completion
+
+    async def recording_completion(route: str, **kwargs):
+        response = await create_chat_completion(route, **kwargs)
+        item = _current_item.get()
+        if item is None:
+            return response
+        item.llm_calls += 1
+        if response.usage is not None:
+            item.prompt_tokens += response.usage.prompt_tokens
+            item.completion_tokens += response.usage.completion_tokens
+        if route in TOOL_CHOICE_ROUTES and response.choices:
+            item.tools_called.extend(
+                call.function.name
+                for call in response.choices[0].message.tool_calls or []
+            )
+        return response
+
+    llm.create_chat_completion = recording_completion
+    try:
+        yield
+    finally:
+        llm.create_chat_completion = create_chat_completion
+
+
+async def run_item(llm: LLM, example: dict, user_onc_token: str) -> ItemResult:
+    item = ItemResult(
+        id=example["id"],
+        status="",
+        expected_tools=example.get("expected_tools"),
+        expected_status=example.get("expected_status"),
+    )
+    # gather runs each item in its own task, so this only reaches this item's calls
+    _current_item.set(item)
+    with replay_scope(example["id"]):
+        timings = start_timings()
+        started_at = time.perf_counter()
+        try:
+            result = await llm.run_conversation(
+                user_prompt=example["user_prompt"],
+                user_onc_token=user_onc_token,
+                chat_history=example.get("chat_history", []),
+            )
+            item.status = result.status.name
+        except Exception as e:
+            item.status = StatusCode.LLM_ERROR.name
+            item.error = f"{type(e).__name__}: {e}"
+        item.latency_ms = round((time.perf_counter() - started_at) * 1000, 1)
+        item.stages = timings.as_dict()
+    item.tools_called = sorted(set(item.tools_called))
+    return item
+
+
+async def run_eval(
+    llm: LLM, corpus: list[dict], concurrency: int, user_onc_token: str
+) -> list[ItemResult]:
+    """Runs every corpus item on the shared LLM, at most concurrency at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_limited(example: dict) -> ItemResult:
+        async with semaphore:
+            return await run_item(llm, example, user_onc_token)
+
+    with recording_completions(llm):
+        return await asyncio.gather(*[run_limited(example) for example in corpus])
+
+
+def accuracy(values: list[Optional[bool]]) -> Optional[float]:
+    labelled = [value for value in values if value is not None]
+    return round(sum(labelled) / len(labelled), 4) if labelled else None
+
+
+def summarize(results: list[ItemResult], elapsed: float) -> dict:
+    latencies = [item.latency_ms for item in results]
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "items": len(results),
+        "elapsed_seconds": round(elapsed, 2),
+        "tool_accuracy": accuracy([item.tools_correct for item in results]),
+        "status_accuracy": accuracy([item.status_correct for item in results]),
+        "statuses": dict(Counter(item.status for item in results).most_common()),
+        "errors": sum(item.error is not None for item in results),
+        "prompt_tokens_mean": round(
+            float(np.mean([item.prompt_tokens for item in results])), 1
+        ),
+        "completion_tokens_mean": round(
+            float(np.mean([item.completion_tokens for item in results])), 1
+        ),
+        "llm_calls_mean": round(
+            float(np.mean([item.llm_calls for item in results])), 2
+        ),
+        "latency_ms": {
+            "p50": round(float(p50), 1),
+            "p95": round(float(p95), 1),
+            "p99": round(float(p99), 1),
+        },
+    }
+
+
+def build_report(results: list[ItemResult], elapsed: float) -> dict:
+    return {
+        "summary": summarize(results, elapsed),
+        "items": [{**asdict(item), "passed": item.passed} for item in results],
+    }
+
+
+def compare(report: dict, baseline: dict) -> list[str]:
+    """Regressions of report against baseline, as lines for the report"""
+    current, previous = report["summary"], baseline["summary"]
+    regressions = []
+    for name in ("tool_accuracy", "status_accuracy"):
+        if (
+            current[name] is not None
+            and previous[name] is not None
+            and current[name] < previous[name]
+        ):
+            regressions.append(f"{name} {previous[name]:.0%} -> {current[name]:.0%}")
+    for name, now, before in [
+        (
+            "prompt_tokens_mean",
+            current["prompt_tokens_mean"],
+            previous["prompt_tokens_mean"],
+        ),
+        ("latency p95 ms", current["latency_ms"]["p95"], previous["latency_ms"]["p95"]),
+    ]:
+        if before and now > before * (1 + REGRESSION_TOLERANCE):
+            regressions.append(f"{name} {before} -> {now} (+{now / before - 1:.0%})")
+    passed_before = {item["id"] for item in baseline["items"] if item["passed"]}
+    regressions.extend(
+        f"{item['id']} passed in the baseline and now fails"
+        for item in report["items"]
+        if not item["passed"] and item["id"] in passed_before
+    )
+    return regressions
+
+
+def print_report(report: dict, regressions: Optional[list[str]] = None) -> None:
+    summary = report["summary"]
+    print(
+        f"{summary['items']} items in {summary['elapsed_seconds']}s, "
+        f"{summary['errors']} raised errors"
+    )
+    for name in ("tool_accuracy", "status_accuracy"):
+        value = summary[name]
+        print(f"{name:>18}: {'unlabelled' if value is None else f'{value:.0%}'}")
+    print(f"{'statuses':>18}: {summary['statuses']}")
+    print(
+        f"{'tokens per item':>18}: {summary['prompt_tokens_mean']:.0f} prompt, "
+        f"{summary['completion_tokens_mean']:.0f} completion, "
+        f"{summary['llm_calls_mean']} LLM calls"
+    )
+    latency = summary["latency_ms"]
+    print(
+        f"{'latency ms':>18}: p50 {latency['p50']:.0f}  p95 {latency['p95']:.0f}  "
+        f"p99 {latency['p99']:.0f}"
+    )
+    failures = [item for item in report["items"] if not item["passed"]]
+    if failures:
+        print(f"failed items ({len(failures)}):")
+    for item in failures:
+        details = []
+        if item["error"]:
+            details.append(item["error"])
+        if item["expected_tools"] is not None and set(item["tools_called"]) != set(
+            item["expected_tools"]
+        ):
+            details.append(
+                f"tools {item['tools_called']} expected {sorted(item['expected_tools'])}"
+            )
+        if (
+            item["expected_status"] is not None
+            and item["status"] != item["expected_status"]
+        ):
+            details.append(
+                f"status {item['status']} expected {item['expected_status']}"
+            )
+        print(f"  {item['id']}: {'; '.join(details)}")
+    if regressions is None:
+        return
+    if regressions:
+        print(f"REGRESSIONS against the baseline ({len(regressions)}):")
+        for line in regressions:
+            print(f"  {line}")
+    else:
+        print("no regressions against the baseline")
+
+
+async def main(args) -> int:
+    corpus = load_corpus(args.corpus)
+    llm = LLM(Environment())
+    user_onc_token = llm.env.get_onc_token()
+    cassette = None
+    if args.replay:
+        install(llm, Cassette.load(args.replay), mode="replay")
+        user_onc_token = REPLAY_ONC_TOKEN
+    elif args.record:
+        cassette = Cassette()
+        install(llm, cassette, mode="record")
+    try:
+        started_at = time.perf_counter()
+        results = await run_eval(llm, corpus, args.concurrency, user_onc_token)
+        report = build_report(results, time.perf_counter() - started_at)
+    finally:
+        await llm.env.close()
+
+    if cassette is not None:
+        cassette.save(args.record)
+        print(f"Saved {len(corpus)} conversations to {args.record}")
+    regressions = (
+        compare(report, json.loads(args.baseline.read_text()))
+        if args.baseline
+        else None
+    )
+    print_report(report, regressions)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=1))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--concurrency", type=int, default=4)
+    backend = parser.add_mutually_exclusive_group()
+    backend.add_argument("--replay", type=Path, help="answer from this cassette")
+    backend.add_argument("--record", type=Path, help="record a cassette while running")
+    parser.add_argument("--output", type=Path, help="save the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="report JSON to compare with")
+    parser.add_argument("--with-caches", action="store_true")
+    args = parser.parse_args()
+
+    if not args.with_caches:
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["TOOL_CACHE_ENABLED"] = "false"
+        os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+    if args.replay and not os.getenv("GROQ_API_KEY"):
+        # The Groq client refuses to start without a key even though replay never uses it
+        os.environ["GROQ_API_KEY"] = "replay"
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,101 @@
+"""
+Compares the local embedding context classifier with the one-token Groq yes/no check.
+
+Each line of the examples file is a follow-up question with its chat history (most recent
+turn first, as get_context returns it) and a hand-labelled "related" flag. The script
+reports accuracy against the labels, agreement between the two checks and latency.
+The local check is timed with the question already embedded, because in run_conversation
+that embedding is shared with retrieval.
+
+Usage (from the repository root, needs GROQ_API_KEY unless --skip-llm is given):
+    python -m LLM.benchmarks.context_check_eval
+    python -m LLM.benchmarks.context_check_eval --examples my_examples.jsonl --skip-llm
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+
+from LLM.core import LLM
+from LLM.Environment import Environment
+from LLM.RAG import JinaEmbeddings
+
+DEFAULT_EXAMPLES = Path(__file__).resolve().parent / "context_examples.jsonl"
+
+
+class EmbeddingOnlyRAG:
+    def __init__(self):
+        self.embedding = JinaEmbeddings()
+
+
+def summarize(name: str, predictions: list[bool], labels: list[bool], latencies):
+    accuracy = sum(p == label for p, label in zip(predictions, labels)) / len(labels)
+    p95 = (
+        statistics.quantiles(latencies, n=20)[-1]
+        if len(latencies) > 1
+        else latencies[0]
+    )
+    print(
+        f"{name:>6}: accuracy {accuracy:.0%}  "
+        f"p50 {statistics.median(latencies) * 1000:.1f}ms  p95 {p95 * 1000:.1f}ms"
+    )
+
+
+async def main(examples_path: Path, skip_llm: bool):
+    examples = [
+        json.loads(line) for line in examples_path.read_text().splitlines() if line
+    ]
+    llm = LLM(Environment(), RAG_instance=EmbeddingOnlyRAG())
+    embed_query = llm.RAG_instance.embedding.embed_query
+    labels = [example["related"] for example in examples]
+
+    local_predictions, local_latencies = [], []
+    llm_predictions, llm_latencies = [], []
+    try:
+        for example in examples:
+            query_embedding = embed_query(example["user_prompt"])
+            start = time.perf_counter()
+            local_predictions.append(
+                llm.context_classifier.is_related(
+                    example["user_prompt"], example["chat_history"], query_embedding
+                )
+            )
+            local_latencies.append(time.perf_counter() - start)
+
+            if not skip_llm:
+                start = time.perf_counter()
+                llm_predictions.append(
+                    await llm.check_keep_context_with_llm(
+                        example["user_prompt"], example["chat_history"]
+                    )
+                )
+                llm_latencies.append(time.perf_counter() - start)
+
+        print(f"{len(examples)} examples from {examples_path}")
+        summarize("local", local_predictions, labels, local_latencies)
+        if skip_llm:
+            return
+        summarize("llm", llm_predictions, labels, llm_latencies)
+        agreement = sum(
+            local == remote for local, remote in zip(local_predictions, llm_predictions)
+        ) / len(examples)
+        print(f" agreement between local and llm: {agreement:.0%}")
+        for example, local, remote in zip(examples, local_predictions, llm_predictions):
+            if local != remote:
+                print(
+                    f"  disagree: {example['user_prompt']!r} "
+                    f"local={local} llm={remote} label={example['related']}"
+                )
+    finally:
+        await llm.env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--examples", type=Path, default=DEFAULT_EXAMPLES)
+    parser.add_argument("--skip-llm", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.examples, args.skip_llm))
@@ -0,0 +1,175 @@
+"""
+End-to-end LLM.run_conversation benchmark on recorded Groq, Qdrant and ONC responses.
+
+"record" runs each corpus prompt once against the live services (needs GROQ_API_KEY,
+QDRANT_URL/QDRANT_API_KEY and ONC_TOKEN) and writes a cassette. "replay" runs the corpus
+from that cassette at the chosen concurrency, with the recorded latencies (scaled by
+--latency-scale) or a fixed latency per service, and reports throughput and p50/p95/p99
+of every pipeline stage. Embedding and reranking still run on the local models.
+
+Each corpus line is {"id": ..., "user_prompt": ..., "chat_history": [...]}, with the
+history most recent turn first as get_context returns it.
+
+The answer and tool caches are off unless --with-caches is given, so repeated prompts
+exercise the whole pipeline.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.conversation_bench record --cassette cassette.json
+    python -m LLM.benchmarks.conversation_bench replay --cassette cassette.json \\
+        --concurrency 8 --repeat 4 --latency-scale 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+from LLM.benchmarks.replay import Cassette, ReplayLatency, install, replay_scope
+from LLM.Constants.status_codes import StatusCode
+from LLM.core import LLM
+from LLM.Environment import Environment
+from LLM.timing import start_timings
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "conversation_prompts.jsonl"
+# Stands in for a real token during replay, recordings only contain a placeholder
+REPLAY_ONC_TOKEN = "replay-onc-token"
+
+
+def load_corpus(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+async def run_prompt(llm: LLM, example: dict, user_onc_token: str) -> dict:
+    """Runs one corpus prompt in its own replay scope and timing context"""
+    with replay_scope(example["id"]):
+        timings = start_timings()
+        started_at = time.perf_counter()
+        result = await llm.run_conversation(
+            user_prompt=example["user_prompt"],
+            user_onc_token=user_onc_token,
+            chat_history=example.get("chat_history", []),
+        )
+        stages = timings.as_dict()
+        stages["total"] = round((time.perf_counter() - started_at) * 1000, 1)
+    return {"failed": result.status == StatusCode.LLM_ERROR, "stages": stages}
+
+
+def print_report(runs: list[dict], elapsed: float) -> None:
+    failed = sum(run["failed"] for run in runs)
+    print(
+        f"{len(runs)} conversations in {elapsed:.2f}s "
+        f"({len(runs) / elapsed:.2f} conversations/s), {failed} failed"
+    )
+    durations: dict[str, list[float]] = defaultdict(list)
+    for run in runs:
+        for stage_name, ms in run["stages"].items():
+            durations[stage_name].append(ms)
+    print(f"{'stage':<40}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    # Slowest stages first, total is always the last row
+    total = durations.pop("total")
+    for stage_name, values in [
+        *sorted(durations.items(), key=lambda item: -np.percentile(item[1], 50)),
+        ("total", total),
+    ]:
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{stage_name:<40}{len(values):>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+
+
+async def record(corpus: list[dict], cassette_path: Path) -> None:
+    llm = LLM(Environment())
+    cassette = Cassette()
+    install(llm, cassette, mode="record")
+    try:
+        runs = []
+        started_at = time.perf_counter()
+        for example in corpus:
+            runs.append(await run_prompt(llm, example, llm.env.get_onc_token()))
+            print(f"recorded {example['id']}")
+        cassette.save(cassette_path)
+        print(f"Saved {len(corpus)} conversations to {cassette_path}")
+        print_report(runs, time.perf_counter() - started_at)
+    finally:
+        await llm.env.close()
+
+
+async def replay(
+    corpus: list[dict],
+    cassette_path: Path,
+    concurrency: int,
+    repeat: int,
+    latency: ReplayLatency,
+) -> None:
+    llm = LLM(Environment())
+    install(llm, Cassette.load(cassette_path), mode="replay", latency=latency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_limited(example: dict) -> dict:
+        async with semaphore:
+            return await run_prompt(llm, example, REPLAY_ONC_TOKEN)
+
+    try:
+        started_at = time.perf_counter()
+        runs = await asyncio.gather(
+            *[run_limited(example) for _ in range(repeat) for example in corpus]
+        )
+        print_report(runs, time.perf_counter() - started_at)
+    finally:
+        await llm.env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", type=Path, required=True)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiplies the recorded latency of every replayed call",
+    )
+    for source in ("groq", "qdrant", "onc"):
+        parser.add_argument(
+            f"--{source}-latency",
+            type=float,
+            default=None,
+            help=f"fixed seconds for every replayed {source} call",
+        )
+    parser.add_argument("--with-caches", action="store_true")
+    args = parser.parse_args()
+
+    if not args.with_caches:
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["TOOL_CACHE_ENABLED"] = "false"
+    corpus = load_corpus(args.corpus)
+    if args.mode == "record":
+        asyncio.run(record(corpus, args.cassette))
+    else:
+        if not os.getenv("GROQ_API_KEY"):
+            # The Groq client refuses to start without a key even though replay never uses it
+            os.environ["GROQ_API_KEY"] = "replay"
+        asyncio.run(
+            replay(
+                corpus,
+                args.cassette,
+                args.concurrency,
+                args.repeat,
+                ReplayLatency(
+                    scale=args.latency_scale,
+                    fixed={
+                        "groq": args.groq_latency,
+                        "qdrant": args.qdrant_latency,
+                        "onc": args.onc_latency,
+                    },
+                ),
+            )
+        )
@@ -0,0 +1,152 @@
+"""
+Minimal OpenAI-compatible chat completions server used to benchmark the LLM pipeline
+without calling Groq. Every request sleeps for `delay` seconds to mimic provider latency,
+every `tail_every`-th request sleeps `tail_delay` instead to mimic tail latency, and while
+`fail_status` is set every request fails with that HTTP status.
+
+Usage:
+    server = FakeGroqServer(delay=0.2)
+    server.start()
+    os.environ["GROQ_BASE_URL"] = server.base_url
+    ...
+    server.stop()
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+from aiohttp import web
+
+
+class FakeGroqServer:
+    def __init__(
+        self,
+        delay: float = 0.2,
+        reply: str = "Fake answer from the benchmark server.",
+        tool_calls: list[tuple[str, dict]] = None,
+        tail_delay: float = 0.0,
+        tail_every: int = 0,
+        fail_status: int = None,
+    ):
+        self.delay = delay
+        self.tail_delay = tail_delay
+        self.tail_every = tail_every
+        self.fail_status = fail_status
+        self.reply = reply
+        # (function name, arguments) pairs returned whenever the request offers tools
+        self.tool_calls = tool_calls or []
+        self.request_count = 0
+        self.port = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def _chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.request_count += 1
+        if self.fail_status is not None:
+            return web.json_response(
+                {"error": {"message": "Fake server failure", "type": "server_error"}},
+                status=self.fail_status,
+            )
+        is_tail = self.tail_every and self.request_count % self.tail_every == 0
+        await asyncio.sleep(self.tail_delay if is_tail else self.delay)
+        # The keep-context check only asks for a single token
+        content = "yes" if body.get("max_completion_tokens") == 1 else self.reply
+        message = {"role": "assistant", "content": content}
+        if body.get("tools") and self.tool_calls:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{index}",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(arguments)},
+                    }
+                    for index, (name, arguments) in enumerate(self.tool_calls)
+                ],
+            }
+        if body.get("stream"):
+            return await self._stream_reply(request, body, content)
+        return web.json_response(
+            {
+                "id": f"chatcmpl-{self.request_count}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake-model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls"
+                        if message.get("tool_calls")
+                        else "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "total_tokens": 0,
+                },
+            }
+        )
+
+    async def _stream_reply(
+        self, request: web.Request, body: dict, content: str
+    ) -> web.StreamResponse:
+        """Sends the reply word by word as chat.completion.chunk server-sent events"""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            chunk = {
+                "id": f"chatcmpl-{self.request_count}",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake-model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if index == 0 else f" {word}"},
+                        "finish_reason": "stop" if index == len(words) - 1 else None,
+                    }
+                ],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_post("/openai/v1/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+        self._loop.run_forever()
+
+    def start(self):
+        """Runs the server on its own thread and event loop so blocking clients can't stall it"""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -0,0 +1,108 @@
+"""
+Benchmarks the hedging LLM gateway against two local fake Groq servers.
+
+The primary server answers in --delay seconds but every --tail-every-th request takes
+--tail-delay seconds. The run is repeated with a plain client on the primary and with
+the gateway hedging to the secondary server, and p50/p95/p99 latency are compared. The
+primary then starts failing to show the circuit breaker moving traffic to the secondary.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.llm_gateway_bench --requests 200 --tail-every 10
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from LLM.benchmarks.fake_groq import FakeGroqServer
+from LLM.Environment import Environment
+
+
+async def timed_completions(client, total_requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> float:
+        async with semaphore:
+            started_at = time.perf_counter()
+            await client.chat.completions.create(
+                model="fake-model",
+                messages=[{"role": "user", "content": "hi"}],
+            )
+            return time.perf_counter() - started_at
+
+    return await asyncio.gather(*[one() for _ in range(total_requests)])
+
+
+def report(name: str, latencies: list[float]) -> None:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"{name:>8}: p50 {p50:.0f}ms  p95 {p95:.0f}ms  p99 {p99:.0f}ms")
+
+
+async def main(
+    total_requests: int,
+    concurrency: int,
+    delay: float,
+    tail_delay: float,
+    tail_every: int,
+):
+    primary = FakeGroqServer(delay=delay, tail_delay=tail_delay, tail_every=tail_every)
+    secondary = FakeGroqServer(delay=delay)
+    primary.start()
+    secondary.start()
+    os.environ.setdefault("GROQ_API_KEY", "benchmark-key")
+    # Hedge quickly so the warm-up doesn't dominate a short run
+    os.environ.setdefault("LLM_HEDGE_INITIAL_DELAY_SECONDS", str(delay * 2))
+    env = Environment()
+    plain = env.create_async_client(os.environ["GROQ_API_KEY"], primary.base_url)
+    gateway = env.create_llm_gateway(
+        [
+            {"name": "primary", "base_url": primary.base_url},
+            {"name": "secondary", "base_url": secondary.base_url},
+        ]
+    )
+    try:
+        report("plain", await timed_completions(plain, total_requests, concurrency))
+        report("hedged", await timed_completions(gateway, total_requests, concurrency))
+        stats = gateway.stats()
+        print(
+            f"  {stats['hedges']} hedges, wins "
+            + ", ".join(f"{e['name']}={e['wins']}" for e in stats["endpoints"])
+        )
+
+        primary.fail_status = 503
+        requests_before = primary.request_count
+        await timed_completions(gateway, total_requests, concurrency)
+        stats = gateway.stats()
+        print(
+            f"primary failing: circuit {stats['endpoints'][0]['circuit']}, "
+            f"{primary.request_count - requests_before} of {total_requests} requests "
+            f"reached it, {stats['failovers']} failovers"
+        )
+    finally:
+        await plain.close()
+        await gateway.close()
+        await env.close()
+        primary.stop()
+        secondary.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0.05)
+    parser.add_argument("--tail-delay", type=float, default=1.0)
+    parser.add_argument("--tail-every", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            args.requests,
+            args.concurrency,
+            args.delay,
+            args.tail_delay,
+            args.tail_every,
+        )
+    )
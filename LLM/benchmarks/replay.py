@@ -0,0 +1,405 @@
+"""
+Record/replay layer for benchmarking LLM.run_conversation offline.
+
+In record mode the Groq client, the Qdrant client and the ONC tools of a live LLM are
+wrapped so every response is saved to a cassette (a JSON fixture file) together with how
+long it took. In replay mode the same wrappers answer from the cassette instead, sleeping
+for the recorded time (scaled, or a fixed injected latency) so a run is deterministic
+but still has realistic waits. Embedding and reranking are local models and keep running.
+
+Recordings are grouped by scope, one per corpus prompt, and keyed by what a call does
+rather than its full payload so a cassette survives prompt edits and a new date:
+    groq:<route>, e.g. groq:keep_context or groq:answer     (by call order in the scope)
+    qdrant:search:<collection>                               (by call order in the scope)
+    qdrant:retrieve:<collection>:<ids>
+    onc:<tool name>:<normalized arguments>
+ONC tokens are replaced with a placeholder before anything is written to disk.
+
+Usage:
+    cassette = Cassette()
+    install(llm, cassette, mode="record")
+    with replay_scope("ice-thickness"):
+        await llm.run_conversation(...)
+    cassette.save(path)
+"""
+
+import asyncio
+import copy
+import functools
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Iterator, Optional
+
+from groq.types.chat import ChatCompletion, ChatCompletionChunk
+from pydantic import BaseModel
+from qdrant_client.http.models import Record, ScoredPoint
+
+from LLM.tool_cache import EXCLUDED_ARGUMENTS, TOKEN_PLACEHOLDER, replace_text
+
+CASSETTE_VERSION = 2
+
+
+class ReplayMissError(KeyError):
+    """The cassette has no recording for a call made during replay"""
+
+
+class ReplayScope:
+    """One conversation being recorded or replayed, counts repeated calls so each gets its own recording"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls: Counter[str] = Counter()
+
+    def next_key(self, key: str) -> str:
+        index = self.calls[key]
+        self.calls[key] += 1
+        return f"{key}#{index}"
+
+
+# Context variables are copied into worker threads and tool event loops, so tools
+# and Qdrant calls made on behalf of a conversation still see its scope
+_current_scope: ContextVar[Optional[ReplayScope]] = ContextVar(
+    "replay_scope", default=None
+)
+# The ModelRouter route (e.g. "keep_context") of the completion being made
+_current_route: ContextVar[Optional[str]] = ContextVar("replay_route", default=None)
+
+
+@contextmanager
+def replay_scope(name: str) -> Iterator[ReplayScope]:
+    scope = ReplayScope(name)
+    reset_token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(reset_token)
+
+
+def _scope() -> ReplayScope:
+    scope = _current_scope.get()
+    if scope is None:
+        raise RuntimeError("Recorded and replayed calls must run inside replay_scope()")
+    return scope
+
+
+def to_jsonable(value):
+    """Converts pydantic models (e.g. ObtainedParamsDictionary) nested in a response to plain JSON"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, dict):
+        return {key: to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(item) for item in value]
+    return value
+
+
+class Cassette:
+    """Recorded responses by scope and call key, with the seconds each call took"""
+
+    def __init__(self, recordings: Optional[dict[str, dict[str, dict]]] = None):
+        self.recordings = recordings or {}
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        data = json.loads(Path(path).read_text())
+        if data.get("version") != CASSETTE_VERSION:
+            raise ValueError(
+                f"{path} is cassette version {data.get('version')}, expected {CASSETTE_VERSION}"
+            )
+        return cls(data["recordings"])
+
+    def save(self, path: Path) -> None:
+        Path(path).write_text(
+            json.dumps(
+                {"version": CASSETTE_VERSION, "recordings": self.recordings},
+                indent=1,
+                default=str,
+            )
+        )
+
+    def record(self, scope: ReplayScope, key: str, response, seconds: float) -> None:
+        self.recordings.setdefault(scope.name, {})[key] = {
+            "seconds": round(seconds, 4),
+            "response": to_jsonable(response),
+        }
+
+    def lookup(self, scope: ReplayScope, key: str) -> dict:
+        try:
+            return copy.deepcopy(self.recordings[scope.name][key])
+        except KeyError:
+            raise ReplayMissError(
+                f"No recording for {key} in scope {scope.name!r}, re-record the cassette"
+            ) from None
+
+
+class ReplayLatency:
+    """
+    How long a replayed call waits: the recorded time multiplied by scale, unless a
+    fixed latency in seconds is given for its source ("groq", "qdrant" or "onc").
+    """
+
+    def __init__(self, scale: float = 1.0, fixed: Optional[dict[str, float]] = None):
+        self.scale = scale
+        self.fixed = fixed or {}
+
+    def seconds(self, source: str, recorded_seconds: float) -> float:
+        if self.fixed.get(source) is not None:
+            return self.fixed[source]
+        return recorded_seconds * self.scale
+
+
+@contextmanager
+def _route_scope(route: str) -> Iterator[None]:
+    reset_token = _current_route.set(route)
+    try:
+        yield
+    finally:
+        _current_route.reset(reset_token)
+
+
+def groq_call_kind() -> str:
+    """Names a completion by its route so the key doesn't depend on prompt text or route settings"""
+    route = _current_route.get()
+    if route is None:
+        raise RuntimeError(
+            "Recorded and replayed completions must go through the installed LLM"
+        )
+    return route
+
+
+def completion_to_chunks(completion: ChatCompletion) -> list[ChatCompletionChunk]:
+    """Splits a recorded answer into word chunks so it can be replayed to a streaming caller"""
+    words = (completion.choices[0].message.content or "").split(" ")
+    return [
+        ChatCompletionChunk.model_validate(
+            {
+                "id": completion.id,
+                "object": "chat.completion.chunk",
+                "created": completion.created,
+                "model": completion.model,
+                "x_groq": {"id": completion.id, "usage": None, "error": None},
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {"content": word if index == 0 else f" {word}"},
+                        "finish_reason": "stop" if index == len(words) - 1 else None,
+                    }
+                ],
+            }
+        )
+        for index, word in enumerate(words)
+    ]
+
+
+async def replay_stream(chunks: list[ChatCompletionChunk]):
+    for chunk in chunks:
+        yield chunk
+
+
+class _Completions:
+    def __init__(self, client: "GroqReplayClient"):
+        self._client = client
+
+    async def create(self, **kwargs):
+        return await self._client.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, client: "GroqReplayClient"):
+        self.completions = _Completions(client)
+
+
+class GroqReplayClient:
+    """Stands in for AsyncGroq, exposing chat.completions.create like the real client"""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        mode: str,
+        client=None,
+        latency: Optional[ReplayLatency] = None,
+    ):
+        self.cassette = cassette
+        self.mode = mode
+        self.client = client
+        self.latency = latency or ReplayLatency()
+        self.chat = _Chat(self)
+
+    async def create(self, **kwargs):
+        scope = _scope()
+        key = scope.next_key(f"groq:{groq_call_kind()}")
+        if self.mode == "record":
+            return await self._record(scope, key, kwargs)
+
+        recording = self.cassette.lookup(scope, key)
+        await asyncio.sleep(self.latency.seconds("groq", recording["seconds"]))
+        completion = ChatCompletion.model_validate(recording["response"])
+        if kwargs.get("stream"):
+            return replay_stream(completion_to_chunks(completion))
+        return completion
+
+    async def _record(self, scope: ReplayScope, key: str, kwargs: dict):
+        started_at = time.perf_counter()
+        if not kwargs.get("stream"):
+            completion = await self.client.chat.completions.create(**kwargs)
+            self.cassette.record(
+                scope, key, completion, time.perf_counter() - started_at
+            )
+            return completion
+
+        # Streams are stored as the completion they add up to
+        chunks = []
+        stream = await self.client.chat.completions.create(**kwargs)
+        async for chunk in stream:
+            chunks.append(chunk)
+        content = "".join(
+            chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices
+        )
+        first = chunks[0]
+        self.cassette.record(
+            scope,
+            key,
+            {
+                "id": first.id,
+                "object": "chat.completion",
+                "created": first.created,
+                "model": first.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+            time.perf_counter() - started_at,
+        )
+        return replay_stream(chunks)
+
+
+class QdrantReplayClient:
+    """Stands in for the AsyncQdrantClient used by RAG.get_documents (search and retrieve)"""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        mode: str,
+        client=None,
+        latency: Optional[ReplayLatency] = None,
+    ):
+        self.cassette = cassette
+        self.mode = mode
+        self.client = client
+        self.latency = latency or ReplayLatency()
+
+    async def _call(self, key: str, method: str, point_type, **kwargs):
+        scope = _scope()
+        key = scope.next_key(key)
+        if self.mode == "record":
+            started_at = time.perf_counter()
+            points = await getattr(self.client, method)(**kwargs)
+            self.cassette.record(
+                scope,
+                key,
+                [point.model_dump(mode="json") for point in points],
+                time.perf_counter() - started_at,
+            )
+            return points
+
+        recording = self.cassette.lookup(scope, key)
+        await asyncio.sleep(self.latency.seconds("qdrant", recording["seconds"]))
+        return [point_type.model_validate(point) for point in recording["response"]]
+
+    async def search(self, collection_name: str, **kwargs):
+        return await self._call(
+            f"qdrant:search:{collection_name}",
+            "search",
+            ScoredPoint,
+            collection_name=collection_name,
+            **kwargs,
+        )
+
+    async def retrieve(self, collection_name: str, ids, **kwargs):
+        return await self._call(
+            f"qdrant:retrieve:{collection_name}:{json.dumps(list(ids), default=str)}",
+            "retrieve",
+            Record,
+            collection_name=collection_name,
+            ids=ids,
+            **kwargs,
+        )
+
+
+def wrap_tool(
+    fn, cassette: Cassette, mode: str, latency: Optional[ReplayLatency] = None
+):
+    """Wraps an ONC tool so its responses are recorded or replayed (keeps fn's name and signature)"""
+    latency = latency or ReplayLatency()
+
+    @functools.wraps(fn)
+    async def wrapper(**kwargs):
+        scope = _scope()
+        arguments = {
+            name: value
+            for name, value in kwargs.items()
+            if name not in EXCLUDED_ARGUMENTS
+        }
+        key = scope.next_key(
+            f"onc:{fn.__name__}:{json.dumps(arguments, sort_keys=True, default=str)}"
+        )
+        user_onc_token = kwargs.get("user_onc_token")
+        if mode == "record":
+            started_at = time.perf_counter()
+            response = await fn(**kwargs)
+            recorded = to_jsonable(response)
+            if user_onc_token:
+                recorded = replace_text(recorded, user_onc_token, TOKEN_PLACEHOLDER)
+            cassette.record(scope, key, recorded, time.perf_counter() - started_at)
+            return response
+
+        recording = cassette.lookup(scope, key)
+        await asyncio.sleep(latency.seconds("onc", recording["seconds"]))
+        response = recording["response"]
+        if user_onc_token:
+            response = replace_text(response, TOKEN_PLACEHOLDER, user_onc_token)
+        return response
+
+    return wrapper
+
+
+def install(
+    llm, cassette: Cassette, mode: str, latency: Optional[ReplayLatency] = None
+) -> None:
+    """Routes an LLM's Groq, Qdrant and ONC calls through the cassette ("record" or "replay")"""
+    if mode not in ("record", "replay"):
+        raise ValueError(f"mode must be 'record' or 'replay', not {mode!r}")
+    llm.async_client = GroqReplayClient(
+        cassette, mode, client=llm.async_client, latency=latency
+    )
+    create_chat_completion = llm.create_chat_completion
+    stream_chat_completion = llm.stream_chat_completion
+
+    async def routed_completion(route: str, **kwargs):
+        with _route_scope(route):
+            return await create_chat_completion(route, **kwargs)
+
+    async def routed_stream(on_event, route: str, **kwargs):
+        with _route_scope(route):
+            return await stream_chat_completion(on_event, route, **kwargs)
+
+    # Groq only sees the request, the route names the recording
+    llm.create_chat_completion = routed_completion
+    llm.stream_chat_completion = routed_stream
+    llm.RAG_instance.async_qdrant_client = QdrantReplayClient(
+        cassette, mode, client=llm.RAG_instance.async_qdrant_client, latency=latency
+    )
+    # Local searches would bypass the cassette
+    llm.RAG_instance.index_mirror = None
+    llm.available_functions = {
+        name: wrap_tool(fn, cassette, mode, latency)
+        for name, fn in llm.available_functions.items()
+    }
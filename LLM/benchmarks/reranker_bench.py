@@ -0,0 +1,118 @@
+"""
+Compares the torch and int8 ONNX bge reranker backends on CPU.
+
+Every corpus prompt is reranked against the same candidate documents by both backends,
+like RAG.rerank does with the candidates of both collections. The report gives ms per
+query (p50/p95) for each backend, and how closely the ONNX ranking agrees with the torch
+one: Spearman rank correlation, how often the top document matches, and the overlap of
+the top 10. Candidates are the tool descriptions unless --documents names a JSONL file
+of {"text": ...} lines (e.g. exported vector DB payloads).
+
+The ONNX model is exported into --onnx-dir first if it isn't there yet.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.reranker_bench
+    python -m LLM.benchmarks.reranker_bench --documents chunks.jsonl --candidates 40
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+
+from LLM.benchmarks.conversation_bench import DEFAULT_CORPUS, load_corpus
+from LLM.Constants.tool_descriptions import toolDescriptions
+from LLM.onnx_reranker import (
+    QUANTIZED_MODEL_FILE,
+    RERANKER_MODEL_NAME,
+    OnnxCrossEncoder,
+    export_quantized,
+    ranking_agreement,
+)
+from LLM.tool_retriever import tool_text
+
+# Where RAG looks for the export unless RERANKER_ONNX_DIR is set
+DEFAULT_ONNX_DIR = (
+    Path(__file__).resolve().parents[1] / "models" / "bge-reranker-base-int8"
+)
+
+
+def load_documents(path) -> list[str]:
+    if path is None:
+        return [tool_text(tool) for tool in toolDescriptions]
+    with open(path) as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def time_backend(reranker, queries: list[list[tuple[str, str]]], warmup: int = 2):
+    """Scores and per-query milliseconds of a backend over every query"""
+    for pairs in queries[:warmup]:
+        reranker.score(pairs)
+    scores, latencies = [], []
+    for pairs in queries:
+        started_at = time.perf_counter()
+        scores.append(np.asarray(reranker.score(pairs)))
+        latencies.append((time.perf_counter() - started_at) * 1000)
+    return scores, latencies
+
+
+def main(args) -> None:
+    prompts = [example["user_prompt"] for example in load_corpus(args.corpus)]
+    documents = load_documents(args.documents)
+    queries = [
+        [
+            (prompt, documents[(index + offset) % len(documents)])
+            for offset in range(args.candidates)
+        ]
+        for index, prompt in enumerate(prompts)
+    ]
+
+    onnx_dir = Path(args.onnx_dir)
+    if not (onnx_dir / QUANTIZED_MODEL_FILE).exists():
+        print(f"Exporting int8 ONNX reranker to {onnx_dir}...")
+        export_quantized(RERANKER_MODEL_NAME, onnx_dir)
+    backends = {
+        "torch": HuggingFaceCrossEncoder(
+            model_name=RERANKER_MODEL_NAME, model_kwargs={"max_length": args.max_tokens}
+        ),
+        "onnx-int8": OnnxCrossEncoder(
+            str(onnx_dir), max_length=args.max_tokens, batch_size=args.batch_size
+        ),
+    }
+    results = {
+        name: time_backend(backend, queries) for name, backend in backends.items()
+    }
+
+    print(
+        f"{len(queries)} queries x {args.candidates} candidates, "
+        f"max {args.max_tokens} tokens per pair"
+    )
+    for name, (_, latencies) in results.items():
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(f"{name:>10}: p50 {p50:.1f} ms/query  p95 {p95:.1f} ms/query")
+
+    agreements = [
+        ranking_agreement(reference, candidate, top_k=10)
+        for reference, candidate in zip(results["torch"][0], results["onnx-int8"][0])
+    ]
+    print(
+        f"{'agreement':>10}: spearman {np.mean([a['spearman'] for a in agreements]):.3f}  "
+        f"top-1 {np.mean([a['top1_match'] for a in agreements]):.0%}  "
+        f"top-10 overlap {np.mean([a['top_k_overlap'] for a in agreements]):.0%}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--documents", type=Path)
+    parser.add_argument("--candidates", type=int, default=40)
+    parser.add_argument("--onnx-dir", default=str(DEFAULT_ONNX_DIR))
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=16)
+    main(parser.parse_args())
@@ -0,0 +1,145 @@
+"""
+Measures what retrieval records save over the pandas DataFrames they replaced.
+
+For the same ranked hits, the DataFrame path (a DataFrame per collection, joined with
+_append and serialized with to_string, as RAG and LLM.get_vectorDB_content used to) and
+the record path (RetrievedDocument lists and format_documents) build the vector content
+of the prompt. The report gives the microseconds each path spends per query after
+reranking, and the prompt tokens of the content it produces. Documents are the tool
+descriptions unless --documents names a JSONL file of {"text": ..., "source": ...} lines.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.retrieval_records_bench
+    python -m LLM.benchmarks.retrieval_records_bench --documents chunks.jsonl
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from LLM.Constants.tool_descriptions import toolDescriptions
+from LLM.prompt_budget import get_token_counter
+from LLM.RAG import RAG, RetrievedDocument, format_documents
+from LLM.tool_retriever import tool_text
+
+
+def load_documents(path) -> list[RetrievedDocument]:
+    if path is None:
+        texts = [(tool_text(tool), "tool_descriptions.py") for tool in toolDescriptions]
+    else:
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        texts = [(line["text"], line.get("source", "unknown")) for line in lines]
+    return [
+        RetrievedDocument(text, source, f"point-{index}", 1.0 - index / len(texts))
+        for index, (text, source) in enumerate(texts)
+    ]
+
+
+def dataframe_select(token_counter, documents, max_returns: int):
+    """RAG.select_documents as it was with DataFrames"""
+    if not documents:
+        return (pd.DataFrame({"contents": []}), [])
+    max_tokens = 2000
+    total_tokens = 0
+    selected_docs = []
+    for doc in documents:
+        doc_tokens = token_counter.count(doc.content)
+        if total_tokens + doc_tokens > max_tokens:
+            break
+        selected_docs.append(doc)
+        total_tokens += doc_tokens
+    df = pd.DataFrame(
+        {
+            "contents": [doc.content for doc in selected_docs],
+            "sources": [doc.source for doc in selected_docs],
+            "point_ids": [doc.point_id for doc in selected_docs],
+        }
+    )
+    df = df[:max_returns]
+    return (df, df["point_ids"])
+
+
+def dataframe_content(token_counter, general, function_calling):
+    general_results, _ = dataframe_select(token_counter, general, max_returns=10)
+    function_calling_results, point_ids = dataframe_select(
+        token_counter, function_calling, max_returns=1
+    )
+    response = general_results._append(function_calling_results)
+    sources = response["sources"].tolist() if "sources" in response.columns else []
+    return sources, list(point_ids), response.to_string(index=False)
+
+
+def records_content(rag, general, function_calling):
+    documents = rag.select_documents(general, max_returns=10) + rag.select_documents(
+        function_calling, max_returns=1
+    )
+    return (
+        [document.source for document in documents],
+        [document.point_id for document in documents[-1:]],
+        format_documents(documents),
+    )
+
+
+def time_path(build, queries, repeats: int) -> tuple[float, list[str]]:
+    """Microseconds per query and the content built for every query"""
+    contents = [build(*query)[2] for query in queries]
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            build(*query)
+    return (time.perf_counter() - started_at) / (repeats * len(queries)) * 1e6, contents
+
+
+def main(args) -> None:
+    documents = load_documents(args.documents)
+    rng = np.random.default_rng(0)
+    queries = [
+        (
+            list(rng.choice(documents, size=min(15, len(documents)), replace=False)),
+            list(rng.choice(documents, size=1)),
+        )
+        for _ in range(args.queries)
+    ]
+    token_counter = get_token_counter()
+    rag = object.__new__(RAG)
+    rag.token_counter = token_counter
+
+    results = {
+        "dataframe": time_path(
+            lambda general, function_calling: dataframe_content(
+                token_counter, general, function_calling
+            ),
+            queries,
+            args.repeats,
+        ),
+        "records": time_path(
+            lambda general, function_calling: records_content(
+                rag, general, function_calling
+            ),
+            queries,
+            args.repeats,
+        ),
+    }
+    print(f"{len(queries)} queries, {len(documents)} candidate documents")
+    for name, (microseconds, contents) in results.items():
+        tokens = [token_counter.count(content) for content in contents]
+        print(
+            f"{name:>10}: {microseconds:8.1f} us/query  "
+            f"{np.mean(tokens):7.1f} prompt tokens/query  "
+            f"{np.mean([len(content) for content in contents]):8.1f} chars/query"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--documents", type=Path)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,135 @@
+"""
+Measures what tool retrieval saves on the tool-selection call.
+
+Every corpus prompt is sent to Groq twice, once with all tool schemas and once with the
+schemas ToolRetriever picks, and the prompt tokens Groq reports, the latency and the
+tools the model called are compared. Vector DB content is left out so only the tool
+schemas differ. With --offline nothing is sent and prompt tokens are counted with the
+Llama tokenizer instead.
+
+Usage (from the repository root, needs GROQ_API_KEY unless --offline is given):
+    python -m LLM.benchmarks.tool_selection_bench
+    python -m LLM.benchmarks.tool_selection_bench --corpus my_prompts.jsonl --offline
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from LLM.benchmarks.context_check_eval import EmbeddingOnlyRAG
+from LLM.benchmarks.conversation_bench import DEFAULT_CORPUS, load_corpus
+from LLM.Constants.system_prompts import first_LLM_prompt, generate_system_prompt
+from LLM.Constants.tool_descriptions import toolDescriptions
+from LLM.Constants.utils import create_user_call
+from LLM.core import LLM
+from LLM.Environment import Environment
+from LLM.schemas import ObtainedParamsDictionary
+
+
+async def select_tools_with_llm(llm: LLM, messages: list[dict], tools: list[dict]):
+    """Returns (prompt tokens, seconds, names of the tools called)"""
+    started_at = time.perf_counter()
+    response = await llm.create_chat_completion(
+        "tool_selection" if tools else "conversational",
+        messages=messages,
+        stream=False,
+        **({"tools": tools, "tool_choice": "auto"} if tools else {}),
+        temperature=0,
+    )
+    elapsed = time.perf_counter() - started_at
+    tool_calls = response.choices[0].message.tool_calls or []
+    return (
+        response.usage.prompt_tokens,
+        elapsed,
+        sorted(call.function.name for call in tool_calls),
+    )
+
+
+def count_prompt_tokens(llm: LLM, messages: list[dict], tools: list[dict]) -> int:
+    return llm.token_counter.count_messages(messages) + (
+        llm.token_counter.count(json.dumps(tools)) if tools else 0
+    )
+
+
+def summarize(name: str, tokens: list[int], latencies: list[float]) -> None:
+    line = f"{name:>9}: prompt tokens mean {np.mean(tokens):.0f}"
+    if latencies:
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        line += f"  latency p50 {p50:.0f}ms p95 {p95:.0f}ms"
+    print(line)
+
+
+async def main(corpus_path: Path, offline: bool):
+    corpus = load_corpus(corpus_path)
+    llm = LLM(Environment(), RAG_instance=EmbeddingOnlyRAG())
+    system_prompt = generate_system_prompt(
+        first_LLM_prompt,
+        context={"current_date": datetime.now().strftime("%Y-%m-%d")},
+    )
+    results = {"all": ([], []), "retrieved": ([], [])}
+    mismatches = []
+    try:
+        for example in corpus:
+            chat_history = example.get("chat_history", [])
+            messages = [
+                {"role": "system", "content": system_prompt},
+                *chat_history,
+                {
+                    "role": "user",
+                    "content": create_user_call(
+                        user_prompt=example["user_prompt"], vector_content=""
+                    ),
+                },
+            ]
+            retrieved = llm.select_tools(
+                example["user_prompt"],
+                await llm.embed_query(example["user_prompt"]),
+                chat_history,
+                ObtainedParamsDictionary(),
+            )
+            called = {}
+            for name, tools in [("all", toolDescriptions), ("retrieved", retrieved)]:
+                tokens, latencies = results[name]
+                if offline:
+                    tokens.append(count_prompt_tokens(llm, messages, tools))
+                    continue
+                prompt_tokens, elapsed, called[name] = await select_tools_with_llm(
+                    llm, messages, tools
+                )
+                tokens.append(prompt_tokens)
+                latencies.append(elapsed)
+            print(
+                f"{example['id']}: {len(retrieved)} tools "
+                f"{[tool['function']['name'] for tool in retrieved]}"
+            )
+            if not offline and called["all"] != called["retrieved"]:
+                mismatches.append((example["id"], called["all"], called["retrieved"]))
+
+        print(f"{len(corpus)} prompts from {corpus_path}")
+        for name, (tokens, latencies) in results.items():
+            summarize(name, tokens, latencies)
+        if not offline:
+            print(
+                f"same tools called for {len(corpus) - len(mismatches)} of {len(corpus)} prompts"
+            )
+            for example_id, with_all, with_retrieved in mismatches:
+                print(
+                    f"  {example_id}: all tools called {with_all}, retrieved called {with_retrieved}"
+                )
+    finally:
+        await llm.env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.corpus, args.offline))
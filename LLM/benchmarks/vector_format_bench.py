@@ -0,0 +1,181 @@
+"""
+Compares retrieval quality and latency of a collection rebuilt in other vector formats.
+
+The source collection (full 1024-dim float32 vectors) is copied into one temporary
+collection per format, the way LLM.migrate_vector_format rebuilds it, then every query
+is searched in each. Hits are compared with an exact search of the source: recall of its top --limit
+hits and how often the top hit matches. The report also gives ms per search (p50/p95)
+and the RAM the vectors take for search (quantized originals stay on disk). Temporary
+collections are deleted afterwards unless --keep is given.
+
+Queries are the corpus prompts embedded with jina-embeddings-v3. By default the general
+collection of the configured Qdrant (QDRANT_URL) is used. With --synthetic N, N random
+vectors whose variance decays across dimensions (like Matryoshka embeddings, where the
+first dimensions carry the most) are searched in an in-memory Qdrant instead, with
+noisy copies of stored vectors as queries. That needs neither a server nor the model,
+but in-memory Qdrant searches exactly and doesn't quantize, so only the truncation
+effect shows up in its quality numbers.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.vector_format_bench
+    python -m LLM.benchmarks.vector_format_bench --formats 1024:float32 512:int8 256:binary
+    python -m LLM.benchmarks.vector_format_bench --synthetic 5000
+"""
+
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import Distance, PointStruct, SearchParams, VectorParams
+
+from LLM.benchmarks.conversation_bench import DEFAULT_CORPUS, load_corpus
+from LLM.Environment import Environment
+from LLM.RAG import JinaEmbeddings
+from LLM.vector_format import (
+    FULL_DIMENSIONS,
+    VectorFormat,
+    migrate_collection,
+    wait_until_indexed,
+)
+
+DEFAULT_FORMATS = [
+    "1024:float32",
+    "1024:float16",
+    "1024:int8",
+    "1024:binary",
+    "512:int8",
+    "512:binary",
+    "256:int8",
+    "256:float32",
+]
+SYNTHETIC_COLLECTION = "vector_format_bench"
+
+
+def parse_format(text: str) -> VectorFormat:
+    dimensions, storage = text.split(":")
+    return VectorFormat(dimensions=int(dimensions), storage=storage)
+
+
+async def synthetic_collection(points: int, queries: int):
+    """An in-memory collection of decaying-variance vectors and noisy queries near them"""
+    rng = np.random.default_rng(0)
+    scales = 1 / np.sqrt(np.arange(1, FULL_DIMENSIONS + 1))
+    vectors = rng.normal(size=(points, FULL_DIMENSIONS)) * scales
+    client = AsyncQdrantClient(location=":memory:")
+    await client.create_collection(
+        SYNTHETIC_COLLECTION,
+        vectors_config=VectorParams(size=FULL_DIMENSIONS, distance=Distance.COSINE),
+    )
+    await client.upsert(
+        SYNTHETIC_COLLECTION,
+        points=[
+            PointStruct(id=index, vector=vector.tolist(), payload={"source": "bench"})
+            for index, vector in enumerate(vectors)
+        ],
+    )
+    rows = vectors[rng.integers(points, size=queries)]
+    query_vectors = rows + rng.normal(size=rows.shape) * scales
+    return client, SYNTHETIC_COLLECTION, query_vectors
+
+
+async def search_all(
+    client, collection_name: str, vector_format: VectorFormat, queries, limit: int
+):
+    """Hit ids and per-search milliseconds of every query"""
+    search_params = vector_format.search_params()
+    hits, latencies = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        results = await client.search(
+            collection_name,
+            query_vector=vector_format.truncate(query).tolist(),
+            limit=limit,
+            search_params=search_params,
+        )
+        latencies.append((time.perf_counter() - started_at) * 1000)
+        hits.append([hit.id for hit in results])
+    return hits, latencies
+
+
+async def run(args) -> None:
+    if args.synthetic:
+        client, source, queries = await synthetic_collection(
+            args.synthetic, args.queries
+        )
+    else:
+        env = Environment()
+        client = AsyncQdrantClient(
+            url=env.get_qdrant_url(),
+            api_key=env.get_qdrant_api_key(),
+            timeout=int(env.get_qdrant_timeout()),
+        )
+        source = args.collection or env.get_general_collection_name()
+        embedding = JinaEmbeddings()
+        prompts = [example["user_prompt"] for example in load_corpus(args.corpus)]
+        queries = [embedding.encode_query(prompt) for prompt in prompts]
+
+    points = (await client.count(source, exact=True)).count
+    exact = VectorFormat()
+    reference = []
+    for query in queries:
+        results = await client.search(
+            source,
+            query_vector=np.asarray(query, dtype=np.float32).tolist(),
+            limit=args.limit,
+            search_params=SearchParams(exact=True),
+        )
+        reference.append([hit.id for hit in results])
+
+    print(f"{source}: {points} points, {len(queries)} queries, top {args.limit}")
+    print(
+        f"{'format':>14}  {'recall':>7}  {'top-1':>6}  {'p50 ms':>7}  {'p95 ms':>7}  "
+        f"{'vector RAM':>10}"
+    )
+    for vector_format in [parse_format(text) for text in args.formats]:
+        target = f"{source}_bench_{vector_format.dimensions}_{vector_format.storage}"
+        await migrate_collection(client, source, target, vector_format)
+        try:
+            await wait_until_indexed(client, target)
+            hits, latencies = await search_all(
+                client, target, vector_format, queries, args.limit
+            )
+        finally:
+            if not args.keep:
+                await client.delete_collection(target)
+        recall = np.mean(
+            [
+                len(set(found) & set(expected)) / max(len(expected), 1)
+                for found, expected in zip(hits, reference)
+            ]
+        )
+        top1 = np.mean(
+            [
+                bool(found) and bool(expected) and found[0] == expected[0]
+                for found, expected in zip(hits, reference)
+            ]
+        )
+        p50, p95 = np.percentile(latencies, [50, 95])
+        vector_mb = points * vector_format.bytes_per_vector() / 2**20
+        print(
+            f"{str(vector_format):>14}  {recall:7.1%}  {top1:6.0%}  {p50:7.2f}  "
+            f"{p95:7.2f}  {vector_mb:7.1f} MB"
+        )
+    print(f"(full precision needs {points * exact.bytes_per_vector() / 2**20:.1f} MB)")
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--collection")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--synthetic", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--keep", action="store_true")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""
+Compares search in the in-process vector index mirror with search in Qdrant.
+
+The collection is loaded into a VectorIndexMirror like RAG does at startup, then the
+same queries are run against Qdrant and the mirror. Queries are stored vectors with
+noise added, so they land near real documents like question embeddings do. The report
+gives the load time, the mirror's memory footprint, ms per search (p50/p95) for each
+side, and the overlap of their top hits (1.0 when the mirror returns exactly Qdrant's).
+
+By default the general collection of the configured Qdrant (QDRANT_URL) is used. With
+--synthetic N a collection of N random vectors is built in an in-memory Qdrant instead,
+which needs no server but leaves the network out of the remote timings.
+
+Usage (from the repository root):
+    python -m LLM.benchmarks.vector_index_bench
+    python -m LLM.benchmarks.vector_index_bench --collection my_collection --limit 20
+    python -m LLM.benchmarks.vector_index_bench --synthetic 5000
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+from LLM.Environment import Environment
+from LLM.vector_index import VectorIndexMirror
+
+SYNTHETIC_COLLECTION = "vector_index_bench"
+
+
+async def synthetic_client(points: int, dims: int) -> AsyncQdrantClient:
+    client = AsyncQdrantClient(location=":memory:")
+    await client.create_collection(
+        SYNTHETIC_COLLECTION,
+        vectors_config=VectorParams(size=dims, distance=Distance.COSINE),
+    )
+    vectors = np.random.default_rng(0).normal(size=(points, dims))
+    await client.upsert(
+        SYNTHETIC_COLLECTION,
+        points=[
+            PointStruct(id=index, vector=vector.tolist(), payload={"text": "x" * 1000})
+            for index, vector in enumerate(vectors)
+        ],
+    )
+    return client
+
+
+def percentiles(latencies: list[float]) -> str:
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return f"p50 {p50:.2f} ms/search  p95 {p95:.2f} ms/search"
+
+
+async def run(args) -> None:
+    if args.synthetic:
+        client = await synthetic_client(args.synthetic, args.dims)
+        collection_name = SYNTHETIC_COLLECTION
+    else:
+        env = Environment()
+        client = AsyncQdrantClient(
+            url=env.get_qdrant_url(), api_key=env.get_qdrant_api_key()
+        )
+        collection_name = args.collection or env.get_general_collection_name()
+
+    mirror = VectorIndexMirror(client, [collection_name], max_points=args.max_points)
+    started_at = time.perf_counter()
+    await mirror.sync_collection(collection_name)
+    load_seconds = time.perf_counter() - started_at
+    collection = mirror.collections.get(collection_name)
+    if collection is None:
+        raise SystemExit(f"{collection_name} can't be mirrored, see the log")
+
+    rng = np.random.default_rng(1)
+    rows = collection.matrix[rng.integers(len(collection.ids), size=args.queries)]
+    queries = rows + rng.normal(scale=args.noise, size=rows.shape) * np.linalg.norm(
+        rows, axis=1, keepdims=True
+    ) / np.sqrt(rows.shape[1])
+
+    remote_latencies, local_latencies, overlaps = [], [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        remote = await client.search(
+            collection_name,
+            query_vector=query.tolist(),
+            limit=args.limit,
+            with_payload=True,
+        )
+        remote_latencies.append((time.perf_counter() - started_at) * 1000)
+        started_at = time.perf_counter()
+        local = mirror.search(collection_name, query, args.limit)
+        local_latencies.append((time.perf_counter() - started_at) * 1000)
+        overlaps.append(
+            len({hit.id for hit in remote} & {hit.id for hit in local})
+            / max(len(remote), 1)
+        )
+    await client.close()
+
+    stats = mirror.stats()["collections"][collection_name]
+    print(
+        f"{collection_name}: {stats['points']} points x {stats['dimensions']} dims, "
+        f"loaded in {load_seconds:.2f} s, {stats['memory_mb']} MB in process"
+    )
+    print(f"{len(queries)} searches, top {args.limit}")
+    print(f"{'qdrant':>8}: {percentiles(remote_latencies)}")
+    print(f"{'mirror':>8}: {percentiles(local_latencies)}")
+    print(f"{'overlap':>8}: {np.mean(overlaps):.1%} of Qdrant's hits")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--collection")
+    parser.add_argument("--synthetic", type=int, default=0)
+    parser.add_argument("--dims", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--max-points", type=int, default=50000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,115 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+# ONC device category and location codes, e.g. CTD, ICEPROFILER, CBYIP, CBYSS.M2
+CODE_PATTERN = re.compile(r"\b[A-Z][A-Z0-9]{2,}(?:\.[A-Z0-9]+)*\b")
+# Words that only make sense with the previous turns, e.g. "which of those measures salinity?".
+# "it" only counts opening the prompt ("it says...", "and its depth?"), elsewhere it is
+# usually a dummy subject ("how windy was it at noon?")
+FOLLOW_UP_PATTERN = re.compile(
+    r"^\s*(and\s+)?(it|its)\b"
+    r"|\b(those|these|them|they|same|previous|above|again"
+    r"|that (day|week|month|year|time|device|instrument|sensor)"
+    r"|the (day|week|month|year) (after|before))\b",
+    re.IGNORECASE,
+)
+# Codes that show up in ordinary questions without naming a device or location
+IGNORED_CODES = {"ONC", "API", "UTC", "CSV", "PDF", "PNG", "WAV"}
+
+
+def extract_codes(text: str) -> set[str]:
+    return set(CODE_PATTERN.findall(text or "")) - IGNORED_CODES
+
+
+class ContextClassifier:
+    """
+    Decides locally whether a follow-up question belongs to the current conversation,
+    replacing the one-token Groq call. In order:
+      1. Device/location codes: shared codes mean related, disjoint codes mean the user
+         moved on to a different device or data product.
+      2. Follow-up words ("those", "same", "the day after") mean related.
+      3. Otherwise the question is related if its embedding is close enough to one of
+         the recent turns.
+    """
+
+    def __init__(
+        self,
+        embed_query: Callable[[str], list[float]],
+        similarity_threshold: float = 0.5,
+        recent_turns: int = 2,
+        max_cached_turns: int = 1024,
+    ):
+        self.embed_query = embed_query
+        self.similarity_threshold = similarity_threshold
+        # Number of previous question/answer pairs compared against
+        self.recent_turns = recent_turns
+        self.max_cached_turns = max_cached_turns
+        # Previous turns come back on every follow-up so their embeddings are kept
+        self._turn_embeddings: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _embed_turn(self, text: str) -> np.ndarray:
+        with self._lock:
+            if text in self._turn_embeddings:
+                self._turn_embeddings.move_to_end(text)
+                return self._turn_embeddings[text]
+        embedding = self._normalize(self.embed_query(text))
+        with self._lock:
+            self._turn_embeddings[text] = embedding
+            while len(self._turn_embeddings) > self.max_cached_turns:
+                self._turn_embeddings.popitem(last=False)
+        return embedding
+
+    def max_similarity(
+        self, user_prompt: str, recent_texts: list[str], query_embedding=None
+    ) -> float:
+        if not recent_texts:
+            return 0.0
+        if query_embedding is None:
+            query_embedding = self.embed_query(user_prompt)
+        query = self._normalize(query_embedding)
+        return max(float(self._embed_turn(text) @ query) for text in recent_texts)
+
+    def is_related(
+        self,
+        user_prompt: str,
+        chat_history: list[dict],
+        query_embedding: Optional[list[float]] = None,
+    ) -> bool:
+        # chat_history is most recent first, one user and one system entry per turn
+        recent_texts = [
+            turn["content"]
+            for turn in chat_history[: self.recent_turns * 2]
+            if turn.get("content")
+        ]
+        if not recent_texts:
+            return False
+
+        decision = self.heuristic_decision(user_prompt, recent_texts)
+        if decision is not None:
+            return decision
+        return (
+            self.max_similarity(user_prompt, recent_texts, query_embedding)
+            >= self.similarity_threshold
+        )
+
+    @staticmethod
+    def heuristic_decision(user_prompt: str, recent_texts: list[str]) -> Optional[bool]:
+        """Steps 1 and 2, None when neither decides and the embeddings have to"""
+        prompt_codes = extract_codes(user_prompt)
+        history_codes = set().union(*(extract_codes(text) for text in recent_texts))
+        if prompt_codes and history_codes:
+            return not prompt_codes.isdisjoint(history_codes)
+        if FOLLOW_UP_PATTERN.search(user_prompt):
+            return True
+        return None
@@ -1,10 +1,12 @@
+import asyncio
 import json
 import logging
+import os
 import sys
+import time
 from collections import OrderedDict
 from datetime import datetime
-
-import pandas as pd
+from typing import Awaitable, Callable, Optional
 
 from LLM.Constants.status_codes import StatusCode
 from LLM.Constants.system_prompts import (
@@ -19,10 +21,25 @@ from LLM.Constants.utils import (
     handle_plotting_requests,
     handle_scalar_request,
 )
+from LLM.context_classifier import ContextClassifier
 from LLM.data_download import generate_download_codes
 from LLM.general_data import get_scalar_data
-from LLM.RAG import RAG
+from LLM.llm_gateway import LLMGateway, llm_route
+from LLM.model_router import ModelRouter
+from LLM.prompt_budget import (
+    MESSAGE_OVERHEAD_TOKENS,
+    PromptBudgeter,
+    PromptSection,
+    get_token_counter,
+)
+from LLM.RAG import RAG, format_documents
 from LLM.schemas import ObtainedParamsDictionary, RunConversationResponse, ToolCall
+from LLM.semantic_cache import SemanticAnswerCache
+from LLM.single_flight import SingleFlight, normalize_prompt
+from LLM.timing import stage
+from LLM.tool_cache import ToolResultCache, replace_text
+from LLM.tool_renderers import TOOL_RENDERERS, render_tool_responses
+from LLM.tool_retriever import ToolRetriever, is_conversational
 from LLM.tools_sprint1 import (
     get_active_instruments_at_cambridge_bay,
     get_daily_sea_temperature_stats_cambridge_bay,
@@ -40,15 +57,94 @@ from LLM.tools_sprint2 import (
 
 logger = logging.getLogger(__name__)
 
+# Receives progress events (stage changes and answer tokens) while a conversation runs
+EventCallback = Callable[[str, dict], Awaitable[None]]
+
+# Tools that place orders or carry obtainedParams between turns. These keep running
+# sequentially because their response can end the conversation turn early.
+ORDER_DEPENDENT_TOOLS = {
+    "generate_download_codes",
+    "get_scalar_data",
+    "get_ship_noise_acoustic_for_date",
+    "plot_spectrogram_for_date",
+}
+
+# Tools that collect parameters over several turns, offered while obtainedParams is pending
+PENDING_PARAMS_TOOLS = {"generate_download_codes", "get_scalar_data"}
+
+# Results that belong to the user who asked, a coalesced request computes its own instead
+UNSHARED_STATUSES = {
+    StatusCode.PROCESSING_DATA_DOWNLOAD,
+    StatusCode.ERROR_WITH_DATA_DOWNLOAD,
+}
+
 sys.modules["LLM"] = sys.modules[__name__]
+# Keeps submodules that nothing imported yet, like the benchmarks, importable as LLM.<name>
+__path__ = [os.path.dirname(__file__)]
+
+
+async def ignore_event(event: str, data: dict) -> None:
+    return None
 
 
 class LLM:
     def __init__(self, env, *, RAG_instance=None):
         self.env = env
-        self.client = env.get_client()
-        self.model = env.get_model()
+        self.async_client = env.get_async_client()
+        # Caps in-flight Groq calls so one worker can interleave many conversations
+        self.llm_semaphore = asyncio.Semaphore(env.get_max_concurrent_llm_calls())
+        # Picks the model and max_completion_tokens for each kind of LLM call
+        self.model_router = ModelRouter.from_overrides(
+            env.get_model_routes(),
+            min_samples=env.get_model_routing_min_samples(),
+            headroom=env.get_model_routing_headroom(),
+        )
+        self.tool_timeout = env.get_tool_timeout()
         self.RAG_instance: RAG = RAG_instance or RAG(env=self.env)
+        self.answer_cache = (
+            SemanticAnswerCache(
+                similarity_threshold=env.get_semantic_cache_threshold(),
+                ttl_seconds=env.get_semantic_cache_ttl(),
+                max_entries=env.get_semantic_cache_max_entries(),
+            )
+            if env.get_semantic_cache_enabled()
+            else None
+        )
+        self.tool_cache = (
+            ToolResultCache(
+                max_entries=env.get_tool_cache_max_entries(),
+                recent_ttl_seconds=env.get_tool_cache_recent_ttl(),
+                settle_days=env.get_tool_cache_settle_days(),
+            )
+            if env.get_tool_cache_enabled()
+            else None
+        )
+        # Identical first-turn questions in flight at the same time share one pipeline run
+        self.single_flight = SingleFlight() if env.get_single_flight_enabled() else None
+        self.token_counter = get_token_counter()
+        self.prompt_budgeter = PromptBudgeter(
+            self.token_counter, max_prompt_tokens=env.get_max_prompt_tokens()
+        )
+        # Only the tool schemas relevant to the prompt are sent with the tool-selection call
+        self.tool_retriever = (
+            ToolRetriever(
+                self.RAG_instance.embedding.embed_documents,
+                self.RAG_instance.embedding.embed_query,
+                toolDescriptions,
+                top_k=env.get_tool_retrieval_top_k(),
+                min_similarity=env.get_tool_retrieval_min_similarity(),
+            )
+            if env.get_tool_retrieval_enabled()
+            else None
+        )
+        self.context_classifier = (
+            ContextClassifier(
+                self.RAG_instance.embedding.embed_query,
+                similarity_threshold=env.get_context_similarity_threshold(),
+            )
+            if env.get_context_check_mode() == "local"
+            else None
+        )
         self.available_functions = {
             "get_daily_sea_temperature_stats_cambridge_bay": get_daily_sea_temperature_stats_cambridge_bay,
             "get_deployed_devices_over_time_interval": get_deployed_devices_over_time_interval,
@@ -63,30 +159,70 @@ class LLM:
             "get_scalar_data": get_scalar_data,
             "get_time_range_of_available_data": get_time_range_of_available_data,
         }
+        # Tools whose result is rendered into the answer locally, skipping the second LLM call
+        rendered_tools = env.get_template_rendered_tools()
+        self.tool_renderers = {
+            function_name: renderer
+            for function_name, renderer in TOOL_RENDERERS.items()
+            if rendered_tools is None or function_name in rendered_tools
+        }
 
     async def get_vectorDB_content(
-        self, user_prompt: str, previous_vdb_ids: list[str] = []
+        self, user_prompt: str, previous_vdb_ids: list[str] = [], query_embedding=None
     ):
-        (vectorDBResponse, point_ids) = self.RAG_instance.get_documents(
-            user_prompt, previous_vdb_ids
+        documents, point_ids = await self.RAG_instance.get_documents(
+            user_prompt,
+            previous_vdb_ids,
+            query_embedding=query_embedding,
         )
-        print("Vector DB Response:", vectorDBResponse)
-        sources = []
-        if isinstance(vectorDBResponse, pd.DataFrame):
-            if vectorDBResponse.empty:
-                vector_content = ""
-            else:
-                if "sources" in vectorDBResponse.columns:
-                    # we need a list of sources to return with the LLM response
-                    sources = vectorDBResponse["sources"].tolist()
-                # Convert DataFrame to a more readable format
-                vector_content = vectorDBResponse.to_string(index=False)
-        else:
-            vector_content = str(vectorDBResponse)
+        # we need a list of sources to return with the LLM response
+        sources = [document.source for document in documents]
+        vector_content = format_documents(documents)
         print("FULL Vector DB Response:", vector_content)
 
         return sources, point_ids, vector_content
 
+    async def check_keep_context(
+        self, user_prompt: str, chat_history: list[dict], query_embedding=None
+    ):
+        """Check if the new user prompt is related to the previous conversation. If its not then the conversation history should be removed."""
+        with stage("keep_context"):
+            if self.context_classifier is None:
+                return await self.check_keep_context_with_llm(user_prompt, chat_history)
+            return await asyncio.to_thread(
+                self.context_classifier.is_related,
+                user_prompt,
+                chat_history,
+                query_embedding,
+            )
+
+    async def embed_query(self, user_prompt: str):
+        """Embeds the question off the event loop so it can be shared by retrieval, caches and the context check"""
+        with stage("query_embedding"):
+            return await asyncio.to_thread(
+                self.RAG_instance.embedding.embed_query, user_prompt
+            )
+
+    async def check_keep_context_with_llm(
+        self, user_prompt: str, chat_history: list[dict]
+    ):
+        """Asks the LLM for a one token yes/no answer, used when CONTEXT_CHECK_MODE=llm"""
+        contextPrompt = f"""User’s new question: {user_prompt}
+            Previous conversation snippet: {chat_history}
+
+            Is this new question related to previous conversation? Answer yes or no.
+            Note: it is not related if the previous conversation was about a different device or data product.
+        """
+        messages = [{"role": "system", "content": contextPrompt}]
+        keepContext = await self.create_chat_completion(
+            "keep_context",  # Small model, one token
+            messages=messages,  # Includes Conversation history
+            stream=False,
+            temperature=0,  # A temperature of 1=default balance between randomnes and confidence. Less than 1 is less randomness, Greater than is more randomness
+        )
+        print("Keep context response:", keepContext.choices[0].message.content)
+        return keepContext.choices[0].message.content.lower() != "no"
+
     async def run_conversation(
         self,
         user_prompt: str,
@@ -94,7 +230,70 @@ class LLM:
         chat_history: list[dict] = [],
         obtained_params: ObtainedParamsDictionary = ObtainedParamsDictionary(),
         previous_vdb_ids: list[str] = [],
+        on_event: Optional[EventCallback] = None,
+    ) -> RunConversationResponse:
+        """
+        Runs one conversation turn. If on_event is given it is awaited with stage events
+        while the pipeline runs and the final answer is streamed to it token by token.
+        A first-turn question that is already being answered for someone else waits
+        for that answer instead of running the pipeline again.
+        """
+        if (
+            self.single_flight is None
+            or chat_history
+            or previous_vdb_ids
+            or obtained_params != ObtainedParamsDictionary()
+        ):
+            return await self.compute_conversation(
+                user_prompt,
+                user_onc_token,
+                chat_history,
+                obtained_params,
+                previous_vdb_ids,
+                on_event,
+            )
+
+        user_onc_token = user_onc_token or self.env.get_onc_token()
+
+        async def compute_shared() -> tuple[RunConversationResponse, str]:
+            result = await self.compute_conversation(
+                user_prompt, user_onc_token, on_event=on_event
+            )
+            return result, user_onc_token
+
+        (result, leader_onc_token), is_leader = await self.single_flight.run(
+            normalize_prompt(user_prompt), compute_shared
+        )
+        if is_leader:
+            return result
+        if result.status in UNSHARED_STATUSES or result.dpRequestId is not None:
+            # Data product orders are placed with the leader's token
+            return await self.compute_conversation(
+                user_prompt, user_onc_token, on_event=on_event
+            )
+        # The leader's ONC token can sit anywhere in the result (urlParamsUsed, baseUrl)
+        shared_result = result.model_copy(deep=True)
+        if leader_onc_token and user_onc_token and leader_onc_token != user_onc_token:
+            shared_result = RunConversationResponse.model_validate(
+                replace_text(result.model_dump(), leader_onc_token, user_onc_token)
+            )
+        await (on_event or ignore_event)(
+            "token", {"content": shared_result.response or ""}
+        )
+        return shared_result
+
+    async def compute_conversation(
+        self,
+        user_prompt: str,
+        user_onc_token: str,
+        chat_history: list[dict] = [],
+        obtained_params: ObtainedParamsDictionary = ObtainedParamsDictionary(),
+        previous_vdb_ids: list[str] = [],
+        on_event: Optional[EventCallback] = None,
     ) -> RunConversationResponse:
+        """Runs the retrieval, tool and answer pipeline for one conversation turn"""
+        stream_answer = on_event is not None
+        on_event = on_event or ignore_event
         point_ids: list[str] = []
         sources: list[str] = []
         try:
@@ -107,31 +306,65 @@ class LLM:
             )
             # If the user requests an example of data without specifying the `dateFrom` or `dateTo` parameters, use the most recent available dates for the requested device.
 
-            sources, point_ids, vector_content = await self.get_vectorDB_content(
-                user_prompt, previous_vdb_ids=previous_vdb_ids
-            )
+            started_at = time.perf_counter()
+            user_onc_token = user_onc_token or self.env.get_onc_token()
+            query_embedding = None
+            # Only set when the answer cache was looked up, so only those answers are stored
+            cache_embedding = None
+            if self.answer_cache is not None:
+                # Follow-up turns depend on the history and pending params so only a fresh question can be cached
+                if (
+                    not chat_history
+                    and not previous_vdb_ids
+                    and obtained_params == ObtainedParamsDictionary()
+                ):
+                    query_embedding = await self.embed_query(user_prompt)
+                    cache_embedding = query_embedding
+                    cached_response = self.answer_cache.lookup(
+                        query_embedding, current_date, user_onc_token
+                    )
+                    if cached_response is not None:
+                        await on_event(
+                            "token", {"content": cached_response.response or ""}
+                        )
+                        return cached_response
+                else:
+                    self.answer_cache.record_bypass()
+            if query_embedding is None and (
+                self.tool_retriever is not None
+                or (chat_history and self.context_classifier is not None)
+            ):
+                # Retrieval, tool retrieval and the local context check share one query embedding
+                query_embedding = await self.embed_query(user_prompt)
 
-            if (
-                len(chat_history) > 0
-            ):  # if its not the first message in the conversation
-                # Check if the new user prompt is related to the previous conversation. If its not then remove conversation history. If it is then keep the conversation history.
-                contextPrompt = f"""User’s new question: {user_prompt}
-                    Previous conversation snippet: {chat_history}
-
-                    Is this new question related to previous conversation? Answer yes or no.
-                    Note: it is not related if the previous conversation was about a different device or data product.
-                """
-                messages = [{"role": "system", "content": contextPrompt}]
-                keepContext = self.client.chat.completions.create(
-                    model=self.model,  # LLM to use
-                    messages=messages,  # Includes Conversation history
-                    stream=False,
-                    max_completion_tokens=1,  # Maximum number of tokens to allow in our response
-                    temperature=0,  # A temperature of 1=default balance between randomnes and confidence. Less than 1 is less randomness, Greater than is more randomness
+            await on_event("stage", {"stage": "retrieving"})
+            # Retrieval and the keep-context check don't depend on each other so run them concurrently.
+            # If either one fails the TaskGroup cancels the other.
+            async with asyncio.TaskGroup() as task_group:
+                vector_task = task_group.create_task(
+                    self.get_vectorDB_content(
+                        user_prompt,
+                        previous_vdb_ids=previous_vdb_ids,
+                        query_embedding=query_embedding,
+                    )
                 )
-                print("Keep context response:", keepContext.choices[0].message.content)
-                if keepContext.choices[0].message.content.lower() == "no":
-                    chat_history = []
+                keep_context_task = None
+                # if its not the first message in the conversation
+                if len(chat_history) > 0:
+                    keep_context_task = task_group.create_task(
+                        self.check_keep_context(
+                            user_prompt, chat_history, query_embedding
+                        )
+                    )
+            sources, point_ids, vector_content = vector_task.result()
+            if keep_context_task is not None and not keep_context_task.result():
+                chat_history = []
+            tools = self.select_tools(
+                user_prompt, query_embedding, chat_history, obtained_params
+            )
+            chat_history, vector_content = self.fit_first_prompt(
+                startingPrompt, user_prompt, chat_history, vector_content, tools
+            )
 
             # qa_docs = self.RAG_instance.get_qa_docs(user_prompt)
 
@@ -170,20 +403,20 @@ class LLM:
                 },
             ]
 
-            response = self.client.chat.completions.create(
-                model=self.model,  # LLM to use
-                messages=messages,  # Includes Conversation history
-                stream=False,
-                tools=toolDescriptions,  # Available tools (i.e. functions) for our LLM to use
-                tool_choice="auto",  # Let our LLM decide when to use tools
-                max_completion_tokens=4096,  # Maximum number of tokens to allow in our response
-                temperature=0,  # A temperature of 1=default balance between randomnes and confidence. Less than 1 is less randomness, Greater than is more randomness
-            )
+            await on_event("stage", {"stage": "selecting_tools"})
+            with stage("tool_selection_llm"):
+                response = await self.create_chat_completion(
+                    self.tool_selection_route(user_prompt, tools),
+                    messages=messages,  # Includes Conversation history
+                    stream=False,
+                    # Available tools (i.e. functions) for our LLM to use, and let our LLM decide when to use them.
+                    # Groq rejects an empty tools list.
+                    **({"tools": tools, "tool_choice": "auto"} if tools else {}),
+                    temperature=0,  # A temperature of 1=default balance between randomnes and confidence. Less than 1 is less randomness, Greater than is more randomness
+                )
 
             response_message = response.choices[0].message
             tool_calls = response_message.tool_calls
-            doing_data_download = False
-            doing_scalar_request = False
             if tool_calls:
                 tool_calls = list(
                     OrderedDict(
@@ -192,36 +425,62 @@ class LLM:
                     ).values()
                 )
                 print("Unique tool calls:", tool_calls)
-                toolMessages = []
+                parsed_tool_calls = []
                 for tool_call in tool_calls:
-                    # print()
                     function_name = tool_call.function.name
-
                     if function_name in self.available_functions:
-                        if function_name == "generate_download_codes":
-                            # Special case for download codes
-                            doing_data_download = True
-                        if function_name == "get_scalar_data":
-                            doing_scalar_request = True
                         try:
                             function_args = json.loads(tool_call.function.arguments)
                         except json.JSONDecodeError:
                             function_args = {}
+                        parsed_tool_calls.append((function_name, function_args or {}))
+
+                # Independent tools only read data so start them all at once.
+                # Tools that can return early still run one at a time, in order, below.
+                independent_tool_tasks = {
+                    index: asyncio.create_task(
+                        self.call_independent_tool(
+                            function_name, function_args, user_onc_token
+                        )
+                    )
+                    for index, (function_name, function_args) in enumerate(
+                        parsed_tool_calls
+                    )
+                    if function_name not in ORDER_DEPENDENT_TOOLS
+                }
+                toolMessages = []
+                function_response = {}
+                tool_responses = []
+                tool_failed = False
+                try:
+                    for index, (function_name, function_args) in enumerate(
+                        parsed_tool_calls
+                    ):
+                        doing_data_download = function_name == "generate_download_codes"
+                        doing_scalar_request = function_name == "get_scalar_data"
                         print(
                             f"Calling function: {function_name} with args: {function_args}"
                         )
-                        function_args_no_obtained_params = (
-                            function_args.copy() if function_args else {}
-                        )
-                        if doing_data_download or doing_scalar_request:
-                            function_args["obtainedParams"] = obtained_params
-
-                        function_response = await self.call_tool(
-                            self.available_functions[function_name],
-                            function_args or {},
-                            user_onc_token=user_onc_token or self.env.get_onc_token(),
+                        await on_event(
+                            "stage", {"stage": "calling_tool", "tool": function_name}
                         )
+                        function_args_no_obtained_params = function_args.copy()
+                        if index in independent_tool_tasks:
+                            function_response = await independent_tool_tasks[index]
+                        else:
+                            if doing_data_download or doing_scalar_request:
+                                function_args["obtainedParams"] = obtained_params
+                            with stage(f"tool_{function_name}"):
+                                function_response = await self.call_tool(
+                                    self.available_functions[function_name],
+                                    function_args,
+                                    user_onc_token=user_onc_token,
+                                )
                         print("Function response:", function_response)
+                        tool_responses.append((function_name, function_response))
+                        tool_failed = tool_failed or str(
+                            function_response.get("response", "")
+                        ).startswith("Error")
                         if doing_data_download:
                             return handle_data_download(
                                 function_response, sources, point_ids=point_ids
@@ -261,36 +520,60 @@ class LLM:
                                 ),
                             )
                         )
-                secondLLMCallStartingPrompt = generate_system_prompt(
-                    second_LLM_prompt,
-                    context={
-                        "current_date": current_date,
-                    },
-                )
+                finally:
+                    # An early return leaves later independent tools unused
+                    for task in independent_tool_tasks.values():
+                        task.cancel()
+                # Small deterministic tool results are turned into the answer without the LLM
+                response = render_tool_responses(tool_responses, self.tool_renderers)
+                await on_event("stage", {"stage": "generating_answer"})
+                if response is not None:
+                    await on_event("token", {"content": response})
+                else:
+                    secondLLMCallStartingPrompt = generate_system_prompt(
+                        second_LLM_prompt,
+                        context={
+                            "current_date": current_date,
+                        },
+                    )
 
-                userInput = create_user_call(
-                    user_prompt=user_prompt,
-                    vector_content=vector_content,
-                    toolInfo=toolMessages,
-                )
-                messagesNoContext = [
-                    # {"role": "system", "content": styling_prompt},
-                    {
-                        "role": "system",
-                        "content": secondLLMCallStartingPrompt,
-                    },
-                    {"role": "user", "content": userInput},
-                ]
-                second_response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messagesNoContext,  # Conversation history without context and different starting system prompt
-                    max_completion_tokens=4096,
-                    temperature=0,
-                    stream=False,
-                )  # Calls LLM again with all the data from all functions
+                    second_vector_content, toolMessages = self.fit_tool_prompt(
+                        secondLLMCallStartingPrompt,
+                        user_prompt,
+                        vector_content,
+                        toolMessages,
+                    )
+                    userInput = create_user_call(
+                        user_prompt=user_prompt,
+                        vector_content=second_vector_content,
+                        toolInfo=toolMessages,
+                    )
+                    messagesNoContext = [
+                        # {"role": "system", "content": styling_prompt},
+                        {
+                            "role": "system",
+                            "content": secondLLMCallStartingPrompt,
+                        },
+                        {"role": "user", "content": userInput},
+                    ]
+                    with stage("answer_llm"):
+                        if stream_answer:
+                            response = await self.stream_chat_completion(
+                                on_event,
+                                "answer",
+                                messages=messagesNoContext,
+                                temperature=0,
+                            )
+                        else:
+                            second_response = await self.create_chat_completion(
+                                "answer",
+                                messages=messagesNoContext,  # Conversation history without context and different starting system prompt
+                                temperature=0,
+                                stream=False,
+                            )  # Calls LLM again with all the data from all functions
+                            response = second_response.choices[0].message.content
                 # Return the final response
-                response = second_response.choices[0].message.content
-                return RunConversationResponse(
+                result = RunConversationResponse(
                     status=StatusCode.REGULAR_MESSAGE,
                     response=response,
                     obtainedParams=obtained_params,
@@ -302,14 +585,40 @@ class LLM:
                     sources=sources,
                     point_ids=point_ids,
                 )
+                # Orders and scalar requests have side effects, failed tools would be retried next time
+                self.cache_answer(
+                    user_prompt,
+                    user_onc_token,
+                    cache_embedding,
+                    result,
+                    started_at,
+                    current_date,
+                    cacheable=not tool_failed
+                    and all(
+                        function_name not in ORDER_DEPENDENT_TOOLS
+                        for function_name, _ in parsed_tool_calls
+                    ),
+                )
+                return result
             else:
-                return RunConversationResponse(
+                # The tool-selection call already produced the whole answer
+                await on_event("token", {"content": response_message.content or ""})
+                result = RunConversationResponse(
                     status=StatusCode.REGULAR_MESSAGE,
                     response=response_message.content,
                     sources=sources,
                     obtainedParams=obtained_params,
                     point_ids=point_ids,
                 )
+                self.cache_answer(
+                    user_prompt,
+                    user_onc_token,
+                    cache_embedding,
+                    result,
+                    started_at,
+                    current_date,
+                )
+                return result
         except Exception as e:
             logger.error(f"LLM failed: {e}", exc_info=True)
             return RunConversationResponse(
@@ -320,9 +629,276 @@ class LLM:
                 point_ids=point_ids if point_ids else previous_vdb_ids,
             )
 
+    def select_tools(
+        self,
+        user_prompt: str,
+        query_embedding,
+        chat_history: list[dict],
+        obtained_params: ObtainedParamsDictionary,
+    ) -> list[dict]:
+        """Tool schemas for the tool-selection call, all of them when tool retrieval is off"""
+        if self.tool_retriever is None:
+            return toolDescriptions
+        # chat_history is most recent first
+        previous_prompt = next(
+            (turn["content"] for turn in chat_history if turn["role"] == "user"), None
+        )
+        required_tools = (
+            PENDING_PARAMS_TOOLS
+            if obtained_params != ObtainedParamsDictionary()
+            else set()
+        )
+        with stage("tool_retrieval"):
+            tools = self.tool_retriever.select(
+                user_prompt, query_embedding, previous_prompt, required_tools
+            )
+        logger.info(
+            f"Tool retrieval: {len(tools)} of {len(toolDescriptions)} tools "
+            f"({[tool['function']['name'] for tool in tools]})"
+        )
+        return tools
+
+    @staticmethod
+    def tool_selection_route(user_prompt: str, tools: list[dict]) -> str:
+        """
+        Greetings and thanks go to the small model. Every other prompt stays on the large
+        one, including knowledge questions no tool scored high enough for.
+        """
+        if not tools and is_conversational(user_prompt):
+            return "conversational"
+        return "tool_selection"
+
+    def fit_first_prompt(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        chat_history: list[dict],
+        vector_content: str,
+        tools: list[dict],
+    ) -> tuple[list[dict], str]:
+        """Trims the oldest history turns, then the vector content, to fit the tool-selection prompt budget"""
+        reserved_tokens = (
+            self.token_counter.count(system_prompt)
+            + self.token_counter.count(
+                create_user_call(user_prompt=user_prompt, vector_content="")
+            )
+            + (self.token_counter.count(json.dumps(tools)) if tools else 0)
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )
+        fitted = self.prompt_budgeter.fit(
+            [
+                PromptSection("chat_history", chat_history, trim_order=2),
+                PromptSection(
+                    "vector_content", vector_content, trim_order=1, min_tokens=512
+                ),
+            ],
+            reserved_tokens=reserved_tokens,
+        )
+        return fitted["chat_history"], fitted["vector_content"]
+
+    def fit_tool_prompt(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        vector_content: str,
+        tool_messages: list[ToolCall],
+    ) -> tuple[str, list[ToolCall]]:
+        """Trims the vector content, then the tool responses, to fit the answer prompt budget"""
+        empty_tool_messages = [
+            tool_message.model_copy(update={"response": ""})
+            for tool_message in tool_messages
+        ]
+        reserved_tokens = (
+            self.token_counter.count(system_prompt)
+            + self.token_counter.count(
+                create_user_call(
+                    user_prompt=user_prompt,
+                    vector_content="",
+                    toolInfo=empty_tool_messages,
+                )
+            )
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )
+        fitted = self.prompt_budgeter.fit(
+            [
+                PromptSection(
+                    "vector_content", vector_content, trim_order=2, min_tokens=256
+                ),
+                *[
+                    PromptSection(f"tool_{index}", tool_message.response, trim_order=1)
+                    for index, tool_message in enumerate(tool_messages)
+                ],
+            ],
+            reserved_tokens=reserved_tokens,
+        )
+        return fitted["vector_content"], [
+            tool_message.model_copy(update={"response": fitted[f"tool_{index}"]})
+            for index, tool_message in enumerate(tool_messages)
+        ]
+
+    def cache_answer(
+        self,
+        user_prompt: str,
+        user_onc_token: str,
+        query_embedding,
+        result: RunConversationResponse,
+        started_at: float,
+        current_date: str,
+        cacheable: bool = True,
+    ):
+        """Stores a finished answer in the semantic cache if this request was looked up in it"""
+        if query_embedding is None:
+            return
+        if not cacheable:
+            self.answer_cache.record_bypass()
+            return
+        self.answer_cache.store(
+            user_prompt,
+            query_embedding,
+            result,
+            compute_seconds=time.perf_counter() - started_at,
+            current_date=current_date,
+            user_onc_token=user_onc_token,
+        )
+
+    def get_cache_stats(self) -> dict:
+        return {
+            "answer_cache": self.answer_cache.stats()
+            if self.answer_cache is not None
+            else None,
+            "tool_cache": self.tool_cache.stats()
+            if self.tool_cache is not None
+            else None,
+            "single_flight": self.single_flight.stats()
+            if self.single_flight is not None
+            else None,
+            "llm_gateway": self.async_client.stats()
+            if isinstance(self.async_client, LLMGateway)
+            else None,
+            "model_routes": self.model_router.stats(),
+            "rerank": self.RAG_instance.rerank_monitor.stats(),
+            "query_embedding_cache": self.RAG_instance.embedding.query_cache.stats()
+            if self.RAG_instance.embedding.query_cache is not None
+            else None,
+            "vector_index_mirror": self.RAG_instance.index_mirror.stats()
+            if self.RAG_instance.index_mirror is not None
+            else None,
+        }
+
+    async def create_chat_completion(self, route: str, **kwargs):
+        """
+        Sends a chat completion through the shared async Groq client without blocking the
+        event loop, with the model and max_completion_tokens of the route (see ModelRouter)
+        """
+        options = self.model_router.request_options(route)
+        response = await self.send_chat_completion(route, {**options, **kwargs})
+        full_limit = self.model_router.routes[route].max_completion_tokens
+        if (
+            "max_completion_tokens" not in kwargs
+            and options["max_completion_tokens"] < full_limit
+            and response.choices
+            and response.choices[0].finish_reason == "length"
+        ):
+            # Cut off by the adapted limit, this request is retried with the route's full one
+            response = await self.send_chat_completion(
+                route, {**options, **kwargs, "max_completion_tokens": full_limit}
+            )
+        return response
+
+    async def send_chat_completion(self, route: str, kwargs: dict):
+        async with self.llm_semaphore:
+            started_at = time.perf_counter()
+            try:
+                with llm_route(route):
+                    response = await self.async_client.chat.completions.create(**kwargs)
+            except Exception:
+                self.model_router.record_error(route)
+                raise
+        self.model_router.record(
+            route,
+            time.perf_counter() - started_at,
+            response.usage,
+            response.choices[0].finish_reason if response.choices else None,
+        )
+        return response
+
+    async def stream_chat_completion(
+        self, on_event: EventCallback, route: str, **kwargs
+    ) -> str:
+        """Streams a chat completion, forwarding each token to on_event, and returns the full content"""
+        kwargs = {**self.model_router.request_options(route), **kwargs}
+        content = []
+        usage = None
+        finish_reason = None
+        async with self.llm_semaphore:
+            started_at = time.perf_counter()
+            try:
+                with llm_route(route):
+                    stream = await self.async_client.chat.completions.create(
+                        stream=True, **kwargs
+                    )
+                async for chunk in stream:
+                    # Groq sends the token usage with the last chunk
+                    if chunk.x_groq is not None and chunk.x_groq.usage is not None:
+                        usage = chunk.x_groq.usage
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    if chunk.choices[0].delta.content:
+                        token = chunk.choices[0].delta.content
+                        content.append(token)
+                        await on_event("token", {"content": token})
+            except Exception:
+                self.model_router.record_error(route)
+                raise
+        self.model_router.record(
+            route, time.perf_counter() - started_at, usage, finish_reason
+        )
+        return "".join(content)
+
+    async def call_independent_tool(
+        self, function_name: str, function_args: dict, user_onc_token: str
+    ):
+        """
+        Runs a read-only tool with a timeout. Most tools use the blocking ONC client,
+        so each one gets its own worker thread and event loop so they can overlap.
+        A blocking call can't be interrupted, so a tool that runs over is abandoned:
+        the conversation gets the timeout error and the thread finishes in the background.
+        """
+        try:
+            with stage(f"tool_{function_name}"):
+                return await asyncio.wait_for(
+                    asyncio.to_thread(
+                        lambda: asyncio.run(
+                            self.call_tool(
+                                self.available_functions[function_name],
+                                function_args,
+                                user_onc_token=user_onc_token,
+                            )
+                        )
+                    ),
+                    timeout=self.tool_timeout,
+                )
+        except TimeoutError:
+            logger.warning(f"{function_name} timed out after {self.tool_timeout}s")
+            return {
+                "response": f"Error: {function_name} timed out after {self.tool_timeout} seconds."
+            }
+
     async def call_tool(self, fn, args, user_onc_token):
+        # Order-dependent tools place requests or carry obtainedParams so they always run
+        use_tool_cache = (
+            self.tool_cache is not None and fn.__name__ not in ORDER_DEPENDENT_TOOLS
+        )
+        if use_tool_cache:
+            cached_response = self.tool_cache.get(fn, args, user_onc_token)
+            if cached_response is not None:
+                return cached_response
         try:
-            return await fn(**args, user_onc_token=user_onc_token)
+            response = await fn(**args, user_onc_token=user_onc_token)
         except TypeError:
             # fallback if fn doesn't accept user_onc_token
-            return await fn(**args)
+            response = await fn(**args)
+        if use_tool_cache:
+            self.tool_cache.put(fn, args, user_onc_token, response)
+        return response
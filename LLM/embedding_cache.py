@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Unicode-normalizes and collapses whitespace, which doesn't change what the question asks"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class QueryEmbeddingCache:
+    """
+    Caches query embeddings keyed by task and normalized text, evicting the least
+    recently used entry once max_entries is reached. Embeddings are computed in worker
+    threads, so every access is guarded by a lock and concurrent misses on the same key
+    wait for the first one instead of running the model again. With persist_path set,
+    embeddings are also written to a SQLite file, so a restarted worker starts warm;
+    entries are keyed by model too, so switching models doesn't serve stale vectors.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = 2048,
+        persist_path: Optional[str] = None,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.in_flight: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.persist_path = persist_path
+        self._db = None
+        if persist_path:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT, task TEXT, text TEXT, vector BLOB, "
+                "PRIMARY KEY (model, task, text))"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _freeze(embedding) -> np.ndarray:
+        # Every caller gets the same array, so nobody may modify it in place
+        vector = np.array(embedding, dtype=np.float32)
+        vector.flags.writeable = False
+        return vector
+
+    def _load(self, key: tuple[str, str]) -> Optional[np.ndarray]:
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT vector FROM query_embeddings WHERE model = ? AND task = ? AND text = ?",
+                (self.model_name, *key),
+            ).fetchone()
+        return self._freeze(np.frombuffer(row[0], dtype=np.float32)) if row else None
+
+    def _save(self, key: tuple[str, str], vector: np.ndarray) -> None:
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                (self.model_name, *key, vector.tobytes()),
+            )
+            self._db.commit()
+
+    def _store(self, key: tuple[str, str], vector: np.ndarray) -> None:
+        with self._lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(
+        self, text: str, task: str, compute: Callable[[str], np.ndarray]
+    ) -> np.ndarray:
+        """The cached embedding of text for task, computing it with compute(text) on a miss"""
+        key = (task, normalize_query(text))
+        with self._lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.in_flight[key] = future
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            vector = self._load(key)
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+            else:
+                with self._lock:
+                    self.misses += 1
+                vector = self._freeze(compute(key[1]))
+                self._save(key, vector)
+            self._store(key, vector)
+            future.set_result(vector)
+            return vector
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self.in_flight[key]
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits + self.coalesced) / lookups
+                if lookups
+                else 0.0,
+                "persistent": self._db is not None,
+            }
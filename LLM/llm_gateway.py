@@ -0,0 +1,287 @@
+"""
+Sends chat completions to one of several Groq-compatible endpoints (different providers
+or different models). A request goes to the first endpoint whose circuit is closed. If
+it hasn't answered after that endpoint's hedge percentile latency on the request's route
+(see llm_route()), a hedged copy goes to the next endpoint and whichever answers first
+wins. Errors fail over straight away and count against the endpoint's circuit breaker,
+which stops sending it traffic for a while after too many failures in a row.
+
+LLMGateway exposes chat.completions.create like AsyncGroq, so LLM uses it unchanged.
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+import numpy as np
+from groq import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncGroq,
+)
+
+logger = logging.getLogger(__name__)
+
+# Recent latencies kept per endpoint and route to pick the hedge delay
+LATENCY_WINDOW = 200
+
+# The ModelRouter route of the completion being sent, routes differ a lot in latency
+_current_route: ContextVar[Optional[str]] = ContextVar("llm_route", default=None)
+
+
+@contextmanager
+def llm_route(route: str) -> Iterator[None]:
+    """Tags the completions sent inside the block with their route"""
+    reset_token = _current_route.set(route)
+    try:
+        yield
+    finally:
+        _current_route.reset(reset_token)
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """Connection problems, timeouts, rate limits and 5xx are the endpoint's fault, other 4xx are the request's"""
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. After reset_seconds one trial
+    request is let through (half open), its success closes the circuit again.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self.trial_in_flight)
+
+    def start_request(self) -> None:
+        if self.state == "half_open":
+            self.trial_in_flight = True
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if (
+            self.opened_at is not None
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """A trial request was cancelled before it finished, let another one through"""
+        self.trial_in_flight = False
+
+
+@dataclass
+class LLMEndpoint:
+    name: str
+    client: AsyncGroq
+    # Replaces the model of every request sent here, None keeps the routed model
+    model: Optional[str] = None
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    # Keyed by route, None for completions sent outside llm_route()
+    latencies: dict[Optional[str], deque] = field(
+        default_factory=lambda: defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+    )
+    requests: int = 0
+    failures: int = 0
+    wins: int = 0
+
+
+class _Completions:
+    def __init__(self, gateway: "LLMGateway"):
+        self._gateway = gateway
+
+    async def create(self, **kwargs):
+        return await self._gateway.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, gateway: "LLMGateway"):
+        self.completions = _Completions(gateway)
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        endpoints: list[LLMEndpoint],
+        hedge_percentile: float = 95,
+        initial_hedge_delay: float = 2.0,
+        min_hedge_delay: float = 0.25,
+        min_latency_samples: int = 20,
+        max_hedges: int = 1,
+    ):
+        if not endpoints:
+            raise ValueError("LLMGateway needs at least one endpoint")
+        self.endpoints = endpoints
+        self.hedge_percentile = hedge_percentile
+        # Used until an endpoint has min_latency_samples latencies on the route to take a
+        # percentile of
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_latency_samples = min_latency_samples
+        self.max_hedges = max_hedges
+        self.hedges = 0
+        self.failovers = 0
+        self.chat = _Chat(self)
+
+    def hedge_delay(self, endpoint: LLMEndpoint, route: Optional[str] = None) -> float:
+        latencies = endpoint.latencies.get(route, ())
+        if len(latencies) < self.min_latency_samples:
+            return self.initial_hedge_delay
+        return max(
+            self.min_hedge_delay,
+            float(np.percentile(latencies, self.hedge_percentile)),
+        )
+
+    def candidate_endpoints(self) -> list[LLMEndpoint]:
+        """Endpoints whose circuit lets a request through, or all of them if every circuit is open"""
+        candidates = [
+            endpoint for endpoint in self.endpoints if endpoint.breaker.available()
+        ]
+        return candidates or list(self.endpoints)
+
+    async def _call(self, endpoint: LLMEndpoint, kwargs: dict, route: Optional[str]):
+        if endpoint.model is not None:
+            kwargs = {**kwargs, "model": endpoint.model}
+        endpoint.requests += 1
+        endpoint.breaker.start_request()
+        started_at = time.perf_counter()
+        try:
+            response = await endpoint.client.chat.completions.create(**kwargs)
+        except asyncio.CancelledError:
+            endpoint.breaker.release()
+            raise
+        except Exception as e:
+            if is_endpoint_failure(e):
+                endpoint.failures += 1
+                endpoint.breaker.record_failure()
+            else:
+                endpoint.breaker.release()
+            raise
+        endpoint.latencies[route].append(time.perf_counter() - started_at)
+        endpoint.breaker.record_success()
+        return response
+
+    @staticmethod
+    async def _discard(task: asyncio.Task) -> None:
+        """Cancels a losing request, closing its stream if it already returned one"""
+        if not task.done():
+            task.cancel()
+            return
+        if task.cancelled() or task.exception() is not None:
+            return
+        close = getattr(task.result(), "close", None)
+        if close is not None:
+            await close()
+
+    async def create(self, **kwargs):
+        endpoints = self.candidate_endpoints()
+        route = _current_route.get()
+        pending: dict[asyncio.Task, LLMEndpoint] = {}
+        next_index = 0
+        hedges = 0
+        last_error: Optional[BaseException] = None
+
+        def launch() -> None:
+            nonlocal next_index
+            endpoint = endpoints[next_index]
+            next_index += 1
+            pending[asyncio.create_task(self._call(endpoint, kwargs, route))] = endpoint
+
+        launch()
+        try:
+            while pending:
+                can_hedge = next_index < len(endpoints) and hedges < self.max_hedges
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay(endpoints[next_index - 1], route)
+                    if can_hedge
+                    else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info(
+                        f"Hedging LLM request to {endpoints[next_index].name}, "
+                        f"{endpoints[next_index - 1].name} is slow"
+                    )
+                    hedges += 1
+                    self.hedges += 1
+                    launch()
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    if task.exception() is None:
+                        endpoint.wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                    if not is_endpoint_failure(last_error):
+                        # The next endpoint would reject the same request
+                        raise last_error
+                    logger.warning(f"LLM endpoint {endpoint.name} failed: {last_error}")
+                if not pending and next_index < len(endpoints):
+                    self.failovers += 1
+                    launch()
+            raise last_error
+        finally:
+            for task in pending:
+                await self._discard(task)
+
+    def stats(self) -> dict:
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "endpoints": [
+                {
+                    "name": endpoint.name,
+                    "model": endpoint.model,
+                    "circuit": endpoint.breaker.state,
+                    "times_opened": endpoint.breaker.times_opened,
+                    "requests": endpoint.requests,
+                    "failures": endpoint.failures,
+                    "wins": endpoint.wins,
+                    "hedge_delay_seconds": {
+                        route or "unrouted": round(self.hedge_delay(endpoint, route), 3)
+                        for route in endpoint.latencies
+                    },
+                }
+                for endpoint in self.endpoints
+            ],
+        }
+
+    async def close(self) -> None:
+        for endpoint in self.endpoints:
+            await endpoint.client.close()
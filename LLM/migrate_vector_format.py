@@ -0,0 +1,95 @@
+"""
+Rebuilds a Qdrant collection in another vector format (see LLM/vector_format.py).
+
+The source collection's points are scrolled with their vectors and upserted into a new
+collection created in the chosen format, with the same ids and payloads. Vectors are
+truncated from the stored ones, so nothing is re-embedded, but the source has to hold at
+least as many dimensions as the target. Keeping the ids keeps the function-calling point
+ids stored on conversations valid. The source is left untouched.
+
+With --alias the alias is pointed at the new collection once it is indexed, so a
+deployment whose QDRANT_*_COLLECTION_NAME is that alias switches over atomically.
+Otherwise set the collection name to the new collection. Either way VECTOR_FORMATS has
+to describe the new format, e.g. {"general": {"dimensions": 512, "storage": "int8"}}.
+
+Usage (from the repository root):
+    python -m LLM.migrate_vector_format general_docs --dimensions 512 --storage int8
+    python -m LLM.migrate_vector_format general_docs --storage binary \\
+        --target general_docs_binary --alias general
+"""
+
+import argparse
+import asyncio
+import time
+
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import (
+    CreateAlias,
+    CreateAliasOperation,
+    DeleteAlias,
+    DeleteAliasOperation,
+)
+
+from LLM.Environment import Environment
+from LLM.vector_format import (
+    MIGRATION_BATCH_SIZE,
+    STORAGE_TYPES,
+    VectorFormat,
+    migrate_collection,
+    wait_until_indexed,
+)
+
+
+async def point_alias_to(client: AsyncQdrantClient, alias: str, target: str) -> None:
+    """Moves alias to target in one operation, so searches never see it missing"""
+    aliases = (await client.get_aliases()).aliases
+    operations = [
+        DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=alias))
+        for existing in aliases
+        if existing.alias_name == alias
+    ]
+    operations.append(
+        CreateAliasOperation(
+            create_alias=CreateAlias(collection_name=target, alias_name=alias)
+        )
+    )
+    await client.update_collection_aliases(change_aliases_operations=operations)
+
+
+async def run(args) -> None:
+    env = Environment()
+    client = AsyncQdrantClient(
+        url=env.get_qdrant_url(),
+        api_key=env.get_qdrant_api_key(),
+        timeout=int(env.get_qdrant_timeout()),
+    )
+    vector_format = VectorFormat(dimensions=args.dimensions, storage=args.storage)
+    target = args.target or f"{args.source}_{args.dimensions}_{args.storage}"
+    try:
+        started_at = time.perf_counter()
+        copied = await migrate_collection(
+            client, args.source, target, vector_format, args.batch_size
+        )
+        print(
+            f"Copied {copied} points from {args.source} to {target} ({vector_format})"
+        )
+        await wait_until_indexed(client, target)
+        print(f"{target} indexed after {time.perf_counter() - started_at:.1f} s")
+        if args.alias:
+            await point_alias_to(client, args.alias, target)
+            print(f"Alias {args.alias} now points to {target}")
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("source")
+    parser.add_argument("--target")
+    parser.add_argument("--dimensions", type=int, default=1024)
+    parser.add_argument("--storage", choices=STORAGE_TYPES, default="float32")
+    parser.add_argument("--batch-size", type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument("--alias")
+    asyncio.run(run(parser.parse_args()))
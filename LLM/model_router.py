@@ -0,0 +1,149 @@
+"""
+Picks the model and completion token limit for each LLM call site and records
+per-route latency and token usage. Classification and conversational turns go to a
+small fast model, tool selection and answer synthesis stay on the large model.
+
+Routes can be overridden with the MODEL_ROUTES environment variable, a JSON object like
+    {"conversational": {"model": "llama-3.3-70b-versatile", "max_completion_tokens": 512}}
+"""
+
+import math
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+SMALL_MODEL = "llama-3.1-8b-instant"
+LARGE_MODEL = "llama-3.3-70b-versatile"
+# Calls kept per route for the latency and completion token percentiles
+METRICS_WINDOW = 500
+
+
+@dataclass
+class Route:
+    model: str
+    # Upper bound on completion tokens, the router lowers it once it has seen enough calls
+    max_completion_tokens: int
+    # Adaptive limits never go below this
+    min_completion_tokens: int = 1
+
+
+DEFAULT_ROUTES = {
+    # One-token yes/no: is the new question related to the conversation?
+    "keep_context": Route(SMALL_MODEL, 1),
+    # Greetings and thanks, sent without tools
+    "conversational": Route(SMALL_MODEL, 256, min_completion_tokens=64),
+    # Picks tools or answers directly from the vector content
+    "tool_selection": Route(LARGE_MODEL, 4096, min_completion_tokens=1024),
+    # Writes the final answer from the tool responses
+    "answer": Route(LARGE_MODEL, 4096, min_completion_tokens=1024),
+}
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.truncated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies: deque = deque(maxlen=METRICS_WINDOW)
+        self.completion_token_samples: deque = deque(maxlen=METRICS_WINDOW)
+
+
+class ModelRouter:
+    """
+    Resolves a call site ("keep_context", "conversational", "tool_selection", "answer")
+    to a model and max_completion_tokens. After min_samples calls a route's token limit
+    adapts to headroom times the p99 completion length it has seen, within the route's
+    bounds. Groq counts max_completion_tokens against the rate limit up front, so a tight
+    limit lets more calls through. A completion cut off at an adapted limit is retried
+    with the route's full limit by LLM.create_chat_completion, its length still counts
+    towards the percentile.
+    """
+
+    def __init__(
+        self,
+        routes: Optional[dict[str, Route]] = None,
+        min_samples: int = 50,
+        headroom: float = 1.5,
+    ):
+        self.routes = {**DEFAULT_ROUTES, **(routes or {})}
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.metrics = {name: RouteMetrics() for name in self.routes}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_overrides(cls, overrides: dict[str, dict], **kwargs) -> "ModelRouter":
+        routes = {
+            name: Route(**{**DEFAULT_ROUTES[name].__dict__, **override})
+            if name in DEFAULT_ROUTES
+            else Route(**override)
+            for name, override in overrides.items()
+        }
+        return cls(routes, **kwargs)
+
+    def completion_token_limit(self, route_name: str) -> int:
+        route = self.routes[route_name]
+        metrics = self.metrics[route_name]
+        with self._lock:
+            samples = list(metrics.completion_token_samples)
+        if len(samples) < self.min_samples:
+            return route.max_completion_tokens
+        adaptive = math.ceil(self.headroom * float(np.percentile(samples, 99)))
+        return min(
+            route.max_completion_tokens, max(route.min_completion_tokens, adaptive)
+        )
+
+    def request_options(self, route_name: str) -> dict:
+        """The model and max_completion_tokens arguments for a completion on this route"""
+        return {
+            "model": self.routes[route_name].model,
+            "max_completion_tokens": self.completion_token_limit(route_name),
+        }
+
+    def record(
+        self,
+        route_name: str,
+        seconds: float,
+        usage=None,
+        finish_reason: Optional[str] = None,
+    ) -> None:
+        metrics = self.metrics[route_name]
+        with self._lock:
+            metrics.calls += 1
+            metrics.latencies.append(seconds)
+            if finish_reason == "length":
+                metrics.truncated += 1
+            if usage is not None:
+                metrics.prompt_tokens += usage.prompt_tokens
+                metrics.completion_tokens += usage.completion_tokens
+                metrics.completion_token_samples.append(usage.completion_tokens)
+
+    def record_error(self, route_name: str) -> None:
+        with self._lock:
+            self.metrics[route_name].errors += 1
+
+    def stats(self) -> dict:
+        stats = {}
+        for name, route in self.routes.items():
+            metrics = self.metrics[name]
+            with self._lock:
+                latencies = list(metrics.latencies)
+                stats[name] = {
+                    "model": route.model,
+                    "calls": metrics.calls,
+                    "errors": metrics.errors,
+                    "truncated": metrics.truncated,
+                    "prompt_tokens": metrics.prompt_tokens,
+                    "completion_tokens": metrics.completion_tokens,
+                }
+            stats[name]["max_completion_tokens"] = self.completion_token_limit(name)
+            if latencies:
+                p50, p95 = np.percentile(latencies, [50, 95])
+                stats[name]["latency_p50_seconds"] = round(float(p50), 3)
+                stats[name]["latency_p95_seconds"] = round(float(p95), 3)
+        return stats
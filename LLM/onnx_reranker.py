@@ -0,0 +1,150 @@
+"""
+CPU reranking with an int8-quantized ONNX export of the bge cross-encoder.
+
+export_quantized() exports the Hugging Face model to ONNX and dynamically quantizes
+its weights to int8. OnnxCrossEncoder scores (question, document) pairs with the same
+score() interface as langchain's HuggingFaceCrossEncoder. Pairs are truncated to
+max_length tokens the way sentence-transformers does it (longest side first, which is
+the document for any normal question), then sorted by token length and batched so each
+batch is only padded to its own longest pair.
+
+onnxruntime and torch are only imported once the ONNX backend is used, so the default
+torch reranker doesn't need onnxruntime installed.
+"""
+
+import inspect
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+RERANKER_MODEL_NAME = "BAAI/bge-reranker-base"
+FP32_MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+
+def export_quantized(model_name: str, output_dir: str) -> Path:
+    """Exports model_name to output_dir as an int8 ONNX model plus its tokenizer"""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    sample = tokenizer([("question", "document")], return_tensors="pt")
+    # Traced inputs are positional, so they have to follow forward()'s parameter order
+    input_names = [
+        name for name in inspect.signature(model.forward).parameters if name in sample
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            str(output_dir / FP32_MODEL_FILE),
+            input_names=input_names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+    quantize_dynamic(
+        str(output_dir / FP32_MODEL_FILE),
+        str(output_dir / QUANTIZED_MODEL_FILE),
+        weight_type=QuantType.QInt8,
+    )
+    tokenizer.save_pretrained(output_dir)
+    return output_dir / QUANTIZED_MODEL_FILE
+
+
+class OnnxCrossEncoder:
+    def __init__(
+        self,
+        model_dir: str,
+        max_length: int = 512,
+        batch_size: int = 16,
+        intra_op_threads: Optional[int] = None,
+    ):
+        import onnxruntime as ort
+
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(
+            str(Path(model_dir) / QUANTIZED_MODEL_FILE),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {
+            model_input.name for model_input in self.session.get_inputs()
+        }
+
+    def batches(self, lengths: list[int]) -> list[list[int]]:
+        """Indices of the pairs grouped into batches of similar token length"""
+        order = sorted(range(len(lengths)), key=lambda index: lengths[index])
+        return [
+            order[start : start + self.batch_size]
+            for start in range(0, len(order), self.batch_size)
+        ]
+
+    def encode(self, text_pairs: list[tuple[str, str]], **kwargs):
+        questions, documents = zip(*text_pairs)
+        return self.tokenizer(
+            list(questions),
+            list(documents),
+            truncation="longest_first",
+            max_length=self.max_length,
+            **kwargs,
+        )
+
+    def score(self, text_pairs: list[tuple[str, str]]) -> list[float]:
+        if not text_pairs:
+            return []
+        lengths = self.encode(text_pairs, return_length=True)["length"]
+        scores = np.empty(len(text_pairs), dtype=np.float32)
+        for batch in self.batches(lengths):
+            encoded = self.encode(
+                [text_pairs[index] for index in batch],
+                padding=True,
+                return_tensors="np",
+            )
+            (logits,) = self.session.run(
+                ["logits"],
+                {
+                    name: encoded[name].astype(np.int64)
+                    for name in encoded
+                    if name in self.input_names
+                },
+            )
+            # Same sigmoid sentence-transformers applies to single-label cross-encoders
+            scores[batch] = 1 / (1 + np.exp(-logits[:, 0]))
+        return scores.tolist()
+
+
+def ranking_agreement(reference, candidate, top_k: int = 5) -> dict:
+    """How closely candidate scores rank the same pairs as reference scores"""
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    reference_ranks = np.argsort(np.argsort(-reference))
+    candidate_ranks = np.argsort(np.argsort(-candidate))
+    spearman = (
+        float(np.corrcoef(reference_ranks, candidate_ranks)[0, 1])
+        if len(reference) > 1
+        else 1.0
+    )
+    top_k = min(top_k, len(reference))
+    overlap = len(
+        set(np.argsort(-reference)[:top_k]) & set(np.argsort(-candidate)[:top_k])
+    )
+    return {
+        "spearman": spearman,
+        "top1_match": bool(np.argmax(reference) == np.argmax(candidate)),
+        "top_k_overlap": overlap / top_k if top_k else 1.0,
+    }
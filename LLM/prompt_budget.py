@@ -0,0 +1,166 @@
+import logging
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Union
+
+from tokenizers import Tokenizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKENIZER = "meta-llama/Llama-3.3-70B-Instruct"
+TRUNCATION_MARKER = "\n...[truncated]"
+# The Llama 3 chat template wraps every message in header and end-of-turn tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Counts tokens with the Llama 3.3 tokenizer. If the tokenizer can't be loaded
+    (no network, no access to the gated repo) it estimates 4 characters per token.
+    """
+
+    def __init__(self, tokenizer: Optional[Tokenizer] = None):
+        self.tokenizer = tokenizer
+
+    @classmethod
+    def load(cls, name_or_path: str) -> "TokenCounter":
+        """Loads a tokenizer.json from a local path or a Hugging Face repo id"""
+        try:
+            if os.path.isfile(name_or_path):
+                tokenizer = Tokenizer.from_file(name_or_path)
+            else:
+                tokenizer = Tokenizer.from_pretrained(
+                    name_or_path, token=os.getenv("HF_TOKEN")
+                )
+        except Exception as e:
+            logger.warning(
+                f"Could not load tokenizer {name_or_path}, estimating 4 characters per token: {e}"
+            )
+            tokenizer = None
+        return cls(tokenizer)
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_messages(self, messages: list[dict]) -> int:
+        return sum(
+            self.count(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+            for message in messages
+        )
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Keeps the start of text so it fits in max_tokens, marking that it was cut"""
+        if self.count(text) <= max_tokens:
+            return text
+        keep_tokens = max_tokens - self.count(TRUNCATION_MARKER)
+        if keep_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[: keep_tokens * 4] + TRUNCATION_MARKER
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        return text[: offsets[keep_tokens][0]] + TRUNCATION_MARKER
+
+    def trim_history(self, chat_history: list[dict], max_tokens: int) -> list[dict]:
+        """Keeps the most recent question/answer pairs (history is most recent first) that fit"""
+        kept = []
+        used = 0
+        for index in range(0, len(chat_history), 2):
+            turn = chat_history[index : index + 2]
+            turn_tokens = self.count_messages(turn)
+            if used + turn_tokens > max_tokens:
+                break
+            kept.extend(turn)
+            used += turn_tokens
+        return kept
+
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> TokenCounter:
+    """Process-wide counter so the tokenizer is only loaded once"""
+    return TokenCounter.load(os.getenv("LLAMA_TOKENIZER", DEFAULT_TOKENIZER))
+
+
+@dataclass
+class PromptSection:
+    name: str
+    # Plain text, or chat history (most recent first) which is trimmed a turn at a time
+    content: Union[str, list[dict]]
+    # Sections with a higher trim_order are cut first, 0 means the section is never cut
+    trim_order: int = 0
+    # A trimmed section is never cut below this many tokens
+    min_tokens: int = 0
+
+
+class PromptBudgeter:
+    """
+    Fits the variable parts of a prompt into max_prompt_tokens. Sections are cut
+    starting from the highest trim_order. Sections that share a trim_order are cut in
+    proportion to their size so one large tool response can't wipe out the others.
+    """
+
+    def __init__(self, counter: TokenCounter, max_prompt_tokens: int = 8000):
+        self.counter = counter
+        self.max_prompt_tokens = max_prompt_tokens
+
+    def tokens(self, content: Union[str, list[dict]]) -> int:
+        if isinstance(content, list):
+            return self.counter.count_messages(content)
+        return self.counter.count(content)
+
+    def trim(
+        self, content: Union[str, list[dict]], max_tokens: int
+    ) -> Union[str, list[dict]]:
+        if isinstance(content, list):
+            return self.counter.trim_history(content, max_tokens)
+        return self.counter.truncate(content, max_tokens)
+
+    def fit(
+        self, sections: list[PromptSection], reserved_tokens: int = 0
+    ) -> dict[str, Union[str, list[dict]]]:
+        """
+        Returns each section's content by name, trimmed so that the sections plus
+        reserved_tokens (system prompt, question, tool schemas) fit in the budget.
+        """
+        fitted = {section.name: section.content for section in sections}
+        sizes = {section.name: self.tokens(section.content) for section in sections}
+        overflow = reserved_tokens + sum(sizes.values()) - self.max_prompt_tokens
+        if overflow <= 0:
+            return fitted
+
+        for trim_order in sorted(
+            {section.trim_order for section in sections if section.trim_order},
+            reverse=True,
+        ):
+            if overflow <= 0:
+                break
+            group = [
+                section
+                for section in sections
+                if section.trim_order == trim_order
+                and sizes[section.name] > section.min_tokens
+            ]
+            trimmable = sum(sizes[s.name] - s.min_tokens for s in group)
+            if not trimmable:
+                continue
+            to_cut = min(overflow, trimmable)
+            for section in group:
+                share = sizes[section.name] - section.min_tokens
+                target = sizes[section.name] - -(-to_cut * share // trimmable)
+                fitted[section.name] = self.trim(section.content, target)
+                new_size = self.tokens(fitted[section.name])
+                overflow -= sizes[section.name] - new_size
+                logger.info(
+                    f"Prompt budget: trimmed {section.name} from {sizes[section.name]} to {new_size} tokens"
+                )
+                sizes[section.name] = new_size
+
+        if overflow > 0:
+            logger.warning(
+                f"Prompt is still {overflow} tokens over the {self.max_prompt_tokens} token budget"
+            )
+        return fitted
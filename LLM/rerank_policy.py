@@ -0,0 +1,145 @@
+"""
+Decides per query and collection how much of the cross-encoder to spend.
+
+Vector hits arrive sorted by cosine score. When hit 1 is far enough ahead of hit 2
+(skip_margin) the cross-encoder would almost never reorder the top, so the hits are
+used in vector order. With a moderate lead (shrink_margin) only the top_m hits are
+reranked and the rest follow in vector order. Otherwise every hit is reranked.
+
+Policies can be overridden per collection with the RERANK_POLICIES environment variable,
+a JSON object like
+    {"function_calling": {"skip_margin": 0.08, "shrink_margin": 0.02, "top_m": 4}}
+Every decision is logged and counted. With audit_rate > 0, that fraction of skipped or
+shrunk decisions is also reranked in full, to measure how often the adaptive top hit
+differs from the full rerank.
+"""
+
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SKIP = "skip"
+SHRINK = "shrink"
+FULL = "full"
+# Fewer than two hits, there is nothing to reorder
+TRIVIAL = "trivial"
+
+
+@dataclass
+class RerankPolicy:
+    # Hits fetched from Qdrant
+    k: int = 20
+    # Hits below this vector score are dropped before reranking
+    min_score: float = 0.0
+    # Hits kept after ranking
+    top_n: int = 15
+    # Lead of hit 1 over hit 2 (vector score) from which reranking is skipped, None never skips
+    skip_margin: Optional[float] = None
+    # Lead from which only the top_m hits are reranked, None always reranks every hit
+    shrink_margin: Optional[float] = None
+    top_m: int = 5
+
+    def decide(self, scores: list[float]) -> tuple[str, int]:
+        """The decision for hits with these vector scores (descending), and how many to rerank"""
+        if len(scores) < 2:
+            return TRIVIAL, 0
+        margin = scores[0] - scores[1]
+        if self.skip_margin is not None and margin >= self.skip_margin:
+            return SKIP, 0
+        if (
+            self.shrink_margin is not None
+            and margin >= self.shrink_margin
+            and self.top_m < len(scores)
+        ):
+            return SHRINK, self.top_m
+        return FULL, len(scores)
+
+
+DEFAULT_RERANK_POLICIES = {
+    # Up to 10 documents are used, so their order below the top matters too
+    "general": RerankPolicy(k=20, min_score=0.4, top_n=15),
+    # Only the top document is used and it is usually well ahead
+    "function_calling": RerankPolicy(
+        k=20, min_score=0.375, top_n=15, skip_margin=0.1, shrink_margin=0.03, top_m=5
+    ),
+}
+
+
+def policies_from_overrides(overrides: dict[str, dict]) -> dict[str, RerankPolicy]:
+    return {
+        **DEFAULT_RERANK_POLICIES,
+        **{
+            name: RerankPolicy(
+                **{
+                    **DEFAULT_RERANK_POLICIES.get(name, RerankPolicy()).__dict__,
+                    **override,
+                }
+            )
+            for name, override in overrides.items()
+        },
+    }
+
+
+class RerankMonitor:
+    """
+    Counts reranking decisions per collection and the cross-encoder pairs they saved,
+    plus how often audited decisions kept the same top hit as a full rerank. Reranking
+    runs in worker threads, so updates are guarded by a lock.
+    """
+
+    def __init__(self, audit_rate: float = 0.0):
+        self.audit_rate = audit_rate
+        self.decisions: dict[str, dict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self.candidates: dict[str, int] = defaultdict(int)
+        self.pairs_scored: dict[str, int] = defaultdict(int)
+        self.audits: dict[str, int] = defaultdict(int)
+        self.audit_top1_matches: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        collection: str,
+        decision: str,
+        candidates: int,
+        pairs_scored: int,
+        margin: Optional[float],
+    ) -> None:
+        logger.info(
+            f"Rerank {collection}: {decision}, {pairs_scored}/{candidates} candidates scored"
+            + (f", margin {margin:.3f}" if margin is not None else "")
+        )
+        with self._lock:
+            self.decisions[collection][decision] += 1
+            self.candidates[collection] += candidates
+            self.pairs_scored[collection] += pairs_scored
+
+    def record_audit(self, collection: str, decision: str, top1_matches: bool) -> None:
+        if not top1_matches:
+            logger.info(f"Rerank {collection}: {decision} changed the top hit")
+        with self._lock:
+            self.audits[collection] += 1
+            self.audit_top1_matches[collection] += top1_matches
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                collection: {
+                    "decisions": dict(decisions),
+                    "candidates": self.candidates[collection],
+                    "pairs_scored": self.pairs_scored[collection],
+                    "pairs_saved": self.candidates[collection]
+                    - self.pairs_scored[collection],
+                    "audits": self.audits[collection],
+                    "audit_top1_agreement": self.audit_top1_matches[collection]
+                    / self.audits[collection]
+                    if self.audits[collection]
+                    else None,
+                }
+                for collection, decisions in self.decisions.items()
+            }
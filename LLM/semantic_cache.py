@@ -0,0 +1,150 @@
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from LLM.schemas import RunConversationResponse
+from LLM.tool_cache import TOKEN_PLACEHOLDER, replace_text
+
+# Words that tie an answer to the day it was generated on
+DATE_SENSITIVE_PATTERN = re.compile(
+    r"\b(today|tonight|now|current|currently|latest|recent|recently|yesterday|"
+    r"this (morning|afternoon|evening|week|month|year))\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray
+    response: RunConversationResponse
+    expires_at: float
+    compute_seconds: float
+    # Only set for answers that mention "today" etc, they are only valid on that date
+    valid_on_date: Optional[str] = None
+
+
+class SemanticAnswerCache:
+    """
+    Caches final answers keyed on the normalized Jina query embedding. A lookup hits when
+    a cached question has cosine similarity >= similarity_threshold with the new one.
+    Entries expire after ttl_seconds and the least recently used entry is evicted once
+    max_entries is reached. Answers are stored with the requester's ONC token replaced by
+    a placeholder (urlParamsUsed, baseUrl) and served with the caller's token.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        ttl_seconds: float = 3600,
+        max_entries: int = 512,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.latency_saved_seconds = 0.0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _replace_token(
+        response: RunConversationResponse, old: Optional[str], new: Optional[str]
+    ) -> RunConversationResponse:
+        if not old or not new:
+            return response.model_copy(deep=True)
+        return RunConversationResponse.model_validate(
+            replace_text(response.model_dump(), old, new)
+        )
+
+    @staticmethod
+    def is_date_sensitive(*texts: str) -> bool:
+        return any(text and DATE_SENSITIVE_PATTERN.search(text) for text in texts)
+
+    def _drop_expired(self, current_date: str) -> None:
+        now = time.monotonic()
+        expired = [
+            entry_id
+            for entry_id, entry in self.entries.items()
+            if entry.expires_at <= now
+            or (entry.valid_on_date and entry.valid_on_date != current_date)
+        ]
+        for entry_id in expired:
+            del self.entries[entry_id]
+
+    def lookup(
+        self, query_embedding, current_date: str, user_onc_token: Optional[str] = None
+    ) -> Optional[RunConversationResponse]:
+        """Return a copy of the closest cached answer above the threshold, if any"""
+        self._drop_expired(current_date)
+        if not self.entries:
+            self.misses += 1
+            return None
+
+        query = self._normalize(query_embedding)
+        entry_ids = list(self.entries.keys())
+        matrix = np.stack([self.entries[entry_id].embedding for entry_id in entry_ids])
+        similarities = matrix @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            self.misses += 1
+            return None
+
+        entry_id = entry_ids[best]
+        self.entries.move_to_end(entry_id)
+        entry = self.entries[entry_id]
+        self.hits += 1
+        self.latency_saved_seconds += entry.compute_seconds
+        return self._replace_token(entry.response, TOKEN_PLACEHOLDER, user_onc_token)
+
+    def store(
+        self,
+        user_prompt: str,
+        query_embedding,
+        response: RunConversationResponse,
+        compute_seconds: float,
+        current_date: str,
+        user_onc_token: Optional[str] = None,
+    ) -> None:
+        date_sensitive = self.is_date_sensitive(user_prompt, response.response)
+        self.entries[self._next_id] = CachedAnswer(
+            embedding=self._normalize(query_embedding),
+            response=self._replace_token(response, user_onc_token, TOKEN_PLACEHOLDER),
+            expires_at=time.monotonic() + self.ttl_seconds,
+            compute_seconds=compute_seconds,
+            valid_on_date=current_date if date_sensitive else None,
+        )
+        self._next_id += 1
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def record_bypass(self) -> None:
+        """Count a request that could not use the cache (history, pending params or side effects)"""
+        self.bypasses += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypasses": self.bypasses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved_seconds, 3),
+            "similarity_threshold": self.similarity_threshold,
+            "ttl_seconds": self.ttl_seconds,
+        }
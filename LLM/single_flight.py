@@ -0,0 +1,53 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+
+
+def normalize_prompt(user_prompt: str) -> str:
+    """Lowercases and drops punctuation and extra whitespace so trivially different prompts match"""
+    return " ".join(PUNCTUATION_PATTERN.sub(" ", user_prompt.lower()).split())
+
+
+class SingleFlight(Generic[T]):
+    """
+    Coalesces concurrent calls that share a key into one computation. The first caller
+    (the leader) starts it as a task, callers arriving while it runs await the same task.
+    The task is shielded so a caller that disconnects doesn't cancel it for the others.
+    Tasks belong to the event loop that started them, so one instance serves one loop.
+    """
+
+    def __init__(self):
+        self.in_flight: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def run(
+        self, key: str, compute: Callable[[], Awaitable[T]]
+    ) -> tuple[T, bool]:
+        """Returns the result and whether this caller was the leader that computed it"""
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.followers += 1
+            return await asyncio.shield(task), False
+
+        task = asyncio.create_task(compute())
+        self.in_flight[key] = task
+
+        def forget(done: asyncio.Task) -> None:
+            if self.in_flight.get(key) is done:
+                del self.in_flight[key]
+
+        task.add_done_callback(forget)
+        self.leaders += 1
+        return await asyncio.shield(task), True
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+
+class StageTimings:
+    """
+    Wall-clock time spent in each pipeline stage of one request. Stages that run more
+    than once (e.g. two tool calls to the same tool) are summed. Stages can finish on
+    worker threads, so updates are guarded by a lock.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def as_dict(self) -> dict[str, float]:
+        """Stage durations in milliseconds"""
+        with self._lock:
+            return {
+                name: round(seconds * 1000, 1)
+                for name, seconds in self.durations.items()
+            }
+
+    def server_timing_header(self) -> str:
+        stages = [f"{name};dur={ms}" for name, ms in self.as_dict().items()]
+        total_ms = round((time.perf_counter() - self.started_at) * 1000, 1)
+        return ", ".join([*stages, f"total;dur={total_ms}"])
+
+
+_current_timings: ContextVar[Optional[StageTimings]] = ContextVar(
+    "stage_timings", default=None
+)
+
+
+def start_timings() -> StageTimings:
+    """Starts collecting stage timings for the current request (and tasks/threads it starts)"""
+    timings = StageTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[StageTimings]:
+    return _current_timings.get()
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times the enclosed block as `name`, a no-op outside of a timed request"""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started_at)
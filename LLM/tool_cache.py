@@ -0,0 +1,148 @@
+import copy
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Optional
+
+# Arguments that don't change what a tool returns
+EXCLUDED_ARGUMENTS = {"user_onc_token", "obtainedParams"}
+# Stands in for the caller's ONC token inside cached responses (urlParamsUsed, baseUrl)
+TOKEN_PLACEHOLDER = "{ONC_TOKEN}"
+
+
+def parse_date(value) -> Optional[date]:
+    """Returns the date of a YYYY-MM-DD or ISO 8601 argument, None for anything else"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        return None
+
+
+def replace_text(value, old: str, new: str):
+    """Replaces old with new in every string nested inside dicts, lists and tuples"""
+    if isinstance(value, str):
+        return value.replace(old, new)
+    if isinstance(value, dict):
+        return {key: replace_text(item, old, new) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(replace_text(item, old, new) for item in value)
+    return value
+
+
+class ToolResultCache:
+    """
+    Caches ONC tool responses keyed by function name and normalized arguments. Data for
+    windows that ended more than settle_days ago doesn't change any more, so those entries
+    never expire. Anything newer, or without a date, is kept for recent_ttl_seconds.
+    Tools run in worker threads, so every access is guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        recent_ttl_seconds: float = 600,
+        settle_days: int = 2,
+    ):
+        self.max_entries = max_entries
+        self.recent_ttl_seconds = recent_ttl_seconds
+        self.settle_days = settle_days
+        # key -> (monotonic expiry or None for never, response with the token scrubbed)
+        self.entries: OrderedDict[str, tuple[Optional[float], dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_arguments(fn, args: dict) -> Optional[dict]:
+        """Binds args to fn's signature (filling in defaults) so equivalent calls share a key"""
+        try:
+            bound = inspect.signature(fn).bind_partial(**args)
+        except TypeError:
+            return None
+        bound.apply_defaults()
+        return {
+            name: value
+            for name, value in bound.arguments.items()
+            if name not in EXCLUDED_ARGUMENTS
+        }
+
+    @staticmethod
+    def make_key(function_name: str, arguments: dict) -> str:
+        return json.dumps([function_name, arguments], sort_keys=True, default=str)
+
+    def _expires_at(self, arguments: dict) -> Optional[float]:
+        dates = [
+            parsed
+            for parsed in (parse_date(value) for value in arguments.values())
+            if parsed
+        ]
+        settled_before = date.today() - timedelta(days=self.settle_days)
+        if dates and max(dates) < settled_before:
+            return None
+        return time.monotonic() + self.recent_ttl_seconds
+
+    def get(self, fn, args: dict, user_onc_token: str) -> Optional[dict]:
+        arguments = self.normalize_arguments(fn, args)
+        if arguments is None:
+            return None
+        key = self.make_key(fn.__name__, arguments)
+        with self._lock:
+            entry = self.entries.get(key)
+            if (
+                entry is not None
+                and entry[0] is not None
+                and entry[0] <= time.monotonic()
+            ):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            response = copy.deepcopy(entry[1])
+        if user_onc_token:
+            response = replace_text(response, TOKEN_PLACEHOLDER, user_onc_token)
+        return response
+
+    def put(self, fn, args: dict, user_onc_token: str, response) -> None:
+        # Errors (bad token, ONC outage, timeouts) should be retried on the next call
+        if not isinstance(response, dict) or str(
+            response.get("response", "")
+        ).startswith("Error"):
+            return
+        arguments = self.normalize_arguments(fn, args)
+        if arguments is None:
+            return
+        key = self.make_key(fn.__name__, arguments)
+        response = copy.deepcopy(response)
+        if user_onc_token:
+            response = replace_text(response, user_onc_token, TOKEN_PLACEHOLDER)
+        with self._lock:
+            self.entries[key] = (self._expires_at(arguments), response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "permanent_entries": sum(
+                    1 for expires_at, _ in self.entries.values() if expires_at is None
+                ),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "recent_ttl_seconds": self.recent_ttl_seconds,
+                "settle_days": self.settle_days,
+            }
@@ -0,0 +1,132 @@
+"""
+Renders the result of small, deterministic tools straight into the final answer so
+run_conversation can skip the second LLM call. Each renderer receives the tool's
+"response" value and returns markdown in the same shape second_LLM_prompt asks for,
+or None when it can't render it (missing data, errors), in which case the LLM is used.
+"""
+
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ToolRenderer = Callable[[dict], Optional[str]]
+
+FOLLOW_UP = "Let me know if you have any other questions!"
+
+
+def stats_table(measurement: str, minimum, maximum, average) -> str:
+    return "\n".join(
+        [
+            f"| Measurement | {measurement} |",
+            "|-------------|" + "-" * (len(measurement) + 2) + "|",
+            f"| Minimum | {minimum:.2f} |",
+            f"| Maximum | {maximum:.2f} |",
+            f"| Average | {average:.2f} |",
+        ]
+    )
+
+
+def render_sea_temperature_stats(response: dict) -> Optional[str]:
+    return (
+        f"{response['description']} (seawater temperature measured by the CTD):\n\n"
+        + stats_table(
+            "Sea temperature (°C)",
+            response["daily_min"],
+            response["daily_max"],
+            response["daily_avg"],
+        )
+    )
+
+
+def render_air_temperature_stats(response: dict) -> Optional[str]:
+    stats = response["stats"]
+    if stats["mean"] is None:
+        return None
+    return (
+        f"{response['description']}, from {stats['samples']} samples at the "
+        "Cambridge Bay weather station:\n\n"
+        + stats_table(
+            "Air temperature (°C)", stats["min_temp"], stats["max_temp"], stats["mean"]
+        )
+    )
+
+
+def render_wind_speed(response: dict) -> Optional[str]:
+    data = response.get("data")
+    if not data or data["wind_speed_m_s"] is None:
+        return None
+    timestamp = datetime.strptime(data["datetime"], "%Y-%m-%dT%H:%M:%SZ")
+    return (
+        "Wind speed measured by the Cambridge Bay weather station:\n\n"
+        "| Time | Wind speed (m/s) |\n"
+        "|------|------------------|\n"
+        f"| {timestamp:%Y-%m-%d %H:%M:%S} | {data['wind_speed_m_s']:.2f} |"
+    )
+
+
+def render_ice_thickness(response: dict) -> Optional[str]:
+    thickness = response["average_ice_thickness"]
+    if thickness is None or thickness < 0:
+        return None
+    # "... over the time range: 2024-02-01 to 2024-03-01 is 1.2345 m"
+    period = response["description"].split("time range: ")[1].split(" is ")[0]
+    return (
+        f"The average sea-ice thickness at Cambridge Bay from {period} was "
+        f"**{thickness:.3f} m**, measured by the ice profiler and excluding samples "
+        "that failed quality control."
+    )
+
+
+def render_active_instruments(response: dict) -> Optional[str]:
+    result = response["result"]
+    categories = Counter(
+        device.get("deviceCategoryCode", "unknown") for device in result["details"]
+    )
+    rows = "\n".join(
+        f"| {category} | {count} |" for category, count in sorted(categories.items())
+    )
+    return (
+        f"There are **{result['activeInstrumentCount']}** instruments currently "
+        "collecting data at Cambridge Bay:\n\n"
+        "| Device category | Instruments |\n"
+        "|-----------------|-------------|\n"
+        f"{rows}"
+    )
+
+
+TOOL_RENDERERS: dict[str, ToolRenderer] = {
+    "get_daily_sea_temperature_stats_cambridge_bay": render_sea_temperature_stats,
+    "get_daily_air_temperature_stats_cambridge_bay": render_air_temperature_stats,
+    "get_wind_speed_at_timestamp": render_wind_speed,
+    "get_ice_thickness": render_ice_thickness,
+    "get_active_instruments_at_cambridge_bay": render_active_instruments,
+}
+
+
+def render_tool_responses(
+    tool_responses: list[tuple[str, dict]], renderers: dict[str, ToolRenderer]
+) -> Optional[str]:
+    """Renders every tool response, or returns None if any tool has no renderer or fails to render"""
+    if not tool_responses:
+        return None
+    parts = []
+    for function_name, function_response in tool_responses:
+        renderer = renderers.get(function_name)
+        if renderer is None:
+            return None
+        response = function_response.get("response")
+        if not isinstance(response, dict):
+            # Tool errors come back as strings, the LLM explains those better
+            return None
+        try:
+            rendered = renderer(response)
+        except (IndexError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Could not render {function_name} response: {e}")
+            return None
+        if not rendered:
+            return None
+        parts.append(rendered)
+    return "\n\n".join([*parts, FOLLOW_UP])
@@ -0,0 +1,128 @@
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+import numpy as np
+
+# Turns like "thanks!" or "hello there" that never need a tool
+CONVERSATIONAL_WORDS = {
+    "hi",
+    "hello",
+    "hey",
+    "there",
+    "thanks",
+    "thank",
+    "you",
+    "so",
+    "much",
+    "very",
+    "ok",
+    "okay",
+    "cool",
+    "great",
+    "awesome",
+    "perfect",
+    "nice",
+    "bye",
+    "goodbye",
+    "good",
+    "morning",
+    "afternoon",
+    "evening",
+    "got",
+    "it",
+    "that",
+    "helps",
+    "helpful",
+    "cheers",
+}
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+
+def is_conversational(user_prompt: str) -> bool:
+    words = WORD_PATTERN.findall(user_prompt.lower())
+    return bool(words) and all(word in CONVERSATIONAL_WORDS for word in words)
+
+
+def tool_text(tool: dict) -> str:
+    """The text a tool is matched on: its name, description and parameter descriptions (not the enums)"""
+    function = tool["function"]
+    parameters = function.get("parameters", {}).get("properties", {})
+    return "\n".join(
+        [
+            function["name"].replace("_", " "),
+            function.get("description", ""),
+            *(
+                f"{name}: {schema.get('description', '')}"
+                for name, schema in parameters.items()
+            ),
+        ]
+    )
+
+
+class ToolRetriever:
+    """
+    Picks the tool schemas worth sending with a tool-selection call. Every tool is
+    embedded once, each prompt gets its top_k tools plus any other tool at or above
+    min_similarity, and conversational turns get none. A follow-up is also matched on the previous question
+    so "what about the day after?" keeps the tool the conversation was using.
+    """
+
+    def __init__(
+        self,
+        embed_documents: Callable[[list[str]], list[list[float]]],
+        embed_query: Callable[[str], list[float]],
+        tool_descriptions: list[dict],
+        top_k: int = 4,
+        min_similarity: float = 0.25,
+    ):
+        self.tool_descriptions = tool_descriptions
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        # Previous questions come back on every follow-up
+        self.embed_query = lru_cache(maxsize=1024)(embed_query)
+        self.tool_embeddings = np.stack(
+            [
+                self._normalize(embedding)
+                for embedding in embed_documents(
+                    [tool_text(tool) for tool in tool_descriptions]
+                )
+            ]
+        )
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def similarities(self, query_embedding) -> np.ndarray:
+        return self.tool_embeddings @ self._normalize(query_embedding)
+
+    def select(
+        self,
+        user_prompt: str,
+        query_embedding,
+        previous_prompt: Optional[str] = None,
+        required_tools: set[str] = frozenset(),
+    ) -> list[dict]:
+        """Returns the relevant tool schemas in their original order, required_tools are always included"""
+        if is_conversational(user_prompt) and not required_tools:
+            return []
+        scores = self.similarities(query_embedding)
+        if previous_prompt:
+            scores = np.maximum(
+                scores, self.similarities(self.embed_query(previous_prompt))
+            )
+        # The floor only adds tools, a question unlike every description keeps its top_k
+        ranked = set(np.argsort(-scores)[: self.top_k]) | set(
+            np.flatnonzero(scores >= self.min_similarity)
+        )
+        selected = {
+            self.tool_descriptions[index]["function"]["name"] for index in ranked
+        } | set(required_tools)
+        return [
+            tool
+            for tool in self.tool_descriptions
+            if tool["function"]["name"] in selected
+        ]
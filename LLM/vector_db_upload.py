@@ -23,6 +23,7 @@ from unstructured.cleaners.core import clean
 from unstructured.partition.pdf import partition_pdf
 
 from LLM.RAG import JinaEmbeddings, QdrantClientWrapper
+from LLM.vector_format import VectorFormat
 
 """
 Series of functions to preprocess PDF files + json files, extract structured text chunks,
@@ -36,13 +37,13 @@ Usage for pdfs (or json's):
     - `embedding`: The embedding vector for the chunk.
     - `text`: The text content of the chunk.
     - `metadata`: Additional metadata source file and page number.
-4. Call `upload_to_vector_db(resultsList, qdrant)` to upload the list of results to a Qdrant vector database.
+4. Await `upload_to_vector_db(resultsList, qdrant)` to upload the list of results to a Qdrant vector database.
 
 Usage for collecting ONC device data and scraping URIs:
 1. Call `get_device_info_from_onc_for_vdb(location_code)` with the desired location code to retrieve a list of devices and their information, 
     including device description scraped from the corresponding URI.
 2. Use `prepare_embedding_input_from_preformatted(input)` to prepare the embedding input from the list of structured data obtained from get_device_info_from_onc_for_vdb. Optionally you can provide a JinaEmbedding Instance otherwise one is created. Optionally you can change doChunking to False to not split data into chunks.
-3. Call `upload_to_vector_db(resultsList, qdrant)` to upload the list of results to a Qdrant vector database.
+3. Await `upload_to_vector_db(resultsList, qdrant)` to upload the list of results to a Qdrant vector database.
 
 To speed up use assumes that the embedding model and qdrant client are being used from the RAG module.
 """
@@ -306,19 +307,29 @@ def get_device_info_from_onc_for_vdb(location_code):
     return results
 
 
-def upload_to_vector_db(resultsList: list, qdrant: QdrantClientWrapper):
+def build_points(resultsList: list, vector_format: VectorFormat) -> list[PointStruct]:
+    if not resultsList:
+        return []
+    # Cut to the collection's Matryoshka dimensions in one pass
+    vectors = vector_format.truncate([item["embedding"] for item in resultsList])
     points = []
-    for item in resultsList:
+    for item, vector in zip(resultsList, vectors):
         points.append(
             PointStruct(
                 id=uuid4().hex,
-                vector=item["embedding"],
+                vector=vector.tolist(),
                 payload={"text": item["text"], **item["metadata"]},
             )
         )
+    return points
 
-    qdrant.qdrant_client.upload_points(
-        collection_name=qdrant.general_collection_name, points=points
+
+async def upload_to_vector_db(resultsList: list, qdrant: QdrantClientWrapper):
+    await qdrant.async_qdrant_client.upload_points(
+        collection_name=qdrant.general_collection_name,
+        points=build_points(
+            resultsList, qdrant.vector_formats[qdrant.general_collection_name]
+        ),
     )
 
 
@@ -515,7 +526,16 @@ def vdb_auto_upload(app_state):
         print(
             f"{get_current_time()} vector DB auto upload - Uploading {len(prepare_embedding_input)} points to {qdrant_client_wrapper.general_collection_name}"
         )
-        upload_to_vector_db(prepare_embedding_input, qdrant_client_wrapper)
+        # Runs in the scheduler's thread, away from the async client's event loop
+        qdrant_client_wrapper.qdrant_client.upload_points(
+            collection_name=qdrant_client_wrapper.general_collection_name,
+            points=build_points(
+                prepare_embedding_input,
+                qdrant_client_wrapper.vector_formats[
+                    qdrant_client_wrapper.general_collection_name
+                ],
+            ),
+        )
         print(f"{get_current_time()} vector DB auto upload - END")
     except Exception as e:
         print(
@@ -0,0 +1,202 @@
+"""
+How a collection stores its jina-embeddings-v3 vectors in Qdrant.
+
+jina-embeddings-v3 is Matryoshka-trained: the first 32/64/128/256/512/768 of its 1024
+dimensions are an embedding on their own once renormalized, so a collection can keep
+fewer dimensions at a small quality cost. truncate() does this to documents on upload
+and to queries on search, so the query cache and the model keep the full vectors.
+
+On top of that, storage picks what Qdrant keeps per dimension:
+    float32  4 bytes, as uploaded
+    float16  2 bytes, converted by Qdrant
+    int8     1 byte scalar-quantized copy in RAM, float32 originals on disk
+    binary   1 bit binary-quantized copy in RAM, float32 originals on disk
+Quantized collections are searched on the RAM copy with oversampling * limit
+candidates, which are then rescored with the original vectors.
+
+Formats are set per collection with the VECTOR_FORMATS environment variable, a JSON
+object keyed like RERANK_POLICIES, e.g.
+    {"general": {"dimensions": 512, "storage": "int8"}}
+The collection itself has to be rebuilt in the new format first, with
+LLM/migrate_vector_format.py.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    CollectionStatus,
+    Datatype,
+    Distance,
+    PayloadSchemaType,
+    PointStruct,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
+
+FULL_DIMENSIONS = 1024
+MATRYOSHKA_DIMENSIONS = (32, 64, 128, 256, 512, 768, FULL_DIMENSIONS)
+STORAGE_TYPES = ("float32", "float16", "int8", "binary")
+
+
+@dataclass
+class VectorFormat:
+    dimensions: int = FULL_DIMENSIONS
+    storage: str = "float32"
+    # Quantized candidates fetched per requested hit before rescoring
+    oversampling: float = 2.0
+
+    def __post_init__(self):
+        if self.dimensions not in MATRYOSHKA_DIMENSIONS:
+            raise ValueError(
+                f"dimensions must be one of {MATRYOSHKA_DIMENSIONS}, not {self.dimensions}"
+            )
+        if self.storage not in STORAGE_TYPES:
+            raise ValueError(
+                f"storage must be one of {STORAGE_TYPES}, not {self.storage!r}"
+            )
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage in ("int8", "binary")
+
+    def truncate(self, vectors) -> np.ndarray:
+        """One vector or a matrix of rows cut to the first dimensions and renormalized"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[-1] == self.dimensions:
+            return vectors
+        truncated = vectors[..., : self.dimensions]
+        norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+        return truncated / np.where(norms == 0, 1, norms)
+
+    def vectors_config(self) -> VectorParams:
+        return VectorParams(
+            size=self.dimensions,
+            distance=Distance.COSINE,
+            datatype=Datatype.FLOAT16 if self.storage == "float16" else None,
+            # Only rescoring reads the originals, the quantized copy stays in RAM
+            on_disk=True if self.quantized else None,
+        )
+
+    def quantization_config(self):
+        if self.storage == "int8":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8, quantile=0.99, always_ram=True
+                )
+            )
+        if self.storage == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self):
+        if not self.quantized:
+            return None
+        return SearchParams(
+            quantization=QuantizationSearchParams(
+                rescore=True, oversampling=self.oversampling
+            )
+        )
+
+    def bytes_per_vector(self) -> float:
+        """RAM Qdrant needs per vector for search, leaving out the HNSW graph"""
+        return (
+            self.dimensions
+            * {
+                "float32": 4,
+                "float16": 2,
+                "int8": 1,
+                "binary": 1 / 8,
+            }[self.storage]
+        )
+
+    def __str__(self) -> str:
+        return f"{self.dimensions}d {self.storage}"
+
+
+def formats_from_overrides(overrides: dict[str, dict]) -> dict[str, VectorFormat]:
+    """Formats keyed like the overrides ("general", "function_calling", "qa")"""
+    return {name: VectorFormat(**override) for name, override in overrides.items()}
+
+
+# Points per scroll and upsert request
+MIGRATION_BATCH_SIZE = 256
+
+
+async def migrate_collection(
+    client: AsyncQdrantClient,
+    source: str,
+    target: str,
+    vector_format: VectorFormat,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+) -> int:
+    """Copies every point of source into a new target collection, returns the point count"""
+    source_vectors = (await client.get_collection(source)).config.params.vectors
+    if isinstance(source_vectors, dict):
+        raise ValueError(
+            f"{source} has named vectors, only a single vector is supported"
+        )
+    if source_vectors.size < vector_format.dimensions:
+        raise ValueError(
+            f"{source} has {source_vectors.size} dimensions, can't migrate to "
+            f"{vector_format.dimensions}"
+        )
+    if await client.collection_exists(target):
+        raise ValueError(f"{target} already exists")
+
+    await client.create_collection(
+        target,
+        vectors_config=vector_format.vectors_config(),
+        quantization_config=vector_format.quantization_config(),
+    )
+    # Source removal and the scheduled upload filter on it
+    await client.create_payload_index(
+        target, field_name="source", field_schema=PayloadSchemaType.KEYWORD
+    )
+
+    copied = 0
+    offset = None
+    while True:
+        records, offset = await client.scroll(
+            source,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if records:
+            vectors = vector_format.truncate([record.vector for record in records])
+            await client.upsert(
+                target,
+                points=[
+                    PointStruct(
+                        id=record.id, vector=vector.tolist(), payload=record.payload
+                    )
+                    for record, vector in zip(records, vectors)
+                ],
+            )
+            copied += len(records)
+        if offset is None:
+            return copied
+
+
+async def wait_until_indexed(
+    client: AsyncQdrantClient, collection_name: str, timeout: float = 600
+) -> None:
+    """Waits for Qdrant to finish building the collection's index and quantized vectors"""
+    deadline = time.monotonic() + timeout
+    while (
+        await client.get_collection(collection_name)
+    ).status != CollectionStatus.GREEN:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{collection_name} wasn't indexed within {timeout} s")
+        await asyncio.sleep(1)
@@ -0,0 +1,264 @@
+"""
+In-process mirror of small Qdrant collections for exact vector search without a
+network round trip.
+
+Each mirrored collection is scrolled (payloads and vectors) into a NumPy matrix at
+startup, and searched exactly with one matrix product. A background task checks every
+refresh_seconds whether the collection's point ids changed (the vector DB uploads always
+write new ids) and reloads it if they did. Writes made through this process call
+mark_stale(), which stops local search on that collection and wakes the task straight
+away. A collection is only searched locally while it is fresh: synced within
+max_staleness_seconds and not marked stale. Otherwise search() returns None and the
+caller falls back to Qdrant. Collections larger than max_points, or with a distance
+other than cosine or dot product, are never mirrored.
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from qdrant_client.http.models import Distance, Record, ScoredPoint
+
+logger = logging.getLogger(__name__)
+
+# Points per scroll request when loading a collection
+SCROLL_PAGE_SIZE = 1000
+
+
+@dataclass
+class MirroredCollection:
+    ids: list
+    # One row per point, normalized for cosine collections
+    matrix: np.ndarray
+    payloads: list[dict]
+    fingerprint: frozenset
+    synced_at: float
+    stale: bool = False
+
+    def memory_bytes(self) -> int:
+        return self.matrix.nbytes + sum(
+            sys.getsizeof(payload.get("text", "")) for payload in self.payloads
+        )
+
+
+class VectorIndexMirror:
+    def __init__(
+        self,
+        client,
+        collection_names: list[str],
+        refresh_seconds: float = 60,
+        max_staleness_seconds: float = 300,
+        max_points: int = 50000,
+    ):
+        self.client = client
+        self.collection_names = [name for name in collection_names if name]
+        self.refresh_seconds = refresh_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self.max_points = max_points
+        self.collections: dict[str, MirroredCollection] = {}
+        self.positions: dict[str, dict] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.local_searches = 0
+        self.fallbacks = 0
+        self.reloads = 0
+        self.sync_errors = 0
+
+    async def start(self) -> None:
+        """Loads every collection, then keeps them in sync in the background"""
+        await self.sync()
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def _sync_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.refresh_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.sync()
+
+    async def sync(self) -> None:
+        for collection_name in self.collection_names:
+            try:
+                await self.sync_collection(collection_name)
+            except Exception as e:
+                self.sync_errors += 1
+                logger.warning(f"Syncing vector index of {collection_name} failed: {e}")
+
+    async def point_ids(self, collection_name: str) -> Optional[frozenset]:
+        """Every point id in the collection, None if it is too large to mirror"""
+        ids = []
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            ids.extend(record.id for record in records)
+            if len(ids) > self.max_points:
+                return None
+            if offset is None:
+                return frozenset(ids)
+
+    async def sync_collection(self, collection_name: str) -> None:
+        fingerprint = await self.point_ids(collection_name)
+        mirrored = self.collections.get(collection_name)
+        if fingerprint is None:
+            self.collections.pop(collection_name, None)
+            return
+        if (
+            mirrored is not None
+            and not mirrored.stale
+            and mirrored.fingerprint == fingerprint
+        ):
+            mirrored.synced_at = time.monotonic()
+            return
+        collection = await self.load(collection_name)
+        if collection is None:
+            self.collections.pop(collection_name, None)
+            return
+        self.collections[collection_name] = collection
+        self.positions[collection_name] = {
+            point_id: position for position, point_id in enumerate(collection.ids)
+        }
+        self.reloads += 1
+        logger.info(
+            f"Loaded {len(collection.ids)} points of {collection_name} into the vector index"
+        )
+
+    async def load(self, collection_name: str) -> Optional[MirroredCollection]:
+        info = await self.client.get_collection(collection_name)
+        vectors = info.config.params.vectors
+        if isinstance(vectors, dict) or vectors.distance not in (
+            Distance.COSINE,
+            Distance.DOT,
+        ):
+            logger.info(f"Not mirroring {collection_name}: unsupported vector config")
+            return None
+        ids, rows, payloads = [], [], []
+        offset = None
+        while True:
+            records, offset = await self.client.scroll(
+                collection_name,
+                limit=SCROLL_PAGE_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+            for record in records:
+                ids.append(record.id)
+                rows.append(record.vector)
+                payloads.append(record.payload or {})
+            if len(ids) > self.max_points:
+                return None
+            if offset is None:
+                break
+        matrix = (
+            np.asarray(rows, dtype=np.float32)
+            if rows
+            else np.zeros((0, vectors.size), dtype=np.float32)
+        )
+        if vectors.distance == Distance.COSINE:
+            matrix = self._normalize_rows(matrix)
+        return MirroredCollection(
+            ids=ids,
+            matrix=matrix,
+            payloads=payloads,
+            fingerprint=frozenset(ids),
+            synced_at=time.monotonic(),
+        )
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def fresh(self, collection_name: str) -> Optional[MirroredCollection]:
+        collection = self.collections.get(collection_name)
+        if (
+            collection is None
+            or collection.stale
+            or time.monotonic() - collection.synced_at > self.max_staleness_seconds
+        ):
+            return None
+        return collection
+
+    def search(
+        self, collection_name: str, query_vector, limit: int
+    ) -> Optional[list[ScoredPoint]]:
+        """The limit nearest points like Qdrant's search, None if the mirror isn't fresh"""
+        collection = self.fresh(collection_name)
+        if collection is None:
+            self.fallbacks += 1
+            return None
+        self.local_searches += 1
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        # Qdrant normalizes cosine queries too, scaling doesn't change the dot product order
+        scores = collection.matrix @ (query / norm if norm else query)
+        limit = min(limit, len(scores))
+        if limit == 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [
+            ScoredPoint(
+                id=collection.ids[position],
+                version=0,
+                score=float(scores[position]),
+                payload=collection.payloads[position],
+            )
+            for position in top
+        ]
+
+    def retrieve(self, collection_name: str, ids: list) -> Optional[list[Record]]:
+        """Points by id like Qdrant's retrieve, None if any is missing or the mirror isn't fresh"""
+        collection = self.fresh(collection_name)
+        positions = self.positions.get(collection_name, {})
+        if collection is None or any(point_id not in positions for point_id in ids):
+            self.fallbacks += 1
+            return None
+        self.local_searches += 1
+        return [
+            Record(id=point_id, payload=collection.payloads[positions[point_id]])
+            for point_id in ids
+        ]
+
+    def mark_stale(self, collection_name: str) -> None:
+        """Stops local search on a collection this process just wrote to, until it reloads"""
+        collection = self.collections.get(collection_name)
+        if collection is not None:
+            collection.stale = True
+        self._wake.set()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "collections": {
+                name: {
+                    "points": len(collection.ids),
+                    "dimensions": collection.matrix.shape[1],
+                    "memory_mb": round(collection.memory_bytes() / 2**20, 2),
+                    "synced_seconds_ago": round(now - collection.synced_at, 1),
+                    "fresh": self.fresh(name) is not None,
+                }
+                for name, collection in self.collections.items()
+            },
+            "local_searches": self.local_searches,
+            "fallbacks": self.fallbacks,
+            "reloads": self.reloads,
+            "sync_errors": self.sync_errors,
+        }
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
@@ -6,6 +6,7 @@ from fastapi import (
     APIRouter,
     BackgroundTasks,
     Depends,
+    Query,
     Request,
 )
 from sentence_transformers import SentenceTransformer
@@ -25,6 +26,7 @@ from .schemas import (
     JSONUploadRequest,
     PDFUploadRequest,
     RawTextUploadRequest,
+    StageTimingStats,
     UploadResponse,
     VectorDocumentOut,
 )
@@ -110,6 +112,27 @@ async def get_clustered_messages(
     return dict(clusters)
 
 
+@router.get("/cache/stats")
+async def get_cache_stats(
+    _: Annotated[auth_schemas.UserOut, Depends(get_admin_user)],
+    request: Request,
+) -> dict:
+    """Hit, miss and latency-saved counters for the LLM caches and coalesced requests"""
+    llm = getattr(request.app.state, "llm", None)
+    # The LLM is created lazily, before the first message there is nothing cached
+    return llm.get_cache_stats() if llm is not None else {}
+
+
+@router.get("/timings", response_model=dict[str, StageTimingStats])
+async def get_stage_timings(
+    _: Annotated[auth_schemas.UserOut, Depends(get_admin_user)],
+    db: Annotated[AsyncSession, Depends(get_db_session)],
+    hours: Annotated[int, Query(ge=1, le=24 * 30)] = 24,
+) -> dict[str, StageTimingStats]:
+    """p50/p95/p99 latency of each pipeline stage over messages from the last `hours` hours"""
+    return await service.get_stage_timing_stats(hours, db)
+
+
 @router.post("/documents/raw-data", status_code=201, response_model=UploadResponse)
 async def upload_raw_text(
     current_admin: Annotated[auth_schemas.UserOut, Depends(get_admin_user)],
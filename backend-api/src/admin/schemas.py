@@ -30,6 +30,15 @@ class UploadResponse(BaseModel):
     detail: str = Field(..., description="Human‑readable status message")
 
 
+class StageTimingStats(BaseModel):
+    """Latency percentiles of one pipeline stage, in milliseconds."""
+
+    count: int = Field(..., description="Number of messages that ran this stage")
+    p50: float
+    p95: float
+    p99: float
+
+
 class RawTextUploadRequest(BaseModel):
     source: Annotated[str, Form(...)]
     input_text: Annotated[str, Form(...)]
@@ -1,5 +1,8 @@
 import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 from fastapi import HTTPException, Request, status
 from qdrant_client.http.models import FieldCondition, Filter, MatchValue, UpdateStatus
 from sqlalchemy import delete, select, update
@@ -14,6 +17,8 @@ from LLM.vector_db_upload import (
     upload_to_vector_db,
 )
 from src.admin.models import VectorDocument
+from src.admin.schemas import StageTimingStats
+from src.llm.models import Message
 from src.logger import logger
 
 
@@ -65,9 +70,8 @@ async def raw_text_upload_to_vdb(
             [{"paragraphs": [information], "page": [], "source": source}],
             state.rag.embedding,
         )
-        await asyncio.to_thread(
-            upload_to_vector_db, prepared, state.rag.qdrant_client_wrapper
-        )
+        await upload_to_vector_db(prepared, state.rag.qdrant_client_wrapper)
+        await state.rag.collection_changed(state.rag.general_collection_name)
         logger.info(
             f"Raw text successfully uploaded for '{source}' by {uploaded_by_id}"
         )
@@ -105,9 +109,8 @@ async def json_upload_to_vdb(
         prepared_input = prepare_embedding_input(
             processed_json, embedding_model=state.rag.embedding
         )
-        await asyncio.to_thread(
-            upload_to_vector_db, prepared_input, state.rag.qdrant_client_wrapper
-        )
+        await upload_to_vector_db(prepared_input, state.rag.qdrant_client_wrapper)
+        await state.rag.collection_changed(state.rag.general_collection_name)
         logger.info(f"JSON successfully uploaded for '{source}' by {uploaded_by_id}")
     except Exception as e:
         logger.error(f"JSON upload failed for '{source}' by {uploaded_by_id}: {e}")
@@ -161,9 +164,8 @@ async def pdf_upload_to_vdb(
         prepared = prepare_embedding_input(
             processed, embedding_model=state.rag.embedding
         )
-        await asyncio.to_thread(
-            upload_to_vector_db, prepared, state.rag.qdrant_client_wrapper
-        )
+        await upload_to_vector_db(prepared, state.rag.qdrant_client_wrapper)
+        await state.rag.collection_changed(state.rag.general_collection_name)
         logger.info(f"PDF successfully uploaded for '{source}' by {uploaded_by_id}")
     except Exception as e:
         logger.error(f"PDF upload failed for '{source}' by {uploaded_by_id}: {e}")
@@ -189,9 +191,10 @@ async def source_remove_from_vdb(
                 FieldCondition(key="source", match=MatchValue(value=source_to_remove))
             ]
         )
-        result = state.rag.qdrant_client.delete(
-            state.rag.collection_name, points_selector=filter_cond
+        result = await state.rag.async_qdrant_client.delete(
+            state.rag.general_collection_name, points_selector=filter_cond
         )
+        await state.rag.collection_changed(state.rag.general_collection_name)
         if result.status != UpdateStatus.COMPLETED:
             raise HTTPException(status_code=502, detail="Vector DB deletion incomplete")
     except HTTPException:
@@ -255,3 +258,31 @@ async def increment_usage(sources: list[str], db: AsyncSession) -> None:
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to increment usage: {e}")
+
+
+async def get_stage_timing_stats(
+    hours: int, db: AsyncSession
+) -> dict[str, StageTimingStats]:
+    """Aggregate the per-stage timings saved on messages from the last `hours` hours."""
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    result = await db.execute(
+        select(Message.timings).where(
+            Message.created_at >= since, Message.timings.is_not(None)
+        )
+    )
+
+    durations: dict[str, list[float]] = defaultdict(list)
+    for timings in result.scalars().all():
+        for stage_name, ms in timings.items():
+            durations[stage_name].append(ms)
+
+    stats = {}
+    for stage_name, values in sorted(durations.items()):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        stats[stage_name] = StageTimingStats(
+            count=len(values),
+            p50=round(float(p50), 1),
+            p95=round(float(p95), 1),
+            p99=round(float(p99), 1),
+        )
+    return stats
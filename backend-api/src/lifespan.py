@@ -9,6 +9,7 @@ from LLM.core import LLM
 from LLM.Environment import Environment
 from LLM.vector_db_upload import vdb_auto_upload
 from src.database import DatabaseSessionManager
+from src.llm.orders import create_order_poller
 from src.logger import logger
 from src.settings import get_settings
 
@@ -41,8 +42,18 @@ async def lifespan(app: FastAPI):
 
         logger.info("Getting RAG instance ...")
         app.state.rag = app.state.llm.RAG_instance
+        await app.state.rag.start()
         logger.info("RAG instance initialized successfully.")
 
+        app.state.order_poller = create_order_poller(
+            session_manager.session, get_settings()
+        )
+        try:
+            await app.state.order_poller.resume()
+        except Exception as e:
+            # New orders are still polled, only ones from before the restart are missed
+            logger.error(f"Resuming data product orders failed: {e}")
+
         scheduler = BackgroundScheduler()
         scheduler.add_job(
             vdb_auto_upload,
@@ -72,6 +83,12 @@ async def lifespan(app: FastAPI):
 
     # Teardown
     logger.info("Shutting down application...")
+    if hasattr(app.state, "order_poller"):
+        await app.state.order_poller.close()
+    if hasattr(app.state, "rag"):
+        await app.state.rag.close()
     if hasattr(app.state, "session_manager"):
         await app.state.session_manager.close()
+    if hasattr(app.state, "env"):
+        await app.state.env.close()
     logger.info("Resources cleaned up.")
@@ -1,6 +1,7 @@
-from typing import TYPE_CHECKING, Any
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Optional
 
-from sqlalchemy import JSON, ForeignKey, Integer, String, Text
+from sqlalchemy import JSON, DateTime, ForeignKey, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from src.database import Base
@@ -53,6 +54,17 @@ class Message(Base):
     onc_api_url: Mapped[str] = mapped_column(String, nullable=True)
     citation: Mapped[str] = mapped_column(String, nullable=True)
     sources: Mapped[list] = mapped_column(JSON, default=list)
+    # Milliseconds spent in each pipeline stage, e.g. {"tool_selection_llm": 812.4}
+    timings: Mapped[Optional[dict[str, float]]] = mapped_column(JSON, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), index=True
+    )
+    # Progress of the ONC data product order behind request_id, kept up to date by OrderPoller
+    order_status: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    order_file_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    order_download_urls: Mapped[Optional[list[str]]] = mapped_column(
+        JSON, nullable=True
+    )
 
     # many-to-one: each message belongs to a conversation
     conversation: Mapped["Conversation"] = relationship(back_populates="messages")
@@ -0,0 +1,283 @@
+"""
+Background polling of ONC data product orders.
+
+generate_download_codes, get_ship_noise_acoustic_for_date and plot_spectrogram_for_date
+only place an order and return its dpRequestId. OrderPoller runs the order on ONC
+(dataProductDelivery/run also reports the status of a run that already started), polls
+it with exponential backoff over one shared HTTP connection pool, and stores the status,
+file count and download links on the Message. Clients read those from the database or
+subscribe to updates instead of each polling ONC themselves.
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import AsyncContextManager, Callable, Optional
+
+import httpx
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.auth.models import User
+from src.logger import logger
+
+from .models import Message as MessageModel
+from .schemas import DataProductOrder
+
+# Set when the order is placed, before ONC has been asked about it
+SUBMITTED_STATUS = "submitted"
+# Set when the order is still unfinished after the maximum polling age
+EXPIRED_STATUS = "expired"
+TERMINAL_STATUSES = {"complete", "cancelled", "error", EXPIRED_STATUS}
+
+
+def summarize_runs(
+    dp_request_id: int, runs: list[dict], onc_api_url: str
+) -> DataProductOrder:
+    """Combines the runs ONC returns for an order into one status, with links once every run is complete"""
+    statuses = [str(run.get("status", "")).lower() for run in runs]
+    if statuses and all(status == "complete" for status in statuses):
+        status = "complete"
+    else:
+        status = next(
+            (status for status in statuses if status in ("error", "cancelled")),
+            next((status for status in statuses if status != "complete"), "queued"),
+        )
+    file_count = sum(int(run.get("fileCount") or 0) for run in runs)
+    download_urls = (
+        [
+            f"{onc_api_url}/dataProductDelivery/download?dpRunId={run['dpRunId']}&index={index}"
+            for run in runs
+            for index in range(1, int(run.get("fileCount") or 0) + 1)
+        ]
+        if status == "complete"
+        else []
+    )
+    return DataProductOrder(
+        request_id=dp_request_id,
+        status=status,
+        file_count=file_count,
+        download_urls=download_urls,
+    )
+
+
+def order_from_message(message: MessageModel) -> DataProductOrder:
+    return DataProductOrder(
+        request_id=message.request_id,
+        status=message.order_status or SUBMITTED_STATUS,
+        file_count=message.order_file_count,
+        download_urls=message.order_download_urls or [],
+    )
+
+
+class OrderPoller:
+    """
+    Polls each tracked order in its own task: straight away (the run call starts the
+    order), then after initial_delay, growing by backoff up to max_delay. Gives up after
+    max_age_seconds. Every ONC call goes through the same http_client, so its connection
+    limits cap the load on ONC however many orders are outstanding.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncContextManager[AsyncSession]],
+        http_client: httpx.AsyncClient,
+        onc_api_url: str,
+        initial_delay: float = 5.0,
+        max_delay: float = 300.0,
+        backoff: float = 2.0,
+        max_age_seconds: float = 24 * 3600,
+        default_onc_token: Optional[str] = None,
+    ):
+        self.session_factory = session_factory
+        self.http_client = http_client
+        self.onc_api_url = onc_api_url.rstrip("/")
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.max_age_seconds = max_age_seconds
+        # Used for orders of users without their own token, like track_order does
+        self.default_onc_token = default_onc_token
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+        self.polls = 0
+        self.errors = 0
+
+    def is_tracking(self, message_id: int) -> bool:
+        return message_id in self.tasks
+
+    def track(
+        self,
+        message_id: int,
+        dp_request_id: int,
+        onc_token: str,
+        max_age_seconds: Optional[float] = None,
+    ) -> None:
+        """Starts polling an order unless it is already being polled"""
+        if message_id in self.tasks:
+            return
+        deadline = time.monotonic() + (
+            self.max_age_seconds if max_age_seconds is None else max_age_seconds
+        )
+        task = asyncio.create_task(
+            self._poll(message_id, dp_request_id, onc_token, deadline)
+        )
+        self.tasks[message_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(message_id, None))
+
+    async def resume(self) -> None:
+        """Picks up orders that were still outstanding when the server last stopped"""
+        oldest = datetime.now(timezone.utc) - timedelta(seconds=self.max_age_seconds)
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(MessageModel, User.onc_token)
+                .join(User, User.id == MessageModel.user_id)
+                .where(
+                    MessageModel.request_id.is_not(None),
+                    or_(
+                        MessageModel.order_status.is_(None),
+                        MessageModel.order_status.not_in(TERMINAL_STATUSES),
+                    ),
+                    MessageModel.created_at >= oldest,
+                )
+            )
+            outstanding = result.all()
+        now = datetime.now(timezone.utc)
+        for message, onc_token in outstanding:
+            created_at = message.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            self.track(
+                message.message_id,
+                message.request_id,
+                onc_token or self.default_onc_token,
+                max_age_seconds=self.max_age_seconds
+                - (now - created_at).total_seconds(),
+            )
+        logger.info(f"Resumed polling {len(outstanding)} data product orders")
+
+    async def check(self, dp_request_id: int, onc_token: str) -> DataProductOrder:
+        """Runs the order on ONC, or reports on the run if it already started"""
+        self.polls += 1
+        response = await self.http_client.get(
+            f"{self.onc_api_url}/dataProductDelivery/run",
+            params={"dpRequestId": dp_request_id, "token": onc_token},
+        )
+        response.raise_for_status()
+        runs = response.json()
+        return summarize_runs(
+            dp_request_id, runs if isinstance(runs, list) else [runs], self.onc_api_url
+        )
+
+    async def _poll(
+        self, message_id: int, dp_request_id: int, onc_token: str, deadline: float
+    ) -> None:
+        delay = self.initial_delay
+        last_order: Optional[DataProductOrder] = None
+        while True:
+            try:
+                order = await self.check(dp_request_id, onc_token)
+            except httpx.HTTPStatusError as e:
+                self.errors += 1
+                if e.response.status_code != 429 and e.response.status_code < 500:
+                    # Bad token or unknown order, asking again won't help
+                    logger.warning(
+                        f"ONC rejected data product order {dp_request_id}: {e}"
+                    )
+                    order = DataProductOrder(request_id=dp_request_id, status="error")
+                else:
+                    order = None
+            except Exception as e:
+                # Network errors, a body that isn't JSON or a malformed run: try again later
+                self.errors += 1
+                logger.warning(
+                    f"Polling data product order {dp_request_id} failed: {e}"
+                )
+                order = None
+
+            if (
+                order is None or order.status not in TERMINAL_STATUSES
+            ) and time.monotonic() >= deadline:
+                order = DataProductOrder(
+                    request_id=dp_request_id, status=EXPIRED_STATUS
+                )
+            if order is not None and order != last_order:
+                try:
+                    if not await self.save(message_id, order):
+                        return
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(
+                        f"Saving data product order {dp_request_id} failed: {e}"
+                    )
+                    # Checked and saved again after the back-off
+                    order = None
+                else:
+                    self.publish(message_id, order)
+                    last_order = order
+            if order is not None and order.status in TERMINAL_STATUSES:
+                return
+
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(self.max_delay, delay * self.backoff)
+
+    async def save(self, message_id: int, order: DataProductOrder) -> bool:
+        """Stores the order on its message, False if the message has been deleted"""
+        async with self.session_factory() as db:
+            message = await db.get(MessageModel, message_id)
+            if message is None:
+                return False
+            message.order_status = order.status
+            message.order_file_count = order.file_count
+            message.order_download_urls = order.download_urls
+            await db.commit()
+        return True
+
+    def subscribe(self, message_id: int) -> asyncio.Queue:
+        """A queue receiving every status change of the message's order"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self.subscribers[message_id].add(queue)
+        return queue
+
+    def unsubscribe(self, message_id: int, queue: asyncio.Queue) -> None:
+        self.subscribers[message_id].discard(queue)
+        if not self.subscribers[message_id]:
+            del self.subscribers[message_id]
+
+    def publish(self, message_id: int, order: DataProductOrder) -> None:
+        for queue in self.subscribers.get(message_id, ()):
+            queue.put_nowait(order)
+
+    def stats(self) -> dict:
+        return {
+            "outstanding": len(self.tasks),
+            "subscribers": sum(len(queues) for queues in self.subscribers.values()),
+            "polls": self.polls,
+            "errors": self.errors,
+        }
+
+    async def close(self) -> None:
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        await self.http_client.aclose()
+
+
+def create_order_poller(session_factory, settings) -> OrderPoller:
+    max_connections = settings.ORDER_POLL_MAX_CONNECTIONS
+    return OrderPoller(
+        session_factory,
+        httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        ),
+        settings.ONC_API_URL,
+        initial_delay=settings.ORDER_POLL_INITIAL_DELAY_SECONDS,
+        max_delay=settings.ORDER_POLL_MAX_DELAY_SECONDS,
+        max_age_seconds=settings.ORDER_POLL_MAX_AGE_HOURS * 3600,
+        default_onc_token=settings.ONC_TOKEN,
+    )
@@ -1,6 +1,7 @@
 from typing import Annotated, List
 
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Dependencies
@@ -14,6 +15,7 @@ from .schemas import (
     Conversation,
     CreateConversationBody,
     CreateLLMQuery,
+    DataProductOrder,
     Feedback,
     Message,
 )
@@ -72,6 +74,21 @@ async def generate_response(
     return await service.generate_response(llm_query, current_user, db, request)
 
 
+@router.post("/messages/stream")
+@limiter.limit("30/minute")
+async def generate_response_stream(
+    llm_query: CreateLLMQuery,
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    request: Request,
+    db: Annotated[AsyncSession, Depends(get_db_session)],
+) -> StreamingResponse:
+    """Send message to LLM and stream progress and answer tokens as server-sent events"""
+    event_stream = await service.generate_response_stream(
+        llm_query, current_user, db, request
+    )
+    return StreamingResponse(event_stream, media_type="text/event-stream")
+
+
 @router.get("/messages/{message_id}", response_model=Message)
 async def get_message(
     message_id: int,
@@ -82,6 +99,28 @@ async def get_message(
     return await service.get_message(message_id, current_user, db)
 
 
+@router.get("/messages/{message_id}/order", response_model=DataProductOrder)
+async def get_order(
+    message_id: int,
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db_session)],
+) -> DataProductOrder:
+    """Get the status of the message's data product order, as last polled by the server"""
+    return await service.get_order(message_id, current_user, db)
+
+
+@router.get("/messages/{message_id}/order/stream")
+async def get_order_stream(
+    message_id: int,
+    current_user: Annotated[UserOut, Depends(get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db_session)],
+    request: Request,
+) -> StreamingResponse:
+    """Stream the status of the message's data product order as server-sent events until it is done"""
+    event_stream = await service.get_order_stream(message_id, current_user, db, request)
+    return StreamingResponse(event_stream, media_type="text/event-stream")
+
+
 @router.patch("/messages/{message_id}/feedback", response_model=Message)
 async def submit_feedback(
     message_id: int,
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Annotated, Optional
 
 from pydantic import BaseModel, ConfigDict, Field
@@ -28,6 +29,21 @@ class Message(BaseModel):
     citation: Optional[str] = None
     sources: Optional[list[str]] = Field(default_factory=list)
     onc_api_url: Optional[str] = None
+    timings: Optional[dict[str, float]] = None
+    created_at: Optional[datetime] = None
+    order_status: Optional[str] = None
+    order_file_count: Optional[int] = None
+    order_download_urls: Optional[list[str]] = None
+
+
+class DataProductOrder(BaseModel):
+    """Progress of the ONC data product order placed by a message"""
+
+    request_id: int
+    status: str
+    file_count: Optional[int] = None
+    # ONC download links, the caller's ONC token has to be appended as &token=
+    download_urls: list[str] = Field(default_factory=list)
 
 
 class Conversation(BaseModel):
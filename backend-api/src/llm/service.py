@@ -1,4 +1,5 @@
-from typing import List
+import asyncio
+from typing import AsyncIterator, List, Optional
 
 from fastapi import HTTPException, Request
 from sqlalchemy import select
@@ -8,22 +9,34 @@ from sqlalchemy.orm import selectinload
 from LLM.core import LLM
 from LLM.RAG import RAG
 from LLM.schemas import ObtainedParamsDictionary, RunConversationResponse
+from LLM.timing import current_timings, stage
 from src.admin.service import increment_usage
 from src.auth.schemas import UserOut
+from src.logger import logger
+from src.settings import get_settings
 
 from .models import Conversation as ConversationModel
 from .models import Feedback as FeedbackModel
 from .models import Message as MessageModel
+from .orders import (
+    SUBMITTED_STATUS,
+    TERMINAL_STATUSES,
+    OrderPoller,
+    order_from_message,
+)
 from .schemas import (
     Conversation,
     CreateConversationBody,
     CreateLLMQuery,
+    DataProductOrder,
     Feedback,
     Message,
 )
-from .utils import get_context, get_llm
+from .utils import format_sse, get_context, get_llm
 
-MAX_CONTEXT_WORDS = 200
+MAX_CONTEXT_TOKENS = 300
+# Seconds between keep-alive comments on an order status stream
+ORDER_STREAM_KEEPALIVE_SECONDS = 15
 
 
 async def create_conversation(
@@ -125,6 +138,7 @@ async def populate_message_from_response(
 
     if llm_response.dpRequestId:
         message.request_id = llm_response.dpRequestId
+        message.order_status = SUBMITTED_STATUS
 
     # Handle incrementing usage if sources are present
     if llm_response.sources:
@@ -132,13 +146,12 @@ async def populate_message_from_response(
         message.sources = llm_response.sources
 
 
-async def generate_response(
+async def prepare_message(
     llm_query: CreateLLMQuery,
     current_user: UserOut,
     db: AsyncSession,
-    request: Request,
-) -> Message:
-    """Validate user creating new Message that will be sent to LLM"""
+) -> tuple[ConversationModel, List[dict], MessageModel]:
+    """Validate the conversation and build the chat history and unsaved Message for an LLM query"""
 
     # Verify conversation exists
     conversation_result = await db.execute(
@@ -151,10 +164,10 @@ async def generate_response(
     if not existing_conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
-    # Fetch up to MAX_CONTEXT_WORDS of prior messages for context
+    # Fetch up to MAX_CONTEXT_TOKENS of prior messages for context
     chat_history = await get_context(
         conversation_id=llm_query.conversation_id,
-        max_words=MAX_CONTEXT_WORDS,
+        max_tokens=MAX_CONTEXT_TOKENS,
         db=db,
     )
 
@@ -165,6 +178,58 @@ async def generate_response(
         input=llm_query.input,
         response="",
     )
+    return existing_conversation, chat_history, message
+
+
+async def save_message(
+    llm_result: RunConversationResponse,
+    message: MessageModel,
+    existing_conversation: ConversationModel,
+    db: AsyncSession,
+) -> MessageModel:
+    """Persist the LLM result on the message and carry conversation state forward"""
+    existing_conversation.obtained_params = llm_result.obtainedParams.model_dump()
+    if llm_result.point_ids:
+        existing_conversation.previous_vdb_ids = [
+            llm_result.point_ids[0]
+        ]  # Gets most relevant point
+
+    # Stages up to here, the commit itself only shows up in the Server-Timing header
+    timings = current_timings()
+    if timings is not None:
+        message.timings = timings.as_dict()
+
+    db.add(existing_conversation)
+    db.add(message)
+    with stage("db_commit"):
+        await db.commit()
+
+    await db.refresh(message)
+    await db.refresh(existing_conversation)
+    return message
+
+
+def track_order(message: MessageModel, current_user: UserOut, request: Request):
+    """Hands a saved message's data product order to the background poller"""
+    poller: OrderPoller = getattr(request.app.state, "order_poller", None)
+    if poller is not None and message.request_id:
+        poller.track(
+            message.message_id,
+            message.request_id,
+            current_user.onc_token or get_settings().ONC_TOKEN,
+        )
+
+
+async def generate_response(
+    llm_query: CreateLLMQuery,
+    current_user: UserOut,
+    db: AsyncSession,
+    request: Request,
+) -> Message:
+    """Validate user creating new Message that will be sent to LLM"""
+    existing_conversation, chat_history, message = await prepare_message(
+        llm_query, current_user, db
+    )
 
     # Call LLM to generate response
     try:
@@ -186,18 +251,80 @@ async def generate_response(
             status_code=500, detail=f"Error generating response from LLM: {str(e)}"
         )
 
-    existing_conversation.obtained_params = llm_result.obtainedParams.model_dump()
-    if llm_result.point_ids:
-        existing_conversation.previous_vdb_ids = [
-            llm_result.point_ids[0]
-        ]  # Gets most relevant point
+    saved_message = await save_message(llm_result, message, existing_conversation, db)
+    track_order(saved_message, current_user, request)
+    return saved_message
 
-    db.add(message)
-    await db.commit()
 
-    await db.refresh(message)
-    await db.refresh(existing_conversation)
-    return message
+async def generate_response_stream(
+    llm_query: CreateLLMQuery,
+    current_user: UserOut,
+    db: AsyncSession,
+    request: Request,
+) -> AsyncIterator[str]:
+    """
+    Validate the query up front (so errors are normal HTTP errors), then return a
+    server-sent event stream of pipeline stages and answer tokens. The Message is
+    persisted in a session of its own once the LLM finishes and sent as the final
+    "message" event.
+    """
+    existing_conversation, chat_history, message = await prepare_message(
+        llm_query, current_user, db
+    )
+    llm: LLM = get_llm(request.app)
+
+    async def event_stream() -> AsyncIterator[str]:
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def on_event(event: str, data: dict) -> None:
+            await events.put((event, data))
+
+        llm_task = asyncio.create_task(
+            llm.run_conversation(
+                user_prompt=llm_query.input,
+                chat_history=chat_history,
+                user_onc_token=current_user.onc_token,
+                obtained_params=ObtainedParamsDictionary(
+                    **existing_conversation.obtained_params
+                ),
+                previous_vdb_ids=existing_conversation.previous_vdb_ids,
+                on_event=on_event,
+            )
+        )
+        # Wake the consumer once the LLM is done and every queued event is sent
+        llm_task.add_done_callback(lambda _: events.put_nowait(None))
+
+        try:
+            while (item := await events.get()) is not None:
+                yield format_sse(*item)
+
+            llm_result: RunConversationResponse = llm_task.result()
+            # The request's session closed when the endpoint returned, before this body ran
+            async with request.app.state.session_manager.session() as session:
+                # Conversation first, merging it resets its messages and would orphan this one
+                stream_conversation = await session.merge(existing_conversation)
+                stream_message = await session.merge(message)
+                await populate_message_from_response(
+                    llm_result, stream_message, session
+                )
+                saved_message = await save_message(
+                    llm_result, stream_message, stream_conversation, session
+                )
+            track_order(saved_message, current_user, request)
+            yield format_sse(
+                "message",
+                Message.model_validate(saved_message).model_dump(mode="json"),
+            )
+        except Exception as e:
+            logger.error(f"Streaming response failed: {e}")
+            yield format_sse(
+                "error", {"detail": f"Error generating response from LLM: {str(e)}"}
+            )
+        finally:
+            # Client disconnected before the LLM finished
+            llm_task.cancel()
+
+    return event_stream()
 
 
 async def get_message(
@@ -221,6 +348,61 @@ async def get_message(
     return message
 
 
+async def get_order(
+    message_id: int,
+    current_user: UserOut,
+    db: AsyncSession,
+) -> DataProductOrder:
+    """Get the data product order status stored on a message, without calling ONC"""
+    message = await get_message(message_id, current_user, db)
+    if message.request_id is None:
+        raise HTTPException(status_code=404, detail="Message has no data product order")
+    return order_from_message(message)
+
+
+async def get_order_stream(
+    message_id: int,
+    current_user: UserOut,
+    db: AsyncSession,
+    request: Request,
+) -> AsyncIterator[str]:
+    """
+    Validate access up front, then return a server-sent event stream that sends the
+    order's current status and every change after it, ending once the order is done
+    """
+    order = await get_order(message_id, current_user, db)
+    poller: Optional[OrderPoller] = getattr(request.app.state, "order_poller", None)
+    # Subscribed before the stream starts so no update between the read and the stream is lost
+    queue = (
+        poller.subscribe(message_id)
+        if poller is not None and poller.is_tracking(message_id)
+        else None
+    )
+
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            yield format_sse("order", order.model_dump(mode="json"))
+            if queue is None or order.status in TERMINAL_STATUSES:
+                return
+            while True:
+                try:
+                    update: DataProductOrder = await asyncio.wait_for(
+                        queue.get(), timeout=ORDER_STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse("order", update.model_dump(mode="json"))
+                if update.status in TERMINAL_STATUSES:
+                    return
+        finally:
+            if queue is not None:
+                poller.unsubscribe(message_id, queue)
+
+    return event_stream()
+
+
 async def submit_feedback(
     message_id: int,
     feedback: Feedback,
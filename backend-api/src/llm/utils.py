@@ -1,3 +1,4 @@
+import json
 from enum import Enum
 from typing import List
 
@@ -7,6 +8,8 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from LLM.core import LLM
+from LLM.prompt_budget import MESSAGE_OVERHEAD_TOKENS, get_token_counter
+from LLM.timing import stage
 from src.llm.models import Conversation, Message
 from src.logger import logger
 
@@ -38,33 +41,42 @@ def get_llm(app: FastAPI) -> LLM:
     return app.state.llm
 
 
+def format_sse(event: str, data: dict) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 async def get_context(
-    conversation_id: int, max_words: int, db: AsyncSession
+    conversation_id: int, max_tokens: int, db: AsyncSession
 ) -> List[dict]:
-    """Return a list of messages for the LLM to use as context"""
+    """Return a list of messages for the LLM to use as context, up to max_tokens Llama tokens"""
 
-    conversation_result = await db.execute(
-        select(Conversation).filter(Conversation.conversation_id == conversation_id)
-    )
-    conversation = conversation_result.scalar_one_or_none()
+    with stage("db_context"):
+        conversation_result = await db.execute(
+            select(Conversation).filter(Conversation.conversation_id == conversation_id)
+        )
+        conversation = conversation_result.scalar_one_or_none()
 
-    if not conversation:
-        raise HTTPException(status_code=404, detail="Conversation not found")
+        if not conversation:
+            raise HTTPException(status_code=404, detail="Conversation not found")
 
-    # most recent messages first
-    messages: List[Message] = conversation.messages[::-1]
+        # most recent messages first
+        messages: List[Message] = conversation.messages[::-1]
     context: List[MessageContext] = []
 
-    context_words = 0
+    token_counter = get_token_counter()
+    context_tokens = 0
 
     for message in messages:
-        message_words = (
-            4 + len(message.input.split()) + len(message.response.split())
-        )  # extra words for "role", "content"
-        if context_words + message_words < max_words:
+        message_tokens = (
+            token_counter.count(message.input)
+            + token_counter.count(message.response)
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )  # chat template tokens around the user and system messages
+        if context_tokens + message_tokens < max_tokens:
             context.append(MessageContext(role=Role.user, content=message.input))
             context.append(MessageContext(role=Role.system, content=message.response))
-            context_words += message_words
+            context_tokens += message_tokens
         else:
             break
 
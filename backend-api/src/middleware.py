@@ -8,6 +8,7 @@ from slowapi.middleware import SlowAPIMiddleware
 from slowapi.util import get_remote_address
 from starlette.middleware.base import BaseHTTPMiddleware
 
+from LLM.timing import start_timings
 from src.logger import logger
 from src.settings import get_settings
 
@@ -38,6 +39,20 @@ class TimeoutMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class ServerTimingMiddleware(BaseHTTPMiddleware):
+    """
+    Middleware to collect per-stage timings for a request.
+    Stages timed with LLM.timing.stage are reported in the Server-Timing response header.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        timings = start_timings()
+        response = await call_next(request)
+        # Streamed responses send headers before the body, so only stages before the first byte are included
+        response.headers["Server-Timing"] = timings.server_timing_header()
+        return response
+
+
 # Gloabal limiter class
 limiter = Limiter(
     key_func=get_remote_address,
@@ -75,4 +90,6 @@ def init_middleware(app):
 
     app.add_middleware(TimeoutMiddleware)
 
+    app.add_middleware(ServerTimingMiddleware)
+
     logger.info("Middleware initialized successfully.")
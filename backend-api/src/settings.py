@@ -18,6 +18,12 @@ class Settings(BaseSettings):
     QDRANT_API_KEY: str = "default_qdrant_api_key"
     QDRANT_URL: str = "default_qdrant_url"
     QDRANT_COLLECTION_NAME: str = "default_qdrant_collection_name"
+    ONC_API_URL: str = "https://data.oceannetworks.ca/api"
+    # Data product orders are polled with exponential backoff until done or too old
+    ORDER_POLL_INITIAL_DELAY_SECONDS: float = 5.0
+    ORDER_POLL_MAX_DELAY_SECONDS: float = 300.0
+    ORDER_POLL_MAX_AGE_HOURS: float = 24.0
+    ORDER_POLL_MAX_CONNECTIONS: int = 10
 
     # guard for production environment
     model_config = (
@@ -1,4 +1,5 @@
 import asyncio
+import contextlib
 from datetime import timedelta
 from typing import AsyncIterator
 from unittest.mock import AsyncMock, patch
@@ -63,20 +64,52 @@ async def async_session() -> AsyncIterator[AsyncSession]:
         yield session
 
 
+class EngineSessionManager:
+    """Stands in for DatabaseSessionManager on the test engine"""
+
+    def __init__(self, engine):
+        self._sessionmaker = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    @contextlib.asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        async with self._sessionmaker() as session:
+            yield session
+
+
+@pytest.fixture()
+def request_sessions() -> list[AsyncSession]:
+    """Sessions handed to requests under @pytest.mark.closing_db_session"""
+    return []
+
+
 @pytest_asyncio.fixture()
-async def client(async_session: AsyncSession, request) -> AsyncIterator[AsyncClient]:
+async def client(
+    async_session: AsyncSession, request, request_sessions: list[AsyncSession]
+) -> AsyncIterator[AsyncClient]:
     """Return a test client which can be used to send api requests"""
+    session_manager = EngineSessionManager(async_session.bind)
 
     async def override_get_db_session():
         yield async_session
 
+    # A session per request, closed when the dependency exits like get_db_session's
+    async def closing_get_db_session():
+        async with session_manager.session() as session:
+            request_sessions.append(session)
+            yield session
+
     test_app = create_app()
+    test_app.state.session_manager = session_manager
 
     # Disable middleware unless @pytest.mark.use_middleware
     if request.node.get_closest_marker("use_middleware") is None:
         test_app.user_middleware = []
 
-    test_app.dependency_overrides[get_db_session] = override_get_db_session
+    test_app.dependency_overrides[get_db_session] = (
+        closing_get_db_session
+        if request.node.get_closest_marker("closing_db_session")
+        else override_get_db_session
+    )
 
     if request.node.get_closest_marker("use_lifespan"):
         async with LifespanManager(test_app):
@@ -144,6 +177,12 @@ class MockLLM:
         self.called_with_history = None
         self.last_prompt = None
 
+    def get_cache_stats(self) -> dict:
+        return {
+            "answer_cache": {"entries": 0, "hits": 0, "misses": 0},
+            "tool_cache": {"entries": 0, "hits": 0, "misses": 0},
+        }
+
     async def run_conversation(
         self,
         user_prompt: str,
@@ -151,9 +190,12 @@ class MockLLM:
         chat_history: list[dict] = [],
         obtained_params: ObtainedParamsDictionary = ObtainedParamsDictionary(),
         previous_vdb_ids: list[dict] = [],
+        on_event=None,
     ) -> RunConversationResponse:
         self.called_with_history = chat_history
         self.last_prompt = user_prompt.lower()
+        if on_event is not None:
+            await on_event("stage", {"stage": "retrieving"})
 
         dummy_sources = ["source_1", "source_2"]
         dummy_point_ids = ["point_abc123", "point_def456"]
@@ -4,11 +4,15 @@ from unittest.mock import AsyncMock, Mock, patch
 import pytest
 from fastapi import HTTPException, status
 from httpx import AsyncClient
+from qdrant_client.http.models import UpdateStatus
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.admin.models import VectorDocument
+from src.admin.service import source_remove_from_vdb
 from src.auth import schemas
+from src.auth.models import User
 from src.auth.service import get_user_by_token
+from src.llm.models import Conversation, Message
 from src.settings import get_settings
 
 
@@ -155,6 +159,75 @@ class TestMessageClustering:
         assert isinstance(clusters, dict)
 
 
+class TestCacheStats:
+    @pytest.mark.asyncio
+    async def test_cache_stats(self, client: AsyncClient, admin_headers: dict):
+        """Test that the LLM cache counters are returned"""
+        response = await client.get("/admin/cache/stats", headers=admin_headers)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert "answer_cache" in response.json()
+
+    @pytest.mark.asyncio
+    async def test_cache_stats_as_user(self, client: AsyncClient, user_headers: dict):
+        """Test that normal users can't read the cache counters"""
+        response = await client.get("/admin/cache/stats", headers=user_headers)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+class TestStageTimings:
+    @pytest.mark.asyncio
+    async def test_stage_timings(
+        self, client: AsyncClient, async_session: AsyncSession, admin_headers: dict
+    ):
+        """Test that stage timings saved on messages are aggregated into percentiles"""
+        user = (await async_session.execute(select(User))).scalars().first()
+        conversation = Conversation(user_id=user.id)
+        async_session.add(conversation)
+        await async_session.commit()
+        await async_session.refresh(conversation)
+
+        async_session.add_all(
+            [
+                Message(
+                    conversation_id=conversation.conversation_id,
+                    user_id=user.id,
+                    input="question",
+                    response="answer",
+                    timings={"answer_llm": float(ms), "db_context": 2.0},
+                )
+                for ms in range(1, 101)
+            ]
+        )
+        # Messages from before the new columns have no timings
+        async_session.add(
+            Message(
+                conversation_id=conversation.conversation_id,
+                user_id=user.id,
+                input="question",
+                response="answer",
+            )
+        )
+        await async_session.commit()
+
+        response = await client.get("/admin/timings?hours=1", headers=admin_headers)
+
+        assert response.status_code == status.HTTP_200_OK
+        stats = response.json()
+        assert stats["answer_llm"]["count"] == 100
+        assert stats["answer_llm"]["p50"] == pytest.approx(50.5)
+        assert stats["answer_llm"]["p99"] == pytest.approx(99.0, abs=0.1)
+        assert stats["db_context"]["p95"] == 2.0
+
+    @pytest.mark.asyncio
+    async def test_stage_timings_as_user(self, client: AsyncClient, user_headers: dict):
+        """Test that normal users can't read the stage timings"""
+        response = await client.get("/admin/timings", headers=user_headers)
+
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
 class TestAdminDocumentUpload:
     @patch("src.admin.service.raw_text_upload_to_vdb", new_callable=AsyncMock)
     @pytest.mark.asyncio
@@ -337,3 +410,24 @@ class TestAdminDocumentCRUD:
         resp = await client.delete("/admin/documents/toremove", headers=admin_headers)
         assert resp.status_code == 500
         assert resp.json()["detail"] == "fail"
+
+    @pytest.mark.asyncio
+    async def test_source_remove_deletes_from_general_collection(
+        self, async_session: AsyncSession
+    ):
+        """Test that removing a source deletes its points with the async Qdrant client"""
+        rag = Mock()
+        rag.general_collection_name = "general"
+        rag.async_qdrant_client.delete = AsyncMock(
+            return_value=Mock(status=UpdateStatus.COMPLETED)
+        )
+        rag.collection_changed = AsyncMock()
+        request = Mock()
+        request.app.state.rag = rag
+
+        await source_remove_from_vdb("toremove", request, async_session)
+
+        rag.async_qdrant_client.delete.assert_awaited_once()
+        collection_name = rag.async_qdrant_client.delete.await_args.args[0]
+        assert collection_name == "general"
+        rag.collection_changed.assert_awaited_once_with("general")
@@ -407,7 +407,7 @@ class TestMockLLM:
         await self._send_message(client, user_headers, conv1_id, "Tell me about ONC.")
 
         # Confirm messages are returned correctly from get_context
-        context = await get_context(conv1_id, max_words=150, db=async_session)
+        context = await get_context(conv1_id, max_tokens=150, db=async_session)
 
         # Check that context returns user + system pairs and order is preserved
         assert len(context) >= 4, "Expected at least 2 message pairs in context"
@@ -415,7 +415,7 @@ class TestMockLLM:
         assert any("onc" in msg["content"].lower().strip() for msg in context)
 
         # Ensure messages from conv2 are not included
-        context_conv2 = await get_context(conv2_id, max_words=150, db=async_session)
+        context_conv2 = await get_context(conv2_id, max_tokens=150, db=async_session)
         assert all("ONC" not in msg["content"].lower() for msg in context_conv2)
 
     @pytest.mark.asyncio
@@ -1,13 +1,86 @@
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import numpy as np
 import pytest
+import torch
 from fastapi import status
+from groq import AsyncGroq, BadRequestError
+from groq.types import CompletionUsage
+from groq.types.chat import ChatCompletion
 from httpx import AsyncClient
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    Datatype,
+    Distance,
+    PointStruct,
+    ScalarQuantization,
+    VectorParams,
+)
+from sentence_transformers import CrossEncoder
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from src.auth.models import User
 from src.llm import schemas
 from src.llm.models import Conversation, Message
+from src.llm.orders import OrderPoller
 from src.llm.utils import get_context
 from src.settings import get_settings
+from tokenizers import Tokenizer
+from tokenizers.models import WordLevel
+from tokenizers.pre_tokenizers import Whitespace
+from tokenizers.processors import TemplateProcessing
+from transformers import (
+    BertConfig,
+    BertForSequenceClassification,
+    PreTrainedTokenizerFast,
+)
+
+from LLM.benchmarks.batch_eval import build_report, run_eval
+from LLM.benchmarks.replay import (
+    Cassette,
+    ReplayLatency,
+    ReplayMissError,
+    install,
+    replay_scope,
+)
+from LLM.Constants.status_codes import StatusCode
+from LLM.context_classifier import ContextClassifier
+from LLM.core import LLM
+from LLM.embedding_cache import QueryEmbeddingCache
+from LLM.Environment import Environment
+from LLM.llm_gateway import CircuitBreaker, LLMEndpoint, LLMGateway, llm_route
+from LLM.model_router import LARGE_MODEL, SMALL_MODEL, ModelRouter
+from LLM.onnx_reranker import OnnxCrossEncoder, export_quantized, ranking_agreement
+from LLM.prompt_budget import PromptBudgeter, PromptSection, TokenCounter
+from LLM.RAG import RAG, RetrievedDocument, format_documents
+from LLM.rerank_policy import (
+    FULL,
+    SHRINK,
+    SKIP,
+    TRIVIAL,
+    RerankMonitor,
+    RerankPolicy,
+    policies_from_overrides,
+)
+from LLM.schemas import RunConversationResponse
+from LLM.semantic_cache import SemanticAnswerCache
+from LLM.single_flight import SingleFlight, normalize_prompt
+from LLM.tool_cache import ToolResultCache
+from LLM.tool_renderers import TOOL_RENDERERS, render_tool_responses
+from LLM.tool_retriever import ToolRetriever, is_conversational
+from LLM.tools_sprint1 import get_daily_sea_temperature_stats_cambridge_bay
+from LLM.vector_format import VectorFormat, formats_from_overrides, migrate_collection
+from LLM.vector_index import VectorIndexMirror
 
 
 class TestConversation:
@@ -225,6 +298,105 @@ class TestMessage:
         assert get_resp.status_code == status.HTTP_200_OK
         assert get_resp.json()["message_id"] == msg["message_id"]
 
+    @pytest.mark.use_middleware
+    @pytest.mark.asyncio
+    async def test_generate_message_timings(
+        self, client: AsyncClient, user_headers: dict
+    ):
+        """Test that stage timings are returned in Server-Timing and saved on the message"""
+        conv_id = await self._create_conversation(client, user_headers)
+
+        resp = await client.post(
+            "/llm/messages",
+            json={"input": "Hi LLM", "conversation_id": conv_id},
+            headers=user_headers,
+        )
+        assert resp.status_code == status.HTTP_201_CREATED
+
+        stages = [
+            metric.split(";")[0] for metric in resp.headers["Server-Timing"].split(", ")
+        ]
+        assert "db_context" in stages
+        assert "db_commit" in stages
+        assert stages[-1] == "total"
+
+        msg = resp.json()
+        assert "db_context" in msg["timings"]
+        assert msg["created_at"] is not None
+
+    @pytest.mark.asyncio
+    async def test_generate_message_stream(
+        self, client: AsyncClient, user_headers: dict
+    ):
+        """Test that streams stage events and persists the message at the end"""
+        conv_id = await self._create_conversation(client, user_headers)
+
+        resp = await client.post(
+            "/llm/messages/stream",
+            json={"input": "Hi LLM", "conversation_id": conv_id},
+            headers=user_headers,
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"].startswith("text/event-stream")
+
+        events = [
+            (
+                lines[0].removeprefix("event: "),
+                json.loads(lines[1].removeprefix("data: ")),
+            )
+            for lines in (
+                block.split("\n") for block in resp.text.strip().split("\n\n")
+            )
+        ]
+        assert events[0] == ("stage", {"stage": "retrieving"})
+        event_name, msg = events[-1]
+        assert event_name == "message"
+        assert "Hi" in msg["response"]
+
+        get_resp = await client.get(
+            f"/llm/messages/{msg['message_id']}", headers=user_headers
+        )
+        assert get_resp.status_code == status.HTTP_200_OK
+        assert get_resp.json()["response"] == msg["response"]
+
+    @pytest.mark.asyncio
+    @pytest.mark.closing_db_session
+    async def test_message_stream_saves_outside_the_request_session(
+        self, client: AsyncClient, user_headers: dict, request_sessions: list
+    ):
+        """Test that the stream body doesn't reopen the request's closed session"""
+        conv_id = await self._create_conversation(client, user_headers)
+
+        resp = await client.post(
+            "/llm/messages/stream",
+            json={"input": "Hi LLM", "conversation_id": conv_id},
+            headers=user_headers,
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        event_name, data = resp.text.strip().split("\n\n")[-1].split("\n")
+        assert event_name == "event: message"
+        msg = json.loads(data.removeprefix("data: "))
+
+        # A closed session that is written to again holds a pooled connection forever
+        assert request_sessions
+        assert not any(session.in_transaction() for session in request_sessions)
+        get_resp = await client.get(
+            f"/llm/messages/{msg['message_id']}", headers=user_headers
+        )
+        assert get_resp.json()["response"] == msg["response"]
+
+    @pytest.mark.asyncio
+    async def test_message_stream_invalid_conversation_id(
+        self, client: AsyncClient, user_headers: dict
+    ):
+        """Test that streaming to a missing conversation fails before the stream starts"""
+        resp = await client.post(
+            "/llm/messages/stream",
+            json={"input": "Hi", "conversation_id": 999},
+            headers=user_headers,
+        )
+        assert resp.status_code == status.HTTP_404_NOT_FOUND
+
     @pytest.mark.asyncio
     async def test_message_invalid_conversation_id(
         self, client: AsyncClient, user_headers: dict
@@ -343,7 +515,7 @@ class TestContextUtils:
         await async_session.commit()
         await async_session.refresh(new_conversation)
 
-        # Create two message with varying words
+        # Create two message with varying lengths, about one token per word
         content_8 = "one two three four five six seven eight"
         content_3 = "one two three"
 
@@ -352,13 +524,13 @@ class TestContextUtils:
             user_id=user_in_db.id,
             input=content_8,
             response=content_8,
-        )  # 4 + 8 + 8 = 20 words
+        )  # 8 + 8 tokens plus chat template overhead
         message_15_words = Message(
             conversation_id=new_conversation.conversation_id,
             user_id=user_in_db.id,
             input=content_8,
             response=content_3,
-        )  # 4 + 8 + 3 = 15 words
+        )  # 8 + 3 tokens plus chat template overhead
 
         async_session.add_all([message_20_words, message_15_words])
         await async_session.commit()
@@ -381,3 +553,1670 @@ class TestContextUtils:
         assert context_2[0]["content"] == message_15_words.input
         assert context_2[1]["role"] == "system"
         assert context_2[1]["content"] == message_15_words.response
+
+
+class TestSemanticAnswerCache:
+    def _answer(self, text: str) -> RunConversationResponse:
+        return RunConversationResponse(status=StatusCode.REGULAR_MESSAGE, response=text)
+
+    def test_similar_question_hits(self):
+        cache = SemanticAnswerCache(similarity_threshold=0.95)
+        cache.store(
+            "What instruments are at Cambridge Bay?",
+            [1.0, 0.0, 0.0],
+            self._answer("A CTD and a hydrophone."),
+            compute_seconds=2.0,
+            current_date="2025-01-01",
+        )
+
+        cached = cache.lookup([0.99, 0.05, 0.0], "2025-01-01")
+        assert cached is not None
+        assert cached.response == "A CTD and a hydrophone."
+        assert cache.lookup([0.0, 1.0, 0.0], "2025-01-01") is None
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["latency_saved_seconds"] == 2.0
+
+    def test_date_sensitive_answer_expires_next_day(self):
+        cache = SemanticAnswerCache()
+        cache.store(
+            "What is the water temperature today?",
+            [1.0, 0.0],
+            self._answer("It is 2 degrees."),
+            compute_seconds=1.0,
+            current_date="2025-01-01",
+        )
+
+        assert cache.lookup([1.0, 0.0], "2025-01-01") is not None
+        assert cache.lookup([1.0, 0.0], "2025-01-02") is None
+
+    def test_expired_and_evicted_entries_miss(self):
+        cache = SemanticAnswerCache(ttl_seconds=0, max_entries=1)
+        cache.store("a", [1.0, 0.0], self._answer("a"), 1.0, "2025-01-01")
+        assert cache.lookup([1.0, 0.0], "2025-01-01") is None
+
+        cache = SemanticAnswerCache(max_entries=1)
+        cache.store("a", [1.0, 0.0], self._answer("a"), 1.0, "2025-01-01")
+        cache.store("b", [0.0, 1.0], self._answer("b"), 1.0, "2025-01-01")
+        assert cache.lookup([1.0, 0.0], "2025-01-01") is None
+        assert cache.stats()["evictions"] == 1
+
+    def test_requester_token_is_not_served_to_others(self):
+        cache = SemanticAnswerCache()
+        cache.store(
+            "Cambridge Bay water temperature in January 2024?",
+            [1.0, 0.0],
+            RunConversationResponse(
+                status=StatusCode.REGULAR_MESSAGE,
+                response="It averaged -1.5 degrees.",
+                baseUrl="https://data.oceannetworks.ca/api/scalardata?token=ALICE_TOKEN",
+                urlParamsUsed={"locationCode": "CBYIP", "token": "ALICE_TOKEN"},
+            ),
+            compute_seconds=1.0,
+            current_date="2025-01-01",
+            user_onc_token="ALICE_TOKEN",
+        )
+
+        cached = cache.lookup([0.99, 0.05], "2025-01-01", "BOB_TOKEN")
+
+        assert "ALICE_TOKEN" not in cached.model_dump_json()
+        assert cached.urlParamsUsed["token"] == "BOB_TOKEN"
+        assert cached.baseUrl.endswith("token=BOB_TOKEN")
+
+
+async def fake_ice_thickness(date_from_str: str, date_to_str: str, user_onc_token: str):
+    return {
+        "response": {"average_ice_thickness": 1.2},
+        "urlParamsUsed": {"dateFrom": date_from_str, "token": user_onc_token},
+    }
+
+
+class TestToolResultCache:
+    def test_past_window_is_shared_without_token(self):
+        cache = ToolResultCache()
+        args = {"date_from_str": "2020-02-01", "date_to_str": "2020-03-01"}
+        response = {
+            "response": {"average_ice_thickness": 1.2},
+            "urlParamsUsed": {"dateFrom": "2020-02-01", "token": "token-a"},
+        }
+        cache.put(fake_ice_thickness, args, "token-a", response)
+
+        # Same arguments in a different order from a different user
+        cached = cache.get(
+            fake_ice_thickness,
+            {"date_to_str": "2020-03-01", "date_from_str": "2020-02-01"},
+            "token-b",
+        )
+        assert cached["response"] == {"average_ice_thickness": 1.2}
+        assert cached["urlParamsUsed"]["token"] == "token-b"
+        assert cache.stats()["permanent_entries"] == 1
+
+    def test_recent_window_expires(self):
+        cache = ToolResultCache(recent_ttl_seconds=0)
+        today = datetime.now().strftime("%Y-%m-%d")
+        args = {"date_from_str": today, "date_to_str": today}
+        cache.put(fake_ice_thickness, args, "token", {"response": {"value": 1}})
+
+        assert cache.get(fake_ice_thickness, args, "token") is None
+        assert cache.stats()["permanent_entries"] == 0
+
+    def test_errors_are_not_cached(self):
+        cache = ToolResultCache()
+        args = {"date_from_str": "2020-02-01", "date_to_str": "2020-03-01"}
+        cache.put(
+            fake_ice_thickness, args, "token", {"response": "Error: Invalid token"}
+        )
+
+        assert cache.get(fake_ice_thickness, args, "token") is None
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ToolResultCache(max_entries=2)
+        for day in ["2020-01-01", "2020-01-02", "2020-01-03"]:
+            args = {"date_from_str": day, "date_to_str": day}
+            cache.put(fake_ice_thickness, args, "token", {"response": day})
+
+        first = {"date_from_str": "2020-01-01", "date_to_str": "2020-01-01"}
+        assert cache.get(fake_ice_thickness, first, "token") is None
+        assert cache.stats()["evictions"] == 1
+
+
+class TestIndependentTools:
+    @pytest.mark.asyncio
+    async def test_blocking_tool_times_out(self):
+        """Test that a tool blocked in a synchronous call returns the timeout error in time"""
+
+        async def blocking_tool(user_onc_token: str):
+            time.sleep(1)
+            return {"response": "late"}
+
+        llm = LLM.__new__(LLM)
+        llm.available_functions = {"blocking_tool": blocking_tool}
+        llm.tool_timeout = 0.1
+        llm.tool_cache = None
+
+        started_at = time.perf_counter()
+        result = await llm.call_independent_tool("blocking_tool", {}, "token")
+
+        assert result == {
+            "response": "Error: blocking_tool timed out after 0.1 seconds."
+        }
+        assert time.perf_counter() - started_at < 0.5
+
+
+class TestQueryEmbeddingCache:
+    def _counting_encoder(self):
+        calls = []
+
+        def encode(text: str) -> list[float]:
+            calls.append(text)
+            time.sleep(0.05)
+            return [float(len(text)), 1.0]
+
+        return encode, calls
+
+    def test_normalized_text_hits(self):
+        cache = QueryEmbeddingCache("model")
+        encode, calls = self._counting_encoder()
+
+        first = cache.get_or_compute("Ice  thickness?", "retrieval.query", encode)
+        second = cache.get_or_compute(" Ice thickness? ", "retrieval.query", encode)
+
+        assert calls == ["Ice thickness?"]
+        assert second is first
+        assert not second.flags.writeable
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["hit_rate"] == 0.5
+
+    def test_task_is_part_of_the_key(self):
+        cache = QueryEmbeddingCache("model")
+        encode, calls = self._counting_encoder()
+
+        cache.get_or_compute("ice", "retrieval.query", encode)
+        cache.get_or_compute("ice", "retrieval.passage", encode)
+
+        assert len(calls) == 2
+
+    def test_concurrent_misses_compute_once(self):
+        cache = QueryEmbeddingCache("model")
+        encode, calls = self._counting_encoder()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            vectors = list(
+                pool.map(
+                    lambda _: cache.get_or_compute("ice", "retrieval.query", encode),
+                    range(8),
+                )
+            )
+
+        assert len(calls) == 1
+        assert all(vector is vectors[0] for vector in vectors)
+        assert cache.stats()["coalesced"] + cache.stats()["hits"] == 7
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = QueryEmbeddingCache("model", max_entries=2)
+        encode, calls = self._counting_encoder()
+        for text in ["a", "b", "a", "c", "b"]:
+            cache.get_or_compute(text, "retrieval.query", encode)
+
+        assert calls == ["a", "b", "c", "b"]
+        assert cache.stats()["evictions"] == 2
+
+    def test_persistent_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "embeddings.sqlite")
+        encode, calls = self._counting_encoder()
+        QueryEmbeddingCache("model", persist_path=path).get_or_compute(
+            "ice", "retrieval.query", encode
+        )
+
+        restarted = QueryEmbeddingCache("model", persist_path=path)
+        vector = restarted.get_or_compute("ice", "retrieval.query", encode)
+        other_model = QueryEmbeddingCache("other", persist_path=path)
+        other_model.get_or_compute("ice", "retrieval.query", encode)
+
+        assert list(vector) == [3.0, 1.0]
+        assert len(calls) == 2
+        assert restarted.stats()["disk_hits"] == 1
+
+
+class TestContextClassifier:
+    # Stand-in embeddings: questions about ice point one way, everything else another
+    def _embed(self, text: str) -> list[float]:
+        return [1.0, 0.0] if "ice" in text.lower() else [0.0, 1.0]
+
+    def _history(self, question: str, answer: str) -> list[dict]:
+        return [
+            {"role": "user", "content": question},
+            {"role": "system", "content": answer},
+        ]
+
+    def test_device_codes_decide(self):
+        classifier = ContextClassifier(self._embed)
+        history = self._history(
+            "Give me CTD salinity data for July 2024", "Your CTD request was submitted."
+        )
+
+        assert classifier.is_related("Now the CTD temperature please", history)
+        assert not classifier.is_related("Download the HYDROPHONE files", history)
+
+    def test_follow_up_words_are_related(self):
+        classifier = ContextClassifier(self._embed)
+        history = self._history(
+            "What instruments are at Cambridge Bay?", "A CTD and a hydrophone."
+        )
+
+        assert classifier.is_related("Which of those measures salinity?", history)
+
+    def test_embedding_similarity(self):
+        classifier = ContextClassifier(self._embed, similarity_threshold=0.5)
+        history = self._history(
+            "How thick was the ice in March?", "The ice was about 1.8 m thick."
+        )
+
+        assert classifier.is_related("Was the ice thinner in April?", history)
+        assert not classifier.is_related("Who funds the observatory?", history)
+        assert not classifier.is_related("Who funds the observatory?", [])
+
+    def test_heuristics_agree_with_labelled_examples(self):
+        examples_path = (
+            Path(inspect.getfile(ContextClassifier)).parent
+            / "benchmarks"
+            / "context_examples.jsonl"
+        )
+        examples = [
+            json.loads(line)
+            for line in examples_path.read_text().splitlines()
+            if line.strip()
+        ]
+
+        for example in examples:
+            decision = ContextClassifier.heuristic_decision(
+                example["user_prompt"],
+                [turn["content"] for turn in example["chat_history"]],
+            )
+            # None leaves the example to the embedding step
+            assert decision in (None, example["related"]), example["user_prompt"]
+
+    def test_dummy_it_is_not_a_follow_up(self):
+        assert (
+            ContextClassifier.heuristic_decision("How windy was it at noon?", ["x"])
+            is None
+        )
+        assert ContextClassifier.heuristic_decision("And its depth?", ["x"]) is True
+        assert ContextClassifier.heuristic_decision("What was it the day after?", ["x"])
+
+
+class TestToolRetriever:
+    # Stand-in embeddings: one axis per topic
+    TOPICS = ["ice", "wind", "download"]
+
+    def _embed(self, text: str) -> list[float]:
+        return [float(topic in text.lower()) for topic in self.TOPICS]
+
+    def _retriever(self, **kwargs) -> ToolRetriever:
+        tools = [
+            {"type": "function", "function": {"name": name, "description": text}}
+            for name, text in [
+                ("get_ice_thickness", "Average sea-ice thickness"),
+                ("get_wind_speed_at_timestamp", "Wind speed at a time"),
+                ("generate_download_codes", "Download data products"),
+            ]
+        ]
+        return ToolRetriever(
+            lambda texts: [self._embed(text) for text in texts],
+            self._embed,
+            tools,
+            **kwargs,
+        )
+
+    def _names(self, tools: list[dict]) -> list[str]:
+        return [tool["function"]["name"] for tool in tools]
+
+    def test_selects_relevant_tools(self):
+        retriever = self._retriever(top_k=1, min_similarity=0.5)
+        prompt = "How thick was the ice in March?"
+
+        assert self._names(retriever.select(prompt, self._embed(prompt))) == [
+            "get_ice_thickness"
+        ]
+
+    def test_similar_tools_are_added_to_the_top_k(self):
+        retriever = self._retriever(top_k=1, min_similarity=0.5)
+        prompt = "Ice thickness and wind speed in March"
+
+        assert self._names(retriever.select(prompt, self._embed(prompt))) == [
+            "get_ice_thickness",
+            "get_wind_speed_at_timestamp",
+        ]
+
+    def test_question_below_the_floor_keeps_the_top_k(self):
+        retriever = self._retriever(top_k=2, min_similarity=0.5)
+        prompt = "What was the salinity in March?"
+
+        assert len(retriever.select(prompt, self._embed(prompt))) == 2
+
+    def test_conversational_turn_gets_no_tools(self):
+        retriever = self._retriever()
+
+        assert is_conversational("Thanks, that helps!")
+        assert not is_conversational("Thanks, now the wind please")
+        assert retriever.select("Thank you!", self._embed("Thank you!")) == []
+
+    def test_tool_less_questions_stay_on_the_large_model(self):
+        router = ModelRouter()
+
+        greeting = LLM.tool_selection_route("Thank you!", [])
+        question = LLM.tool_selection_route("What does a hydrophone measure?", [])
+
+        assert router.request_options(greeting)["model"] == SMALL_MODEL
+        assert question == "tool_selection"
+        assert router.request_options(question)["model"] == LARGE_MODEL
+
+    def test_follow_up_and_required_tools(self):
+        retriever = self._retriever(top_k=1, min_similarity=0.5)
+        prompt = "What about the month after?"
+
+        tools = retriever.select(
+            prompt,
+            self._embed(prompt),
+            previous_prompt="How thick was the ice in March?",
+            required_tools={"generate_download_codes"},
+        )
+
+        assert self._names(tools) == ["get_ice_thickness", "generate_download_codes"]
+
+
+class TestOnnxCrossEncoder:
+    WORDS = (
+        "ice thickness wind speed temperature sea air cambridge bay hydrophone data "
+        "what is the at on today yesterday average daily ctd salinity oxygen"
+    ).split()
+
+    @pytest.fixture(scope="class")
+    def model_dirs(self, tmp_path_factory):
+        """A small random BERT cross-encoder saved as-is and exported to int8 ONNX"""
+        vocab = {
+            word: i
+            for i, word in enumerate(["[PAD]", "[UNK]", "[CLS]", "[SEP]", *self.WORDS])
+        }
+        tokenizer = Tokenizer(WordLevel(vocab, "[UNK]"))
+        tokenizer.pre_tokenizer = Whitespace()
+        tokenizer.post_processor = TemplateProcessing(
+            single="[CLS] $A [SEP]",
+            pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+            special_tokens=[("[CLS]", 2), ("[SEP]", 3)],
+        )
+        torch.manual_seed(0)
+        model = BertForSequenceClassification(
+            BertConfig(
+                vocab_size=len(vocab),
+                hidden_size=64,
+                num_hidden_layers=2,
+                num_attention_heads=2,
+                intermediate_size=128,
+                max_position_embeddings=128,
+                initializer_range=0.3,
+                num_labels=1,
+            )
+        )
+        root = tmp_path_factory.mktemp("reranker")
+        model.save_pretrained(root / "torch")
+        PreTrainedTokenizerFast(
+            tokenizer_object=tokenizer,
+            unk_token="[UNK]",
+            pad_token="[PAD]",
+            cls_token="[CLS]",
+            sep_token="[SEP]",
+        ).save_pretrained(root / "torch")
+        export_quantized(str(root / "torch"), str(root / "onnx"))
+        return root / "torch", root / "onnx"
+
+    def _pairs(self, count: int, max_words: int) -> list[tuple[str, str]]:
+        rng = np.random.default_rng(0)
+        return [
+            (
+                "ice thickness at cambridge bay",
+                " ".join(rng.choice(self.WORDS, rng.integers(3, max_words))),
+            )
+            for _ in range(count)
+        ]
+
+    def test_quantized_ranking_agrees_with_torch(self, model_dirs):
+        torch_dir, onnx_dir = model_dirs
+        pairs = self._pairs(30, 40)
+
+        reference = CrossEncoder(str(torch_dir), max_length=32).predict(pairs)
+        scores = OnnxCrossEncoder(str(onnx_dir), max_length=32, batch_size=4).score(
+            pairs
+        )
+
+        agreement = ranking_agreement(reference, scores, top_k=5)
+        assert agreement["spearman"] >= 0.9
+        assert agreement["top1_match"]
+        assert agreement["top_k_overlap"] >= 0.8
+
+    def test_long_documents_are_truncated(self, model_dirs):
+        _, onnx_dir = model_dirs
+        reranker = OnnxCrossEncoder(str(onnx_dir), max_length=32)
+        # Longer than the model's 128 positions if it weren't truncated
+        pairs = [("ice thickness", " ".join(["ice"] * 300)), ("ice", "sea")]
+
+        assert len(reranker.score(pairs)) == 2
+        assert reranker.score([]) == []
+
+    def test_batches_group_similar_lengths(self, model_dirs):
+        _, onnx_dir = model_dirs
+        reranker = OnnxCrossEncoder(str(onnx_dir), batch_size=2)
+
+        assert reranker.batches([40, 5, 38, 7, 20]) == [[1, 3], [4, 2], [0]]
+
+
+class TestAdaptiveRerank:
+    class CountingCrossEncoder:
+        """Scores documents by their number, so reranking reverses vector order"""
+
+        def __init__(self):
+            self.pairs = 0
+
+        def score(self, pairs):
+            self.pairs += len(pairs)
+            return [float(document.split()[-1]) for _, document in pairs]
+
+    def _rag(self, audit_rate: float = 0.0) -> RAG:
+        rag = object.__new__(RAG)
+        rag.model = self.CountingCrossEncoder()
+        rag.rerank_policies = policies_from_overrides(
+            {
+                "tools": {
+                    "top_n": 3,
+                    "skip_margin": 0.2,
+                    "shrink_margin": 0.05,
+                    "top_m": 2,
+                }
+            }
+        )
+        rag.rerank_monitor = RerankMonitor(audit_rate=audit_rate)
+        return rag
+
+    def _documents(self, scores: list[float]) -> list[RetrievedDocument]:
+        return [
+            RetrievedDocument(f"doc {index}", "source", str(index), score)
+            for index, score in enumerate(scores)
+        ]
+
+    def _contents(self, documents: list[RetrievedDocument]) -> list[str]:
+        return [document.content for document in documents]
+
+    def test_format_documents_groups_runs_of_one_source(self):
+        documents = [
+            RetrievedDocument("Ice is 1.2 m thick.\n", "ice.pdf", "a"),
+            RetrievedDocument("Measured daily.", "ice.pdf", "b"),
+            RetrievedDocument("The CTD measures salinity.", "ctd.pdf", "c"),
+        ]
+
+        assert format_documents(documents) == (
+            "Source: ice.pdf\nIce is 1.2 m thick.\n\nMeasured daily.\n\n"
+            "Source: ctd.pdf\nThe CTD measures salinity."
+        )
+        assert format_documents([]) == ""
+
+    def test_decisions_follow_the_vector_margin(self):
+        policy = RerankPolicy(skip_margin=0.2, shrink_margin=0.05, top_m=2)
+
+        assert policy.decide([0.9, 0.6, 0.5]) == (SKIP, 0)
+        assert policy.decide([0.9, 0.8, 0.5]) == (SHRINK, 2)
+        assert policy.decide([0.9, 0.88, 0.5]) == (FULL, 3)
+        assert policy.decide([0.9]) == (TRIVIAL, 0)
+        assert RerankPolicy().decide([0.9, 0.1]) == (FULL, 2)
+
+    def test_overrides_keep_collection_defaults(self):
+        policies = policies_from_overrides({"function_calling": {"skip_margin": 0.5}})
+
+        assert policies["function_calling"].skip_margin == 0.5
+        assert policies["function_calling"].min_score == 0.375
+        assert policies["general"].skip_margin is None
+
+    def test_rerank_scores_only_what_the_policy_needs(self):
+        rag = self._rag()
+
+        ranked = rag.rerank(
+            "question",
+            {
+                "general": self._documents([0.9, 0.6, 0.5]),
+                "tools": self._documents([0.9, 0.8, 0.7, 0.6]),
+            },
+        )
+
+        # General is fully reranked, tools only has its top 2 reranked
+        assert self._contents(ranked["general"]) == ["doc 2", "doc 1", "doc 0"]
+        assert self._contents(ranked["tools"]) == ["doc 1", "doc 0", "doc 2"]
+        assert rag.model.pairs == 5
+        stats = rag.rerank_monitor.stats()
+        assert stats["tools"]["decisions"] == {SHRINK: 1}
+        assert stats["tools"]["pairs_saved"] == 2
+
+    def test_skipped_rerank_keeps_vector_order(self):
+        rag = self._rag()
+
+        ranked = rag.rerank("question", {"tools": self._documents([0.9, 0.6, 0.5])})
+
+        assert self._contents(ranked["tools"]) == ["doc 0", "doc 1", "doc 2"]
+        assert rag.model.pairs == 0
+
+    def test_audit_compares_with_a_full_rerank(self):
+        rag = self._rag(audit_rate=1.0)
+
+        ranked = rag.rerank("question", {"tools": self._documents([0.9, 0.6, 0.5])})
+
+        assert self._contents(ranked["tools"]) == ["doc 0", "doc 1", "doc 2"]
+        stats = rag.rerank_monitor.stats()["tools"]
+        assert stats["audits"] == 1
+        assert stats["audit_top1_agreement"] == 0.0
+        assert stats["pairs_scored"] == 0
+
+
+class TestVectorIndexMirror:
+    async def _client(self, vectors: np.ndarray) -> AsyncQdrantClient:
+        client = AsyncQdrantClient(location=":memory:")
+        await client.create_collection(
+            "docs",
+            vectors_config=VectorParams(
+                size=vectors.shape[1], distance=Distance.COSINE
+            ),
+        )
+        await client.upsert(
+            "docs",
+            points=[
+                PointStruct(
+                    id=index, vector=vector.tolist(), payload={"text": f"doc {index}"}
+                )
+                for index, vector in enumerate(vectors)
+            ],
+        )
+        return client
+
+    @pytest.mark.asyncio
+    async def test_local_search_matches_qdrant(self):
+        rng = np.random.default_rng(0)
+        client = await self._client(rng.normal(size=(500, 16)))
+        mirror = VectorIndexMirror(client, ["docs"])
+        await mirror.sync()
+        query = rng.normal(size=16)
+
+        local = mirror.search("docs", query, 10)
+        remote = await client.search("docs", query_vector=query.tolist(), limit=10)
+
+        assert [hit.id for hit in local] == [hit.id for hit in remote]
+        assert np.allclose(
+            [hit.score for hit in local], [hit.score for hit in remote], atol=1e-5
+        )
+        assert mirror.retrieve("docs", [3])[0].payload == {"text": "doc 3"}
+        assert mirror.retrieve("docs", [3, 999]) is None
+
+    @pytest.mark.asyncio
+    async def test_sync_reloads_only_when_points_change(self):
+        rng = np.random.default_rng(1)
+        client = await self._client(rng.normal(size=(20, 8)))
+        mirror = VectorIndexMirror(client, ["docs"])
+        await mirror.sync()
+        await mirror.sync()
+        assert mirror.reloads == 1
+
+        await client.upsert(
+            "docs",
+            points=[PointStruct(id=20, vector=[1.0] * 8, payload={"text": "new"})],
+        )
+        await mirror.sync()
+
+        assert mirror.reloads == 2
+        assert mirror.search("docs", [1.0] * 8, 1)[0].payload == {"text": "new"}
+
+    @pytest.mark.asyncio
+    async def test_rag_falls_back_to_qdrant_for_stale_collections(self):
+        rng = np.random.default_rng(2)
+        client = await self._client(rng.normal(size=(50, 8)))
+        rag = object.__new__(RAG)
+        rag.async_qdrant_client = client
+        rag.search_timeout = 5
+        rag.vector_formats = {}
+        rag.index_mirror = VectorIndexMirror(client, ["docs"])
+        await rag.index_mirror.sync()
+        query = rng.normal(size=8).tolist()
+
+        (local,) = await rag.search_collections(query, ["docs"], [5])
+        await rag.collection_changed("docs")
+        (remote,) = await rag.search_collections(query, ["docs"], [5])
+
+        assert [hit.id for hit in local] == [hit.id for hit in remote]
+        assert rag.index_mirror.local_searches == 1
+        assert rag.index_mirror.fallbacks == 1
+
+
+class TestVectorFormat:
+    def test_truncation_renormalizes_matryoshka_prefix(self):
+        vector_format = VectorFormat(dimensions=256)
+        vectors = np.random.default_rng(0).normal(size=(3, 1024))
+
+        truncated = vector_format.truncate(vectors)
+
+        assert truncated.shape == (3, 256)
+        assert np.allclose(np.linalg.norm(truncated, axis=1), 1)
+        assert np.allclose(
+            truncated[0] * np.linalg.norm(vectors[0, :256]), vectors[0, :256]
+        )
+        assert VectorFormat().truncate(vectors[0]).shape == (1024,)
+
+    def test_storage_picks_qdrant_config(self):
+        assert VectorFormat(storage="float16").vectors_config().datatype == (
+            Datatype.FLOAT16
+        )
+        assert VectorFormat().quantization_config() is None
+        assert VectorFormat().search_params() is None
+        assert isinstance(
+            VectorFormat(storage="int8").quantization_config(), ScalarQuantization
+        )
+        binary = VectorFormat(storage="binary", oversampling=3)
+        assert isinstance(binary.quantization_config(), BinaryQuantization)
+        assert binary.vectors_config().on_disk is True
+        assert binary.search_params().quantization.rescore is True
+        assert binary.search_params().quantization.oversampling == 3
+
+    def test_invalid_formats_are_rejected(self):
+        with pytest.raises(ValueError):
+            VectorFormat(dimensions=300)
+        with pytest.raises(ValueError):
+            formats_from_overrides({"general": {"storage": "int4"}})
+
+    @pytest.mark.asyncio
+    async def test_migration_keeps_ids_and_payloads(self):
+        vectors = np.random.default_rng(1).normal(size=(30, 1024))
+        client = AsyncQdrantClient(location=":memory:")
+        await client.create_collection(
+            "docs",
+            vectors_config=VectorParams(size=1024, distance=Distance.COSINE),
+        )
+        await client.upsert(
+            "docs",
+            points=[
+                PointStruct(
+                    id=index, vector=vector.tolist(), payload={"text": str(index)}
+                )
+                for index, vector in enumerate(vectors)
+            ],
+        )
+        vector_format = VectorFormat(dimensions=256, storage="int8")
+
+        copied = await migrate_collection(
+            client, "docs", "docs_256", vector_format, batch_size=7
+        )
+
+        assert copied == 30
+        info = await client.get_collection("docs_256")
+        assert info.config.params.vectors.size == 256
+        (point,) = await client.retrieve("docs_256", [4], with_vectors=True)
+        assert point.payload == {"text": "4"}
+        assert np.allclose(point.vector, vector_format.truncate(vectors[4]), atol=1e-6)
+        with pytest.raises(ValueError):
+            await migrate_collection(client, "docs_256", "docs_512", VectorFormat(512))
+
+    @pytest.mark.asyncio
+    async def test_rag_truncates_queries_per_collection(self):
+        client = AsyncQdrantClient(location=":memory:")
+        await client.create_collection(
+            "small", vectors_config=VectorParams(size=256, distance=Distance.COSINE)
+        )
+        await client.upsert(
+            "small", points=[PointStruct(id=1, vector=[1.0] * 256, payload={})]
+        )
+        rag = object.__new__(RAG)
+        rag.async_qdrant_client = client
+        rag.search_timeout = 5
+        rag.index_mirror = None
+        rag.vector_formats = {"small": VectorFormat(dimensions=256, storage="binary")}
+
+        (hits,) = await rag.search_collections([1.0] * 1024, ["small"], [5])
+
+        assert [hit.id for hit in hits] == [1]
+
+
+class TestPromptBudgeter:
+    def _word_counter(self) -> TokenCounter:
+        """One token per word so the numbers below are easy to follow"""
+        words = "one two three four five six seven eight . [ truncated ]".split()
+        tokenizer = Tokenizer(
+            WordLevel({word: i for i, word in enumerate(["[UNK]", *words])}, "[UNK]")
+        )
+        tokenizer.pre_tokenizer = Whitespace()
+        return TokenCounter(tokenizer)
+
+    def test_truncate_keeps_start(self):
+        counter = self._word_counter()
+        text = "one two three four five six seven eight"
+
+        assert counter.count(text) == 8
+        assert counter.truncate(text, 8) == text
+        truncated = counter.truncate(text, 7)
+        assert truncated.startswith("one two")
+        assert counter.count(truncated) <= 7
+
+    def test_fit_trims_highest_trim_order_first(self):
+        counter = self._word_counter()
+        budgeter = PromptBudgeter(counter, max_prompt_tokens=30)
+        history = [
+            {"role": "user", "content": "one two"},
+            {"role": "system", "content": "three"},
+            {"role": "user", "content": "four five six"},
+            {"role": "system", "content": "seven eight"},
+        ]
+        vector_content = "one two three four five six"
+
+        fitted = budgeter.fit(
+            [
+                PromptSection("chat_history", history, trim_order=2),
+                PromptSection("vector_content", vector_content, trim_order=1),
+            ],
+            reserved_tokens=4,
+        )
+
+        # Only the oldest turn is dropped, the vector content still fits
+        assert fitted["chat_history"] == history[:2]
+        assert fitted["vector_content"] == vector_content
+
+    def test_fit_shares_cuts_within_trim_order(self):
+        counter = TokenCounter()  # 4 characters per token
+        budgeter = PromptBudgeter(counter, max_prompt_tokens=100)
+        fitted = budgeter.fit(
+            [
+                PromptSection("tool_0", "a" * 400, trim_order=1),
+                PromptSection("tool_1", "b" * 400, trim_order=1),
+            ]
+        )
+
+        assert counter.count(fitted["tool_0"]) + counter.count(fitted["tool_1"]) <= 100
+        assert fitted["tool_0"].startswith("a")
+        assert fitted["tool_1"].startswith("b")
+
+
+class TestToolRenderers:
+    sea_temperature = {
+        "response": {
+            "description": "Daily sea temperature statistics for Cambridge Bay during day: 2024-06-01",
+            "daily_min": -1.5,
+            "daily_max": -0.9,
+            "daily_avg": -1.2,
+        }
+    }
+
+    def test_renders_stats_table(self):
+        answer = render_tool_responses(
+            [("get_daily_sea_temperature_stats_cambridge_bay", self.sea_temperature)],
+            TOOL_RENDERERS,
+        )
+
+        assert "2024-06-01" in answer
+        assert "| Minimum | -1.50 |" in answer
+        assert "| Average | -1.20 |" in answer
+
+    def test_falls_back_without_renderer_or_data(self):
+        # A tool without a renderer needs the LLM for the whole answer
+        assert (
+            render_tool_responses(
+                [
+                    (
+                        "get_daily_sea_temperature_stats_cambridge_bay",
+                        self.sea_temperature,
+                    ),
+                    ("get_oxygen_data_24h", {"response": {"oxygenData": {}}}),
+                ],
+                TOOL_RENDERERS,
+            )
+            is None
+        )
+        # Tool errors and missing values are explained by the LLM
+        assert (
+            render_tool_responses(
+                [("get_ice_thickness", {"response": "Error: Invalid ONC token."})],
+                TOOL_RENDERERS,
+            )
+            is None
+        )
+        assert (
+            render_tool_responses(
+                [
+                    (
+                        "get_wind_speed_at_timestamp",
+                        {"response": {"result": {"wind_speed_m_s": None}}},
+                    )
+                ],
+                TOOL_RENDERERS,
+            )
+            is None
+        )
+        # Malformed responses don't raise
+        assert (
+            render_tool_responses(
+                [("get_ice_thickness", {"response": {"unexpected": 1}})],
+                TOOL_RENDERERS,
+            )
+            is None
+        )
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_computation(self):
+        """Test that callers with the same key wait for the leader's result"""
+        single_flight = SingleFlight()
+        computations = []
+
+        async def compute():
+            computations.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        results = await asyncio.gather(
+            *[single_flight.run("key", compute) for _ in range(5)]
+        )
+
+        assert computations == [1]
+        assert [result for result, _ in results] == ["answer"] * 5
+        assert [is_leader for _, is_leader in results].count(True) == 1
+        assert single_flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+        # Once finished, the next call computes again
+        await single_flight.run("key", compute)
+        assert computations == [1, 1]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        """Test that a leader disconnecting leaves the shared computation running"""
+        single_flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        leader = asyncio.create_task(single_flight.run("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(single_flight.run("key", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+
+        assert await follower == ("answer", False)
+
+    @pytest.mark.asyncio
+    async def test_follower_gets_its_own_token_in_base_url(self, monkeypatch):
+        """Test that the leader's token in a tool's baseUrl is swapped for the follower's"""
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            await asyncio.sleep(0.05)
+            return httpx.Response(
+                200,
+                json={
+                    "sensorData": [
+                        {"data": [{"minimum": -1.6, "maximum": -1.2, "value": -1.4}]}
+                    ]
+                },
+            )
+
+        async_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            httpx,
+            "AsyncClient",
+            lambda: async_client(transport=httpx.MockTransport(handler)),
+        )
+
+        async def compute_conversation(user_prompt, user_onc_token, on_event=None):
+            tool_response = await get_daily_sea_temperature_stats_cambridge_bay(
+                "2024-01-15", user_onc_token
+            )
+            return RunConversationResponse(
+                status=StatusCode.REGULAR_MESSAGE,
+                response=json.dumps(tool_response["response"]),
+                baseUrl=tool_response["baseUrl"],
+                urlParamsUsed=tool_response["urlParamsUsed"],
+            )
+
+        llm = LLM.__new__(LLM)
+        llm.single_flight = SingleFlight()
+        llm.compute_conversation = compute_conversation
+
+        alice, bob = await asyncio.gather(
+            llm.run_conversation("Sea temperature on 2024-01-15?", "ALICE_TOKEN"),
+            llm.run_conversation("Sea temperature on 2024-01-15?", "BOB_TOKEN"),
+        )
+
+        assert alice.baseUrl.endswith("token=ALICE_TOKEN")
+        assert bob.baseUrl.endswith("token=BOB_TOKEN")
+        assert "ALICE_TOKEN" not in bob.model_dump_json()
+        assert llm.single_flight.stats()["followers"] == 1
+
+    def test_normalize_prompt(self):
+        """Test that case, punctuation and spacing don't change the key"""
+        assert normalize_prompt("What is  Cambridge Bay?") == normalize_prompt(
+            "what is cambridge bay"
+        )
+        assert normalize_prompt("ice in 2024") != normalize_prompt("ice in 2023")
+
+
+def fake_groq_endpoint(name: str, delay: float = 0.0, status_code: int = 200):
+    """An endpoint whose client talks to an in-process fake chat completions server"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(delay)
+        if status_code != 200:
+            return httpx.Response(status_code, json={"error": {"message": "down"}})
+        return httpx.Response(
+            200,
+            json={
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": json.loads(request.content)["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": name},
+                        "finish_reason": "stop",
+                    }
+                ],
+            },
+        )
+
+    client = AsyncGroq(
+        api_key="test",
+        base_url=f"http://{name}",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    return LLMEndpoint(
+        name=name, client=client, breaker=CircuitBreaker(failure_threshold=2)
+    )
+
+
+async def ask(gateway: LLMGateway) -> str:
+    response = await gateway.chat.completions.create(
+        model="llama", messages=[{"role": "user", "content": "hi"}]
+    )
+    return response.choices[0].message.content
+
+
+class TestLLMGateway:
+    @pytest.mark.asyncio
+    async def test_slow_endpoint_is_hedged(self):
+        """Test that a second endpoint answers when the first is slower than the hedge delay"""
+        gateway = LLMGateway(
+            [fake_groq_endpoint("slow", delay=1.0), fake_groq_endpoint("fast")],
+            initial_hedge_delay=0.05,
+        )
+
+        assert await ask(gateway) == "fast"
+        assert gateway.hedges == 1
+
+    @pytest.mark.asyncio
+    async def test_fast_endpoint_is_not_hedged(self):
+        """Test that an endpoint answering within the hedge delay gets no hedge"""
+        gateway = LLMGateway(
+            [fake_groq_endpoint("primary"), fake_groq_endpoint("secondary")],
+            initial_hedge_delay=1.0,
+        )
+
+        assert await ask(gateway) == "primary"
+        assert gateway.hedges == 0
+        assert gateway.endpoints[1].requests == 0
+
+    @pytest.mark.asyncio
+    async def test_failing_endpoint_fails_over_and_opens_circuit(self):
+        """Test that server errors fail over and the breaker stops using the endpoint"""
+        gateway = LLMGateway(
+            [
+                fake_groq_endpoint("broken", status_code=503),
+                fake_groq_endpoint("backup"),
+            ]
+        )
+
+        for _ in range(3):
+            assert await ask(gateway) == "backup"
+
+        broken = gateway.endpoints[0]
+        assert broken.breaker.state == "open"
+        # The third request skipped the open circuit
+        assert broken.requests == 2
+        assert gateway.failovers == 2
+
+    @pytest.mark.asyncio
+    async def test_bad_request_is_not_retried(self):
+        """Test that a request the endpoint rejects isn't sent to the next endpoint"""
+        gateway = LLMGateway(
+            [fake_groq_endpoint("strict", status_code=400), fake_groq_endpoint("other")]
+        )
+
+        with pytest.raises(BadRequestError):
+            await ask(gateway)
+        assert gateway.endpoints[1].requests == 0
+        assert gateway.endpoints[0].breaker.state == "closed"
+
+    @pytest.mark.asyncio
+    async def test_hedge_delay_is_kept_per_route(self):
+        """Test that a slow route's latencies don't stretch the hedge delay of a fast one"""
+        gateway = LLMGateway(
+            [fake_groq_endpoint("primary"), fake_groq_endpoint("secondary")],
+            initial_hedge_delay=1.0,
+            min_latency_samples=5,
+        )
+        primary = gateway.endpoints[0]
+        primary.latencies["answer"].extend([3.0] * 5)
+
+        with llm_route("keep_context"):
+            for _ in range(5):
+                await ask(gateway)
+
+        assert gateway.hedge_delay(primary, "answer") == 3.0
+        assert gateway.hedge_delay(primary, "keep_context") == gateway.min_hedge_delay
+        assert gateway.hedge_delay(primary, "conversational") == 1.0
+        assert set(gateway.stats()["endpoints"][0]["hedge_delay_seconds"]) == {
+            "answer",
+            "keep_context",
+        }
+
+    @pytest.mark.asyncio
+    async def test_endpoints_replace_the_plain_client(self, monkeypatch):
+        """Test that configured endpoints are used instead of a plain Groq client"""
+        monkeypatch.setenv(
+            "LLM_ENDPOINTS", json.dumps([{"name": "groq"}, {"name": "groq-backup"}])
+        )
+        env = Environment()
+
+        assert isinstance(env.async_client, LLMGateway)
+        assert [endpoint.name for endpoint in env.async_client.endpoints] == [
+            "groq",
+            "groq-backup",
+        ]
+        await env.close()
+
+    def test_endpoint_without_api_key_is_rejected(self, monkeypatch):
+        """Test that an endpoint whose api_key_env isn't set fails at startup"""
+        monkeypatch.delenv("GROQ_BACKUP_API_KEY", raising=False)
+        monkeypatch.setenv(
+            "LLM_ENDPOINTS",
+            json.dumps(
+                [
+                    {"name": "groq"},
+                    {"name": "backup", "api_key_env": "GROQ_BACKUP_API_KEY"},
+                ]
+            ),
+        )
+
+        with pytest.raises(ValueError, match="GROQ_BACKUP_API_KEY"):
+            Environment()
+
+
+class TestModelRouter:
+    def _usage(self, completion_tokens: int) -> CompletionUsage:
+        return CompletionUsage(
+            prompt_tokens=100,
+            completion_tokens=completion_tokens,
+            total_tokens=100 + completion_tokens,
+        )
+
+    def test_cheap_routes_use_small_model(self):
+        router = ModelRouter()
+
+        assert router.request_options("keep_context") == {
+            "model": SMALL_MODEL,
+            "max_completion_tokens": 1,
+        }
+        assert router.request_options("conversational")["model"] == SMALL_MODEL
+        assert router.request_options("tool_selection")["model"] == LARGE_MODEL
+        assert router.request_options("answer")["model"] == LARGE_MODEL
+
+    def test_overrides_keep_route_defaults(self):
+        router = ModelRouter.from_overrides({"conversational": {"model": LARGE_MODEL}})
+
+        assert router.request_options("conversational") == {
+            "model": LARGE_MODEL,
+            "max_completion_tokens": 256,
+        }
+
+    def test_completion_limit_adapts_to_observed_lengths(self):
+        router = ModelRouter(min_samples=10, headroom=1.5)
+        for _ in range(9):
+            router.record("answer", 0.5, self._usage(1000), "stop")
+        assert router.completion_token_limit("answer") == 4096
+
+        router.record("answer", 0.5, self._usage(1000), "stop")
+        assert router.completion_token_limit("answer") == 1500
+
+        stats = router.stats()["answer"]
+        assert stats["calls"] == 10
+        assert stats["completion_tokens"] == 10000
+        assert stats["max_completion_tokens"] == 1500
+        assert stats["latency_p50_seconds"] == 0.5
+
+    def test_truncated_answer_keeps_adapting(self):
+        router = ModelRouter(min_samples=1)
+        router.record("answer", 0.5, self._usage(1000), "stop")
+        assert router.completion_token_limit("answer") == 1500
+
+        router.record("answer", 0.5, self._usage(1500), "length")
+        router.record("answer", 0.5, self._usage(4096), "stop")
+        for _ in range(500):
+            router.record("answer", 0.5, self._usage(1000), "stop")
+
+        assert router.completion_token_limit("answer") == 1500
+        assert router.stats()["answer"]["truncated"] == 1
+
+    @pytest.mark.asyncio
+    async def test_truncated_completion_is_retried_with_full_limit(self):
+        limits = []
+
+        class TruncatingCompletions:
+            async def create(self, **kwargs):
+                limits.append(kwargs["max_completion_tokens"])
+                completion = chat_completion("An answer")
+                if kwargs["max_completion_tokens"] < 4096:
+                    completion.choices[0].finish_reason = "length"
+                return completion
+
+        llm = LLM.__new__(LLM)
+        llm.model_router = ModelRouter(min_samples=1)
+        llm.llm_semaphore = asyncio.Semaphore(1)
+        llm.async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=TruncatingCompletions())
+        )
+        llm.model_router.record("answer", 0.5, self._usage(1000), "stop")
+
+        response = await llm.create_chat_completion("answer", messages=[])
+
+        assert response.choices[0].finish_reason == "stop"
+        assert limits == [1500, 4096]
+
+
+def chat_completion(
+    content: str = "", tool_names: tuple[str, ...] = ()
+) -> ChatCompletion:
+    """A Groq completion with the given tool calls, using 10 prompt and 2 completion tokens"""
+    return ChatCompletion.model_validate(
+        {
+            "id": "chatcmpl-1",
+            "object": "chat.completion",
+            "created": 0,
+            "model": LARGE_MODEL,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": content,
+                        "tool_calls": [
+                            {
+                                "id": f"call-{name}",
+                                "type": "function",
+                                "function": {"name": name, "arguments": "{}"},
+                            }
+                            for name in tool_names
+                        ]
+                        or None,
+                    },
+                    "finish_reason": "tool_calls" if tool_names else "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+        }
+    )
+
+
+class ScriptedLLM:
+    """Picks get_ice_thickness for prompts about ice, then answers, without calling Groq"""
+
+    async def create_chat_completion(self, route: str, **kwargs) -> ChatCompletion:
+        if route == "tool_selection":
+            prompt = kwargs["messages"][-1]["content"]
+            return chat_completion(
+                tool_names=("get_ice_thickness",) if "ice" in prompt else ()
+            )
+        return chat_completion("An answer")
+
+    async def run_conversation(
+        self, user_prompt: str, user_onc_token: str, chat_history: list[dict] = []
+    ) -> RunConversationResponse:
+        messages = [{"role": "user", "content": user_prompt}]
+        await self.create_chat_completion("tool_selection", messages=messages)
+        answer = await self.create_chat_completion("answer", messages=messages)
+        return RunConversationResponse(
+            status=StatusCode.REGULAR_MESSAGE,
+            response=answer.choices[0].message.content,
+        )
+
+
+class TestBatchEval:
+    corpus = [
+        {
+            "id": "ice",
+            "user_prompt": "How thick was the ice?",
+            "expected_tools": ["get_ice_thickness"],
+            "expected_status": "REGULAR_MESSAGE",
+        },
+        {
+            "id": "wind",
+            "user_prompt": "How windy was it?",
+            "expected_tools": ["get_scalar_data"],
+        },
+    ]
+
+    @pytest.mark.asyncio
+    async def test_items_record_their_completions(self):
+        llm = ScriptedLLM()
+        create_chat_completion = llm.create_chat_completion
+
+        results = await run_eval(llm, self.corpus, concurrency=2, user_onc_token="t")
+
+        ice, wind = results
+        assert ice.tools_called == ["get_ice_thickness"]
+        assert (ice.llm_calls, ice.prompt_tokens, ice.completion_tokens) == (2, 20, 4)
+        assert ice.passed
+        assert wind.tools_called == []
+        assert not wind.passed
+        assert llm.create_chat_completion == create_chat_completion
+
+    @pytest.mark.asyncio
+    async def test_repeated_runs_are_not_counted_twice(self):
+        llm = ScriptedLLM()
+        await run_eval(llm, self.corpus, concurrency=1, user_onc_token="t")
+
+        results = await run_eval(llm, self.corpus, concurrency=1, user_onc_token="t")
+        summary = build_report(results, elapsed=1.0)["summary"]
+
+        assert summary["items"] == 2
+        assert summary["tool_accuracy"] == 0.5
+        assert summary["status_accuracy"] == 1.0
+        assert summary["statuses"] == {"REGULAR_MESSAGE": 2}
+        assert summary["prompt_tokens_mean"] == 20
+        assert summary["llm_calls_mean"] == 2
+
+
+class EchoCompletions:
+    """Answers every completion with the content of its last message"""
+
+    async def create(self, **kwargs) -> ChatCompletion:
+        return chat_completion(kwargs["messages"][-1]["content"])
+
+
+class CassetteLLM:
+    """Makes the Groq, Qdrant and ONC calls of a conversation through the attributes install() wraps"""
+
+    def __init__(self, async_client=None, qdrant_client=None):
+        self.async_client = async_client
+        self.RAG_instance = SimpleNamespace(
+            async_qdrant_client=qdrant_client, index_mirror=None
+        )
+        self.available_functions = {"get_ice_thickness": fake_ice_thickness}
+
+    async def create_chat_completion(self, route: str, **kwargs) -> ChatCompletion:
+        # Same settings on every route, as MODEL_ROUTES can make them
+        return await self.async_client.chat.completions.create(
+            model=LARGE_MODEL, max_completion_tokens=64, **kwargs
+        )
+
+    async def stream_chat_completion(self, on_event, route: str, **kwargs) -> str:
+        raise NotImplementedError
+
+    async def run_conversation(self, user_prompt: str, user_onc_token: str) -> list:
+        async def ask(route: str, content: str) -> str:
+            response = await self.create_chat_completion(
+                route, messages=[{"role": "user", "content": content}]
+            )
+            return response.choices[0].message.content
+
+        hits = await self.RAG_instance.async_qdrant_client.search(
+            collection_name="general", query_vector=[1.0, 0.0], limit=1
+        )
+        thickness = await self.available_functions["get_ice_thickness"](
+            date_from_str="2024-01-01",
+            date_to_str="2024-02-01",
+            user_onc_token=user_onc_token,
+        )
+        return [
+            await ask("keep_context", "related"),
+            await ask("conversational", "small talk"),
+            await ask("answer", user_prompt),
+            hits[0].payload["text"],
+            thickness,
+        ]
+
+
+class TestReplay:
+    @pytest.mark.asyncio
+    async def test_recorded_conversation_replays(self, tmp_path):
+        qdrant_client = AsyncQdrantClient(location=":memory:")
+        await qdrant_client.create_collection(
+            "general", vectors_config=VectorParams(size=2, distance=Distance.COSINE)
+        )
+        await qdrant_client.upsert(
+            "general",
+            points=[PointStruct(id=1, vector=[1.0, 0.0], payload={"text": "Ice doc"})],
+        )
+        recording_llm = CassetteLLM(
+            SimpleNamespace(chat=SimpleNamespace(completions=EchoCompletions())),
+            qdrant_client,
+        )
+        cassette = Cassette()
+        install(recording_llm, cassette, mode="record")
+        with replay_scope("ice"):
+            recorded = await recording_llm.run_conversation("Ice?", "secret-token")
+        path = tmp_path / "cassette.json"
+        cassette.save(path)
+
+        replaying_llm = CassetteLLM()
+        install(
+            replaying_llm,
+            Cassette.load(path),
+            mode="replay",
+            latency=ReplayLatency(scale=0),
+        )
+        with replay_scope("ice"):
+            replayed = await replaying_llm.run_conversation("Ice?", "other-token")
+
+        # Keyed by route, although every route has the same settings
+        assert set(cassette.recordings["ice"]) >= {
+            "groq:keep_context#0",
+            "groq:conversational#0",
+            "groq:answer#0",
+            "qdrant:search:general#0",
+        }
+        assert replayed[:4] == ["related", "small talk", "Ice?", "Ice doc"]
+        assert replayed[:4] == recorded[:4]
+        assert replayed[4]["urlParamsUsed"]["token"] == "other-token"
+        assert "secret-token" not in path.read_text()
+        await qdrant_client.close()
+
+    @pytest.mark.asyncio
+    async def test_missing_recording_is_reported(self):
+        llm = CassetteLLM()
+        install(llm, Cassette(), mode="replay")
+
+        with replay_scope("unknown"), pytest.raises(ReplayMissError):
+            await llm.run_conversation("Ice?", "token")
+
+
+def onc_run_client(responses: list[httpx.Response], requests: list[httpx.Request]):
+    """An HTTP client answering ONC run calls with the given responses, the last one repeats"""
+    remaining = list(responses)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return remaining.pop(0) if len(remaining) > 1 else remaining[0]
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class TestDataProductOrders:
+    async def _order_message(self, client: AsyncClient, headers: dict) -> dict:
+        """Sends a message the mock LLM answers with a data product order (dpRequestId 42)"""
+        conv_id = (
+            await client.post("/llm/conversations", json={}, headers=headers)
+        ).json()["conversation_id"]
+        return (
+            await client.post(
+                "/llm/messages",
+                json={"input": "download scalar data", "conversation_id": conv_id},
+                headers=headers,
+            )
+        ).json()
+
+    def _poller(
+        self, async_session: AsyncSession, http_client, default_onc_token=None
+    ) -> OrderPoller:
+        @asynccontextmanager
+        async def session_factory():
+            yield async_session
+
+        return OrderPoller(
+            session_factory,
+            http_client,
+            "https://onc.test/api",
+            initial_delay=0,
+            max_delay=0,
+            default_onc_token=default_onc_token,
+        )
+
+    @pytest.mark.asyncio
+    async def test_order_status_endpoint(self, client: AsyncClient, user_headers: dict):
+        """Test that an order placed by a message is reported as submitted"""
+        msg = await self._order_message(client, user_headers)
+        assert msg["request_id"] == 42
+        assert msg["order_status"] == "submitted"
+
+        resp = await client.get(
+            f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json() == {
+            "request_id": 42,
+            "status": "submitted",
+            "file_count": None,
+            "download_urls": [],
+        }
+
+    @pytest.mark.asyncio
+    async def test_message_without_order(self, client: AsyncClient, user_headers: dict):
+        """Test that a message without a data product order has no order status"""
+        conv_id = (
+            await client.post("/llm/conversations", json={}, headers=user_headers)
+        ).json()["conversation_id"]
+        msg = (
+            await client.post(
+                "/llm/messages",
+                json={"input": "Hi LLM", "conversation_id": conv_id},
+                headers=user_headers,
+            )
+        ).json()
+
+        resp = await client.get(
+            f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+        )
+        assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+    @pytest.mark.asyncio
+    async def test_order_stream_without_poller(
+        self, client: AsyncClient, user_headers: dict
+    ):
+        """Test that the stream sends the stored status and ends when nothing polls the order"""
+        msg = await self._order_message(client, user_headers)
+
+        resp = await client.get(
+            f"/llm/messages/{msg['message_id']}/order/stream", headers=user_headers
+        )
+        assert resp.status_code == status.HTTP_200_OK
+        event, data = resp.text.strip().split("\n")
+        assert event == "event: order"
+        assert json.loads(data.removeprefix("data: "))["status"] == "submitted"
+
+    @pytest.mark.asyncio
+    async def test_poller_records_completed_order(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that the poller follows an order to completion and stores its download links"""
+        msg = await self._order_message(client, user_headers)
+        requests = []
+        poller = self._poller(
+            async_session,
+            onc_run_client(
+                [
+                    httpx.Response(202, json=[{"dpRunId": 7, "status": "queued"}]),
+                    httpx.Response(202, json=[{"dpRunId": 7, "status": "running"}]),
+                    httpx.Response(
+                        200,
+                        json=[{"dpRunId": 7, "status": "complete", "fileCount": 2}],
+                    ),
+                ],
+                requests,
+            ),
+        )
+
+        poller.track(msg["message_id"], 42, "onc-token")
+        updates = poller.subscribe(msg["message_id"])
+        await poller.tasks[msg["message_id"]]
+
+        statuses = [updates.get_nowait().status for _ in range(updates.qsize())]
+        assert statuses == ["queued", "running", "complete"]
+        assert requests[0].url.params["dpRequestId"] == "42"
+        assert not poller.is_tracking(msg["message_id"])
+
+        order = (
+            await client.get(
+                f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+            )
+        ).json()
+        assert order["status"] == "complete"
+        assert order["file_count"] == 2
+        assert order["download_urls"] == [
+            "https://onc.test/api/dataProductDelivery/download?dpRunId=7&index=1",
+            "https://onc.test/api/dataProductDelivery/download?dpRunId=7&index=2",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_poller_retries_after_unexpected_error(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that a response that isn't JSON is counted and polled again, not fatal"""
+        msg = await self._order_message(client, user_headers)
+        requests = []
+        poller = self._poller(
+            async_session,
+            onc_run_client(
+                [
+                    httpx.Response(200, text="<html>Maintenance</html>"),
+                    httpx.Response(
+                        200,
+                        json=[{"dpRunId": 7, "status": "complete", "fileCount": 1}],
+                    ),
+                ],
+                requests,
+            ),
+        )
+
+        poller.track(msg["message_id"], 42, "onc-token")
+        await poller.tasks[msg["message_id"]]
+
+        assert len(requests) == 2
+        assert poller.errors == 1
+        order = (
+            await client.get(
+                f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+            )
+        ).json()
+        assert order["status"] == "complete"
+
+    @pytest.mark.asyncio
+    async def test_poller_retries_failed_save(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that a database error while saving is retried after the back-off"""
+        msg = await self._order_message(client, user_headers)
+        poller = self._poller(
+            async_session,
+            onc_run_client(
+                [httpx.Response(200, json=[{"dpRunId": 7, "status": "complete"}])],
+                [],
+            ),
+        )
+        save = poller.save
+        failures = [RuntimeError("database is locked")]
+
+        async def flaky_save(message_id, order):
+            if failures:
+                raise failures.pop()
+            return await save(message_id, order)
+
+        poller.save = flaky_save
+
+        poller.track(msg["message_id"], 42, "onc-token")
+        await poller.tasks[msg["message_id"]]
+
+        assert poller.errors == 1
+        order = (
+            await client.get(
+                f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+            )
+        ).json()
+        assert order["status"] == "complete"
+
+    @pytest.mark.asyncio
+    async def test_poller_stops_on_rejected_order(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that an order ONC rejects is marked as an error without polling again"""
+        msg = await self._order_message(client, user_headers)
+        requests = []
+        poller = self._poller(
+            async_session,
+            onc_run_client([httpx.Response(401, json={"errors": []})], requests),
+        )
+
+        poller.track(msg["message_id"], 42, "bad-token")
+        await poller.tasks[msg["message_id"]]
+
+        assert len(requests) == 1
+        order = (
+            await client.get(
+                f"/llm/messages/{msg['message_id']}/order", headers=user_headers
+            )
+        ).json()
+        assert order["status"] == "error"
+
+    @pytest.mark.asyncio
+    async def test_poller_resumes_outstanding_orders(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that orders still outstanding at startup are polled again"""
+        msg = await self._order_message(client, user_headers)
+        requests = []
+        poller = self._poller(
+            async_session,
+            onc_run_client(
+                [
+                    httpx.Response(
+                        200,
+                        json=[{"dpRunId": 7, "status": "complete", "fileCount": 1}],
+                    )
+                ],
+                requests,
+            ),
+        )
+
+        await poller.resume()
+        assert poller.is_tracking(msg["message_id"])
+        await poller.tasks[msg["message_id"]]
+
+        assert requests[0].url.params["token"] == get_settings().ONC_TOKEN
+        # Finished orders aren't picked up again
+        await poller.resume()
+        assert not poller.is_tracking(msg["message_id"])
+
+    @pytest.mark.asyncio
+    async def test_resumed_order_without_user_token_uses_default(
+        self, client: AsyncClient, user_headers: dict, async_session: AsyncSession
+    ):
+        """Test that a resumed order of a user without an ONC token uses the server token"""
+        msg = await self._order_message(client, user_headers)
+        user = (
+            await async_session.execute(select(User).where(User.username == "testuser"))
+        ).scalar_one()
+        user.onc_token = ""
+        await async_session.commit()
+        requests = []
+        poller = self._poller(
+            async_session,
+            onc_run_client(
+                [httpx.Response(200, json=[{"dpRunId": 7, "status": "complete"}])],
+                requests,
+            ),
+            default_onc_token="server-token",
+        )
+
+        await poller.resume()
+        await poller.tasks[msg["message_id"]]
+
+        assert requests[0].url.params["token"] == "server-token"